@@ -0,0 +1,47 @@
+import os
+import json
+import time
+from typing import Any, AsyncIterator, Callable, List, Optional
+from fastapi.encoders import jsonable_encoder
+from langchain_core.runnables import Runnable, RunnableLambda
+
+# --- CONFIGURATION ---
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))  # items in flight per batch request
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "5000"))
+
+
+def _timed(runnable: Runnable, to_result: Callable[[Any], Any]) -> Runnable:
+    """Wrap a runnable so each item reports its own wall time alongside the result."""
+    async def run(item):
+        start = time.perf_counter()
+        result = to_result(await runnable.ainvoke(item))
+        return result, round(time.perf_counter() - start, 3)
+    return RunnableLambda(run)
+
+async def stream_batch(runnable: Runnable, items: List[Any], to_result: Callable[[Any], Any] = lambda r: r,
+                       max_concurrency: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Run items through `runnable.abatch_as_completed` and yield one NDJSON line per item
+    as it finishes, in completion order, followed by a summary line. A failing item
+    produces an {"index", "error"} line instead of failing the batch.
+    """
+    concurrency = min(max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    start = time.perf_counter()
+    failed = 0
+    async for index, output in _timed(runnable, to_result).abatch_as_completed(
+        items, config={"max_concurrency": concurrency}, return_exceptions=True
+    ):
+        elapsed = round(time.perf_counter() - start, 3)
+        if isinstance(output, Exception):
+            failed += 1
+            line = {"index": index, "error": str(output) or type(output).__name__, "completed_at": elapsed}
+        else:
+            result, seconds = output
+            line = {"index": index, "result": jsonable_encoder(result), "seconds": seconds, "completed_at": elapsed}
+        yield json.dumps(line) + "\n"
+    yield json.dumps({
+        "done": True,
+        "count": len(items),
+        "failed": failed,
+        "seconds": round(time.perf_counter() - start, 3),
+    }) + "\n"
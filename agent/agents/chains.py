@@ -0,0 +1,55 @@
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+from pydantic import BaseModel
+
+
+def text_chain(system_prompt: str, model, user_template: str = "{input}") -> Runnable:
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("user", user_template)
+    ])
+    return prompt | model | StrOutputParser()
+
+def structured_chain(system_prompt: Optional[str], model, schema: Type[BaseModel], user_template: str = "{input}") -> Runnable:
+    messages = [("system", system_prompt)] if system_prompt else []
+    prompt = ChatPromptTemplate.from_messages(messages + [("user", user_template)])
+    return prompt | model.with_structured_output(schema)
+
+
+class ChainRegistry:
+    """
+    Prompt/model chains built once and reused by every request. Each entry reads its
+    model through a getter, so overriding the pooled model (tests, benchmarks) rebuilds
+    the chain on next use instead of serving one bound to the old model.
+    """
+
+    def __init__(self):
+        self._builders: Dict[str, Tuple[Callable[[], Any], Callable[[Any], Runnable]]] = {}
+        self._chains: Dict[str, Tuple[Any, Runnable]] = {}
+        self.stats = {"builds": 0, "hits": 0}
+
+    def register(self, name: str, model: Callable[[], Any], build: Callable[[Any], Runnable]):
+        self._builders[name] = (model, build)
+        self._chains.pop(name, None)
+
+    def get(self, name: str) -> Runnable:
+        get_model, build = self._builders[name]
+        model = get_model()
+        cached = self._chains.get(name)
+        if cached is not None and cached[0] is model:
+            self.stats["hits"] += 1
+            return cached[1]
+        chain = build(model)
+        self._chains[name] = (model, chain)
+        self.stats["builds"] += 1
+        return chain
+
+    def warm(self):
+        """Build every registered chain up front, e.g. at application startup."""
+        for name in self._builders:
+            self.get(name)
+
+
+chain_registry = ChainRegistry()
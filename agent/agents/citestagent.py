@@ -1,44 +1,87 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from pydantic import BaseModel
 import dotenv
-from typing import Any, TypedDict
+from functools import lru_cache
+from typing import Any, NotRequired, TypedDict
+from agents.logreducer import reduce_text
+from agents.failuresignature import FailureSignature, extract_signature, signature_cache
+from agents.workerpool import run_blocking
+from agents.clients import clients
+from agents.tracing import traced_graph, event
+from agents.chains import chain_registry, structured_chain
 
 dotenv.load_dotenv()
 
 EXPLANATION_PROMPT = """You are an expert CI test log analyst. Given a CI job log, provide a concise 1-2 sentence explanation of why the job failed. Do not classify as flaky or not, just explain the failure.
 
 Output format (JSON):
-{
+{{
   "explanation": "1-2 sentences explaining the failure"
-}
+}}
 """
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+LLM_MODEL = "gemini-2.5-flash"
+
+def get_llm():
+    return clients.chat(LLM_MODEL)
 
 class CILogInput(TypedDict):
     log_text: str
+    account_id: NotRequired[str]  # installation account and repo the job ran for; cached explanations are scoped to them
+    repo: NotRequired[str]
+
+class CILogState(CILogInput, total=False):
+    log_excerpt: str  # Bounded excerpt of the log; set up front when the upload was reduced while streaming
+    log_stats: dict
+    signature: FailureSignature
+    signature_match: str  # "exact", "near" or "miss"
+    explanation: str
 
 class CILogAnalysis(BaseModel):
     explanation: str
 
-def explain_failure_node(state: CILogInput) -> dict[str, Any]:
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", EXPLANATION_PROMPT),
-        ("user", "{input}")
-    ])
-    structured_llm = llm.with_structured_output(CILogAnalysis)
-    chain = prompt | structured_llm
-    result = chain.invoke({"input": state["log_text"]})
+chain_registry.register("citest.explain", get_llm, lambda model: structured_chain(EXPLANATION_PROMPT, model, CILogAnalysis))
+
+async def reduce_log_node(state: CILogState) -> dict[str, Any]:
+    if state.get("log_excerpt"):
+        return {}
+    excerpt, stats = await run_blocking(reduce_text, state["log_text"])
+    print(f"✂️ Reduced CI log from {stats['chars']} to {len(excerpt)} chars ({stats['windows']} error windows)")
+    return {"log_excerpt": excerpt, "log_stats": stats}
+
+async def match_signature_node(state: CILogState) -> dict[str, Any]:
+    # The same flaky test or broken dependency fails hundreds of jobs the same way
+    signature = await run_blocking(extract_signature, state["log_excerpt"])
+    entry, match = signature_cache.get(signature, state.get("account_id") or "", state.get("repo") or "")
+    update = {"signature": signature, "signature_match": match}
+    event("cache", cache="ci_signature", result=match)
+    if entry is not None:
+        print(f"♻️ CI failure signature {match} match ({entry['error_class'] or entry['key'][:12]}, seen {entry['count']} times)")
+        update["explanation"] = entry["explanation"]
+    return update
+
+def route_after_match(state: CILogState) -> str:
+    return END if state.get("explanation") else "explain_failure"
+
+async def explain_failure_node(state: CILogState) -> dict[str, Any]:
+    chain = chain_registry.get("citest.explain")
+    result = await chain.ainvoke({"input": state["log_excerpt"]})
     if isinstance(result, dict):
         result = CILogAnalysis(**result)
+    signature_cache.put(state["signature"], result.explanation, state.get("account_id") or "", state.get("repo") or "")
     return result.model_dump()
 
 def build_citest_agent_graph():
-    builder = StateGraph(CILogInput)
+    builder = StateGraph(CILogState)
+    builder.add_node("reduce_log", reduce_log_node)
+    builder.add_node("match_signature", match_signature_node)
     builder.add_node("explain_failure", explain_failure_node)
-    builder.set_entry_point("explain_failure")
+    builder.set_entry_point("reduce_log")
+    builder.add_edge("reduce_log", "match_signature")
+    builder.add_conditional_edges("match_signature", route_after_match, ["explain_failure", END])
     builder.add_edge("explain_failure", END)
-    return builder.compile() 
\ No newline at end of file
+    return builder.compile()
+
+@lru_cache(maxsize=None)
+def get_citest_agent_graph():
+    return traced_graph(build_citest_agent_graph(), "citest")
@@ -0,0 +1,86 @@
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable
+from dotenv import load_dotenv
+from agents.tracing import TracedEmbeddings
+from agents.embedder import Embedder, EMBED_BATCH_SIZE
+
+load_dotenv()
+
+# --- CONFIGURATION ---
+MONGODB_URI = os.environ.get("MONGODB_URI")
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", "5000"))  # server selection timeout for readiness checks
+
+
+class ClientPool:
+    """
+    Model, embedding and database clients shared by every agent and created on first
+    use, so importing the service neither pays for the SDK imports nor needs MongoDB
+    to be reachable. One client exists per distinct configuration (e.g. per Gemini
+    model and temperature). `override(kind, instance)` swaps in a stand-in for every
+    client of that kind (tests, benchmarks).
+    """
+
+    def __init__(self):
+        self._clients: Dict[Hashable, Any] = {}
+        self._overrides: Dict[str, Any] = {}
+        self._lock = threading.RLock()  # factories may build the clients they depend on
+        self.stats = {"created": 0, "init_seconds": {}}
+
+    def get(self, kind: str, key: Hashable, factory: Callable[[], Any]):
+        if kind in self._overrides:
+            return self._overrides[kind]
+        client = self._clients.get((kind, key))
+        if client is not None:
+            return client
+        with self._lock:
+            # Another thread may have built it while this one waited
+            client = self._clients.get((kind, key))
+            if client is None:
+                start = time.perf_counter()
+                client = factory()
+                self._clients[(kind, key)] = client
+                self.stats["created"] += 1
+                self.stats["init_seconds"][f"{kind}:{key}"] = round(time.perf_counter() - start, 3)
+        return client
+
+    def chat(self, model: str, temperature: float = None):
+        def build():
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            kwargs = {} if temperature is None else {"temperature": temperature}
+            return ChatGoogleGenerativeAI(model=model, **kwargs)
+        return self.get("chat", (model, temperature), build)
+
+    def embeddings(self, model: str):
+        def build():
+            from langchain_voyageai import VoyageAIEmbeddings
+            # The Embedder sends batches no bigger than this, so the SDK doesn't split them again
+            return VoyageAIEmbeddings(model=model, batch_size=EMBED_BATCH_SIZE)
+        inner = self.get("embeddings", model, build)
+        # Embedding calls emit no LangChain callbacks, so every client (stand-ins too) is wrapped for tracing,
+        # then batched, paced and retried per API call
+        traced = self.get("traced_embeddings", (model, id(inner)), lambda: TracedEmbeddings(inner, model))
+        return self.get("embedder", (model, id(traced)), lambda: Embedder(traced, model))
+
+    def mongo(self):
+        def build():
+            from pymongo import MongoClient
+            return MongoClient(MONGODB_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+        return self.get("mongo", MONGODB_URI, build)
+
+    def override(self, kind: str, instance):
+        self._overrides[kind] = instance
+
+    def reset(self):
+        """Drop every client and override; the next use builds fresh ones."""
+        with self._lock:
+            self._clients.clear()
+            self._overrides.clear()
+
+    def summary(self) -> dict:
+        return {**self.stats, "clients": sorted(f"{kind}:{key}" for kind, key in self._clients),
+                "overrides": sorted(self._overrides)}
+
+
+clients = ClientPool()
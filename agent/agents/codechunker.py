@@ -0,0 +1,271 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+# --- CONFIGURATION ---
+# Chunks below this size are merged into a neighbour even when that joins two symbols
+SYNTAX_MIN_CHUNK_CHARS = int(os.environ.get("SYNTAX_MIN_CHUNK_CHARS", "300"))
+MAX_NESTING = 4  # classes inside classes etc.; deeper oversized bodies are split by lines
+
+LANGUAGES = {
+    ".py": "python", ".pyi": "python",
+    ".ts": "typescript", ".tsx": "typescript", ".mts": "typescript", ".cts": "typescript",
+    ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript",
+    ".go": "go",
+    ".java": "java",
+}
+
+# Strings and comments are matched whole so brackets inside them are not counted
+_PY_TOKENS = re.compile(r'''"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|\#[^\n]*|[()\[\]{}]|\n''')
+_C_TOKENS = re.compile(r'''/\*[\s\S]*?\*/|//[^\n]*|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`|[()\[\]{}]|\n''')
+
+_MODIFIERS = r"(?:(?:export|default|declare|public|private|protected|static|final|abstract|readonly|async|override|synchronized|native|sealed|get|set)\s+)*"
+_PY_DECLARATION = re.compile(r"(?:async\s+)?(?:def|class)\s+([A-Za-z_]\w*)")
+_JS_DECLARATIONS = [
+    re.compile(_MODIFIERS + r"(?:function\*?|class|interface|type|enum|namespace)\s+([A-Za-z_$][\w$]*)"),
+    re.compile(_MODIFIERS + r"(?:const|let|var)\s+([A-Za-z_$][\w$]*)"),
+]
+_JAVA_TYPE = re.compile(_MODIFIERS + r"(?:class|interface|enum|record|@interface)\s+([A-Za-z_]\w*)")
+# Declarations that open a module or file
+_SYMBOLS = {
+    "python": [_PY_DECLARATION, re.compile(r"([A-Za-z_]\w*)\s*(?::[^=]+)?=(?!=)")],
+    "typescript": _JS_DECLARATIONS,
+    "javascript": _JS_DECLARATIONS,
+    "go": [
+        re.compile(r"func\s+\(\s*\w*\s*\*?([A-Za-z_]\w*)(?:\[[^\]]*\])?\s*\)\s*([A-Za-z_]\w*)"),
+        re.compile(r"(?:func|type|var|const)\s+([A-Za-z_]\w*)"),
+    ],
+    "java": [_JAVA_TYPE],
+}
+# Declarations inside a class body, where a name followed by "(" is a method rather than a call
+_JS_MEMBER = re.compile(_MODIFIERS + r"([A-Za-z_$#][\w$]*)\s*(?:<[^>]*>)?\s*(?:\(|=\s*(?:async\s*)?\(|:\s*\()")
+_MEMBERS = {
+    "python": [_PY_DECLARATION],
+    "typescript": [_JS_MEMBER],
+    "javascript": [_JS_MEMBER],
+    "go": [],
+    "java": [_JAVA_TYPE, re.compile(_MODIFIERS + r"(?:<[^>]+>\s+)?(?:[\w$.]+(?:<[^()]*>)?(?:\[\])*\s+)?([A-Za-z_$][\w$]*)\s*\(")],
+}
+_CLASS_HEADER = re.compile(r"\b(?:class|interface|enum|record)\b")
+_NOT_SYMBOLS = {"if", "for", "while", "switch", "catch", "return", "throw", "new", "await", "yield", "function",
+                "typeof", "super", "else", "do", "try", "import", "require", "with"}
+_PREFIX = re.compile(r"@[\w.$]+(?:\(.*\))?\s*$|@[\w.$]+\($")  # decorators and annotations on their own line
+_PY_CONTINUES = re.compile(r"(?:elif|else|except|finally)\b")
+_C_CONTINUES = ("=", ",", "(", "[", "&&", "||", "?", ":", ".", "|", "&", "=>")
+
+BLANK, COMMENT, PREFIX, CONT, CODE = range(5)
+
+
+@dataclass
+class Segment:
+    start: int  # first line, 0-based
+    end: int  # one past the last line
+    symbols: list[str] = field(default_factory=list)
+    size: int = 0
+    declares: bool = False  # starts a declaration of its own rather than continuing one
+    head: Optional[int] = None  # the line that opens the statement's body, below any comments and decorators
+
+
+def language_for(filepath: str) -> Optional[str]:
+    return LANGUAGES.get(os.path.splitext(filepath)[1].lower())
+
+def _scan(text: str, lines: list[str], language: str):
+    """
+    Per-line structure: the nesting level each line starts at (indentation for Python,
+    brace depth otherwise) and what kind of line it is. None when brackets don't balance,
+    which usually means a construct the scanner doesn't model (regex literals, templates).
+    """
+    python = language == "python"
+    n = len(lines)
+    depth = [0] * n  # brace depth at line start (not used for Python)
+    group = [0] * n  # open brackets at line start; all brackets for Python, parens/brackets otherwise
+    inside = [False] * n  # line starts inside a multi-line string or comment
+    line = braces = groups = 0
+    for match in (_PY_TOKENS if python else _C_TOKENS).finditer(text):
+        token = match.group()
+        if token == "\n":
+            line += 1
+            depth[line], group[line] = braces, groups
+        elif len(token) == 1 and token in "([{)]}":
+            if token == "{" and not python:
+                braces += 1
+            elif token == "}" and not python:
+                braces -= 1
+            else:
+                groups += 1 if token in "([{" else -1
+            if braces < 0 or groups < 0:
+                return None
+        else:
+            for _ in range(token.count("\n")):
+                line += 1
+                depth[line], group[line], inside[line] = braces, groups, True
+    if braces or groups:
+        return None
+
+    kinds, levels = [BLANK] * n, [0] * n
+    comment = "#" if python else "//"
+    previous = ""  # last code line, for C-like statements continued on the next line
+    for i, raw in enumerate(lines):
+        stripped = raw.strip()
+        levels[i] = len(raw) - len(raw.lstrip()) if python else depth[i]
+        if inside[i] or group[i]:
+            kinds[i] = CONT
+        elif not stripped:
+            continue
+        elif stripped.startswith(comment) or (not python and stripped.startswith("/*")):
+            kinds[i] = COMMENT
+            continue
+        elif python and (_PY_CONTINUES.match(stripped) or (previous.endswith("\\"))):
+            kinds[i] = CONT
+        elif not python and (stripped[0] in "})]." or previous.endswith(_C_CONTINUES)):
+            kinds[i] = CONT
+        elif _PREFIX.match(stripped):
+            kinds[i] = PREFIX
+        else:
+            kinds[i] = CODE
+        previous = stripped.split(comment)[0].rstrip() if comment in stripped else stripped
+    return kinds, levels
+
+def _symbol(stripped: str, patterns) -> Optional[str]:
+    for pattern in patterns:
+        match = pattern.match(stripped)
+        if match:
+            name = ".".join(g for g in match.groups() if g)
+            if name.split(".")[-1] not in _NOT_SYMBOLS:
+                return name
+    return None
+
+def _size(lines, start, end) -> int:
+    return sum(len(l) + 1 for l in lines[start:end])
+
+def _statements(lines, kinds, levels, lo, hi, level, patterns, parent) -> list[Segment]:
+    """Split lines[lo:hi] into consecutive statements at `level`, each led by its comments and decorators."""
+    bounds = []
+    for i in range(lo, hi):
+        if kinds[i] != CODE or levels[i] != level:
+            continue
+        start = i
+        # Pull in the doc comments and decorators written directly above the statement
+        while start > lo and kinds[start - 1] in (COMMENT, PREFIX, CONT):
+            t = start - 1
+            while t > lo and kinds[t] == CONT:
+                t -= 1
+            if kinds[t] not in (COMMENT, PREFIX) or levels[t] != level:
+                break
+            start = t
+        if not bounds or start > bounds[-1]:
+            bounds.append(start)
+    if not bounds or bounds[0] > lo:
+        bounds.insert(0, lo)
+
+    segments = []
+    for k, start in enumerate(bounds):
+        end = bounds[k + 1] if k + 1 < len(bounds) else hi
+        head = next((i for i in range(start, end) if kinds[i] == CODE and levels[i] == level), None)
+        name = _symbol(lines[head].strip(), patterns) if head is not None else None
+        symbols = [f"{parent}.{name}" if parent else name] if name else []
+        segments.append(Segment(start, end, symbols, _size(lines, start, end), bool(name), head))
+    return segments
+
+def _split_lines(lines, start, end, max_chars, symbols) -> list[Segment]:
+    """Fallback for unstructured text: pack whole lines, breaking at blank lines where possible."""
+    pieces, current, size = [], start, 0
+    for i in range(start, end):
+        length = len(lines[i]) + 1
+        if size and size + length > max_chars:
+            # Back up to the last blank line if it keeps the piece at least half full
+            cut = next((b for b in range(i - 1, current, -1) if not lines[b].strip()), None)
+            if cut is not None and _size(lines, current, cut + 1) >= max_chars // 2:
+                pieces.append(Segment(current, cut + 1, list(symbols)))
+                current = cut + 1
+            else:
+                pieces.append(Segment(current, i, list(symbols)))
+                current = i
+            size = _size(lines, current, i)
+        size += length
+    if current < end:
+        pieces.append(Segment(current, end, list(symbols)))
+    for piece in pieces:
+        piece.size = _size(lines, piece.start, piece.end)
+    return pieces
+
+def _fit(segment, lines, kinds, levels, language, max_chars, nesting) -> list[Segment]:
+    """Split a statement that is too large along the statements of its body, recursively."""
+    if segment.size <= max_chars:
+        return [segment]
+    header = segment.head
+    body = None
+    if header is not None and nesting < MAX_NESTING:
+        body = next((i for i in range(header + 1, segment.end) if kinds[i] == CODE and levels[i] > levels[header]), None)
+    if body is None:
+        return _split_lines(lines, segment.start, segment.end, max_chars, segment.symbols)
+    parent = segment.symbols[0] if segment.symbols else ""
+    # Methods are only told apart from calls inside a class body
+    patterns = _MEMBERS[language] if language == "python" or _CLASS_HEADER.search(lines[header]) else []
+    children = _statements(lines, kinds, levels, body, segment.end, levels[body], patterns, parent)
+    # The signature and anything above the first member travel with the first member
+    children[0].start = segment.start
+    children[0].size += _size(lines, segment.start, body)
+    children[0].declares = True
+    for child in children:
+        child.symbols = child.symbols or list(segment.symbols)
+    pieces = []
+    for child in children:
+        pieces.extend(_fit(child, lines, kinds, levels, language, max_chars, nesting + 1))
+    return _merge(pieces, max_chars)
+
+def _merge(segments: list[Segment], max_chars: int, min_chars: int = SYNTAX_MIN_CHUNK_CHARS) -> list[Segment]:
+    """
+    Join neighbours that fit together: always when the second continues the first's
+    declaration or neither declares anything (imports, constants), otherwise only when one
+    of them is tiny, so separate functions stay in separate chunks.
+    """
+    merged: list[Segment] = []
+    for segment in segments:
+        last = merged[-1] if merged else None
+        if last is not None and last.size + segment.size <= max_chars and (
+            not segment.declares or min(last.size, segment.size) < min_chars
+        ):
+            last.end = segment.end
+            last.size += segment.size
+            last.symbols += [s for s in segment.symbols if s not in last.symbols]
+            last.declares = last.declares or segment.declares
+        else:
+            merged.append(segment)
+    return merged
+
+def chunk_code(filepath: str, content: str, max_chars: int) -> list[dict]:
+    """
+    Split a source file along function, class and method boundaries. Declarations larger
+    than `max_chars` are split along their members, then by lines; small neighbours are
+    merged. Chunks don't overlap and are whole lines, so consecutive chunks joined with a
+    newline give back the file. Each chunk carries its symbols and 1-based line range.
+    Files in other languages, or that the scanner can't follow, are split by lines.
+    """
+    lines = content.split("\n")
+    language = language_for(filepath)
+    scanned = _scan(content, lines, language) if language else None
+    if scanned is None:
+        segments = _split_lines(lines, 0, len(lines), max_chars, [])
+    else:
+        kinds, levels = scanned
+        top = min((levels[i] for i, k in enumerate(kinds) if k == CODE), default=0)
+        segments = []
+        for statement in _statements(lines, kinds, levels, 0, len(lines), top, _SYMBOLS[language], ""):
+            segments.extend(_fit(statement, lines, kinds, levels, language, max_chars, 0))
+        segments = _merge(segments, max_chars)
+
+    chunks = []
+    for segment in segments:
+        text = "\n".join(lines[segment.start:segment.end])
+        if len(text) > max_chars and segment.end - segment.start == 1:
+            # A single huge line (minified code, data): cut it by characters
+            chunks.extend(
+                {"content": text[i:i + max_chars], "startLine": segment.start + 1, "endLine": segment.start + 1,
+                 "symbols": segment.symbols}
+                for i in range(0, len(text), max_chars)
+            )
+        elif text.strip():
+            chunks.append({"content": text, "startLine": segment.start + 1, "endLine": segment.end, "symbols": segment.symbols})
+    return chunks
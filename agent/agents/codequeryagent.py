@@ -1,32 +1,63 @@
 import os
-import time
-from pymongo import MongoClient
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_voyageai import VoyageAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import asyncio
+import hashlib
+from functools import lru_cache
 from langgraph.graph import StateGraph, END
-from githubkit import GitHub, AppInstallationAuthStrategy
 from dotenv import load_dotenv
 from typing import TypedDict, Any, Optional, List
 from pydantic import BaseModel, Field
 from datetime import datetime
 load_dotenv()
-import base64
+from agents.workerpool import run_blocking
+from agents.githubpool import github_pool
+from agents.vectorstore import build_retrieval_backend, encode_embedding, RESULT_FIELDS, EMBEDDING_STORAGE
+from agents.pathindex import PathIndex, path_index_cache
+from agents.lexicalindex import lexical_index_cache
+from agents.contextpacker import fuse, pack
+from agents.codechunker import chunk_code, SYNTAX_MIN_CHUNK_CHARS
+from agents.chains import chain_registry
+from agents.clients import clients
+from agents.tracing import traced_graph, event
 
 # --- CONFIGURATION ---
-MONGODB_URI = os.environ.get("MONGODB_URI")
 DB_NAME = "code-lense"
 FILELIST_COLL = "repofilelists"
 VECTOR_COLL = "codechunk"
+INDEXJOB_COLL = "repoindexjobs"
 
-# GitHub App credentials
-APP_ID = os.environ.get("GITHUB_APP_ID")
-PRIVATE_KEY = os.environ.get("GITHUB_PRIVATE_KEY") or ""
+# Chunking / embedding config; part of the chunk cache key so changing either re-embeds
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200  # recursive splitter only; syntax chunks don't overlap
+# "syntax": split along functions and classes (agents/codechunker.py); "recursive": plain character splitter
+CHUNKER = os.environ.get("CHUNKER", "syntax")
+EMBEDDING_MODEL = "voyage-code-2"
+CHUNK_CONFIG = f"syntax:{CHUNK_SIZE}:{SYNTAX_MIN_CHUNK_CHARS}" if CHUNKER == "syntax" else f"recursive:{CHUNK_SIZE}:{CHUNK_OVERLAP}"
+if EMBEDDING_STORAGE != "float32":
+    CHUNK_CONFIG += f":{EMBEDDING_STORAGE}"  # stored vectors of another format are re-embedded, not mixed
+PATH_SHORTLIST_SIZE = int(os.environ.get("PATH_SHORTLIST_SIZE", "200"))  # candidate paths shown to the LLM
+PATH_EMBEDDINGS = os.environ.get("PATH_EMBEDDINGS", "0") == "1"  # also rank paths by embedding similarity
+RETRIEVAL_CANDIDATES = int(os.environ.get("RETRIEVAL_CANDIDATES", "20"))  # chunks each retriever proposes before fusion
 
 # --- LANGCHAIN SETUP ---
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
-embeddings = VoyageAIEmbeddings(model="voyage-code-2")
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+# Clients come from the shared pool and are created on first use, not at import
+LLM_MODEL = "gemini-2.0-flash"
+
+def get_llm():
+    return clients.chat(LLM_MODEL, temperature=0)
+
+def get_embeddings():
+    return clients.embeddings(EMBEDDING_MODEL)
+
+@lru_cache(maxsize=None)
+def get_text_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+def split_file(filepath, content) -> list[dict]:
+    """Chunks of one file as {"content", and for syntax chunks "startLine", "endLine", "symbols"}."""
+    if CHUNKER == "syntax":
+        return chunk_code(filepath, content, CHUNK_SIZE)
+    return [{"content": chunk} for chunk in get_text_splitter().split_text(content)]
 
 # --- PYDANTIC MODELS ---
 class FileSelection(BaseModel):
@@ -35,19 +66,62 @@ class FileSelection(BaseModel):
         description="List of file paths that are most likely to contain the answer to the user's query"
     )
 
+chain_registry.register("codequery.select_files", get_llm, lambda model: model.with_structured_output(FileSelection))
+
 # --- MONGODB SETUP ---
-mongo = MongoClient(MONGODB_URI)
-filelist_coll = mongo[DB_NAME][FILELIST_COLL]
-vector_coll = mongo[DB_NAME][VECTOR_COLL]
-
-# --- GITHUBKIT SETUP ---
-def get_github_client(installation_id):
-    app = GitHub(
-        AppInstallationAuthStrategy(
-            APP_ID, PRIVATE_KEY, installation_id,
-        )
-    )
-    return app
+# Resolved per call so the service starts (and reports not-ready) while MongoDB is down
+def get_filelist_coll():
+    return clients.mongo()[DB_NAME][FILELIST_COLL]
+
+def get_vector_coll():
+    return clients.mongo()[DB_NAME][VECTOR_COLL]
+
+def get_indexjob_coll():
+    return clients.mongo()[DB_NAME][INDEXJOB_COLL]
+
+def get_retrieval():
+    return clients.get("retrieval", VECTOR_COLL, lambda: build_retrieval_backend(get_vector_coll()))
+
+async def load_repo_chunks(account_id, repo):
+    """Every current chunk of a repo without embeddings, for the lexical index."""
+    return await run_blocking(lambda: list(get_vector_coll().find(
+        {"accountId": account_id, "repo": repo, "chunkConfig": CHUNK_CONFIG, "embeddingModel": EMBEDDING_MODEL},
+        {field: 1 for field in RESULT_FIELDS},
+    )))
+
+# --- CHUNK CACHE ---
+# Chunks in codechunk are content-addressed: a file whose blob SHA, splitter config and
+# embedding model are unchanged reuses its stored chunks instead of being re-embedded.
+chunk_cache_stats = {"hits": 0, "misses": 0, "evicted_chunks": 0}
+
+def git_blob_sha(content: str) -> str:
+    """Compute the git blob SHA GitHub reports for this file content."""
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def chunk_cache_key(account_id, repo, filepath, blob_sha) -> str:
+    raw = "|".join([account_id, repo, filepath, blob_sha, CHUNK_CONFIG, EMBEDDING_MODEL])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def build_chunk_docs(account_id, repo, filepath, content, blob_sha=None):
+    """Split one file into codechunk documents (without embeddings)."""
+    blob_sha = blob_sha or git_blob_sha(content)
+    cache_key = chunk_cache_key(account_id, repo, filepath, blob_sha)
+    return [
+        {
+            "accountId": account_id,
+            "repo": repo,
+            "filepath": filepath,
+            "blobSha": blob_sha,
+            "cacheKey": cache_key,
+            "chunkConfig": CHUNK_CONFIG,
+            "embeddingModel": EMBEDDING_MODEL,
+            "chunkIndex": i,
+            **chunk,
+            "createdAt": datetime.utcnow()
+        }
+        for i, chunk in enumerate(split_file(filepath, content))
+    ]
 
 # --- AGENT STATE ---
 class CodeQueryState(TypedDict):
@@ -57,8 +131,11 @@ class CodeQueryState(TypedDict):
     owner: str
     installation_id: int
     filepaths: list[str]
+    path_index: Any
     top_files: list[str]
     file_contents: dict[str, str]
+    file_shas: dict[str, str]
+    indexed_files: list[str]
     chunks: list[Any]
     embedded_chunks: list[Any]
     user_query_emb: Any
@@ -66,19 +143,47 @@ class CodeQueryState(TypedDict):
     answer: Optional[str]
 
 # --- GRAPH NODES ---
-def fetch_file_list(state: CodeQueryState):
-    doc = filelist_coll.find_one({"accountId": state["account_id"], "repo": state["repo"]})
-    state["filepaths"] = doc["filepaths"] if doc else []
+async def fetch_file_list(state: CodeQueryState):
+    key = (state["account_id"], state["repo"])
+    query = {"accountId": state["account_id"], "repo": state["repo"]}
+    # Check the list's version first so an unchanged list is neither re-read nor re-indexed
+    meta = await run_blocking(get_filelist_coll().find_one, query, {"updatedAt": 1})
+    version = str(meta["updatedAt"]) if meta and meta.get("updatedAt") else None
+    index = path_index_cache.get(key, version) if version else None
+    hit = index is not None
+    if index is None and meta:
+        doc = await run_blocking(get_filelist_coll().find_one, query, {"filepaths": 1})
+        filepaths = doc["filepaths"] if doc else []
+        version = version or hashlib.sha1("\n".join(filepaths).encode("utf-8")).hexdigest()
+        index = path_index_cache.get(key, version)
+        hit = index is not None
+        if index is None:
+            index = await run_blocking(PathIndex, filepaths)
+            if PATH_EMBEDDINGS and filepaths:
+                index.set_path_vectors(await get_embeddings().aembed_documents(filepaths))
+            path_index_cache.put(key, version, index)
+    event("cache", cache="path_index", result="hit" if hit else "miss")
+    state["path_index"] = index
+    state["filepaths"] = index.filepaths if index else []
     return state
 
-def select_top_files(state: CodeQueryState, top_n=3):
-    # Create structured output LLM
-    structured_llm = llm.with_structured_output(FileSelection)
+async def select_top_files(state: CodeQueryState, top_n=3):
+    # Structured output LLM, built once and shared
+    structured_llm = chain_registry.get("codequery.select_files")
+
+    # Narrow large repos down to a ranked shortlist before the LLM sees them
+    index = state["path_index"]
+    candidates = state["filepaths"]
+    if index is not None:
+        if index.path_vectors is not None and state["user_query_emb"] is None:
+            state["user_query_emb"] = await get_embeddings().aembed_query(state["user_query"])
+        candidates = await run_blocking(index.shortlist, state["user_query"], PATH_SHORTLIST_SIZE, state["user_query_emb"])
+    print(f"Path shortlist: {len(candidates)} of {len(state['filepaths'])} files")
     
     prompt = f"""User query: {state["user_query"]}
 
 Here is a list of files in the repository:
-{chr(10).join(f"- {fp}" for fp in state["filepaths"])}
+{chr(10).join(f"- {fp}" for fp in candidates)}
 
 Select the {top_n} file paths that are most likely to contain the answer to the user's query. 
 Consider file extensions, naming patterns, and the nature of the query when making your selection.
@@ -86,161 +191,155 @@ Only return files that actually exist in the provided list with the same full na
     
     try:
         # Use structured output to get reliable file selection
-        result = structured_llm.invoke(prompt)
+        result = await structured_llm.ainvoke(prompt)
         state["top_files"] = result.selected_files[:top_n]
         
-        # Fallback: if structured output fails or returns invalid files, use first N
-        if not state["top_files"] or not all(fp in state["filepaths"] for fp in state["top_files"]):
-            state["top_files"] = state["filepaths"][:top_n]
+        # Fallback: if structured output fails or returns invalid files, use the best-ranked N
+        valid = index.filepath_set if index is not None else set(state["filepaths"])
+        if not state["top_files"] or not all(fp in valid for fp in state["top_files"]):
+            state["top_files"] = candidates[:top_n]
             
     except Exception as e:
         # Fallback to simple selection if structured output fails
-        state["top_files"] = state["filepaths"][:top_n]
+        state["top_files"] = candidates[:top_n]
     print(f"Top files: {state['top_files']}")
     return state
 
-def fetch_files_content(state: CodeQueryState):
-    client = get_github_client(state["installation_id"])
-    file_contents = {}
-    for filepath in state["top_files"]:
-        try:
-            resp = client.rest.repos.get_content(
-                owner=state["owner"],
-                repo=state["repo"].split('/')[-1],
-                path=filepath
-            ).parsed_data
-            
-            if not isinstance(resp, list) and resp.type == "file" and resp.content:
-                content = base64.b64decode(resp.content).decode('utf-8')
-                file_contents[filepath] = content
-            else:
-                print(f"⚠️ Path '{filepath}' is not a file or has no content, skipping.")
-        except Exception as e:
-            print(f"❌ Could not fetch content for '{filepath}': {e}")
-            
+async def find_indexed_files(account_id, repo, filepaths):
+    """Files the background indexer already keeps current, so the query needn't fetch them."""
+    job = await run_blocking(get_indexjob_coll().find_one, {"accountId": account_id, "repo": repo})
+    if not job or not job.get("fullWalkAt"):
+        return []
+    return await run_blocking(get_vector_coll().distinct, "filepath", {
+        "accountId": account_id,
+        "repo": repo,
+        "filepath": {"$in": filepaths},
+        "chunkConfig": CHUNK_CONFIG,
+        "embeddingModel": EMBEDDING_MODEL,
+    })
+
+async def fetch_files_content(state: CodeQueryState):
+    state["indexed_files"] = await find_indexed_files(state["account_id"], state["repo"], state["top_files"])
+    if state["indexed_files"]:
+        print(f"Served from repo index: {state['indexed_files']}")
+    # Files are independent, so fetch them concurrently; blobs seen before come from the local blob cache
+    to_fetch = [fp for fp in state["top_files"] if fp not in state["indexed_files"]]
+    fetched = await github_pool.fetch_files(
+        state["installation_id"], state["owner"], state["repo"].split('/')[-1], to_fetch,
+    )
+    file_contents = {fp: content for fp, (content, _) in fetched.items()}
+    for fp in to_fetch:
+        if fp not in fetched:
+            print(f"⚠️ Path '{fp}' is not a file or has no content, skipping.")
+
     state["file_contents"] = file_contents
+    state["file_shas"] = {fp: sha for fp, (_, sha) in fetched.items() if sha}
     print(f"File contents: {list(state['file_contents'].keys())}")
     return state
 
-def chunk_and_embed(state: CodeQueryState):
+async def chunk_and_embed(state: CodeQueryState):
     print(f"Chunking and embedding for {state['account_id']} {state['repo']}")
+    file_shas = state.get("file_shas") or {}
+    cache_keys = {
+        filepath: chunk_cache_key(
+            state["account_id"], state["repo"], filepath,
+            file_shas.get(filepath) or git_blob_sha(content),
+        )
+        for filepath, content in state["file_contents"].items()
+    }
+
+    # One lookup for every file; keys already in codechunk skip splitting and embedding
+    cached_keys = set(await run_blocking(
+        get_vector_coll().distinct, "cacheKey",
+        {"accountId": state["account_id"], "repo": state["repo"], "cacheKey": {"$in": list(cache_keys.values())}},
+    )) if cache_keys else set()
+    stale_files = [fp for fp, key in cache_keys.items() if key not in cached_keys]
+    chunk_cache_stats["hits"] += len(cache_keys) - len(stale_files)
+    chunk_cache_stats["misses"] += len(stale_files)
+    print(f"Chunk cache: {len(cache_keys) - len(stale_files)} hits, {len(stale_files)} misses")
+    event("cache", cache="chunks", hits=len(cache_keys) - len(stale_files), misses=len(stale_files))
+
     all_chunks = []
     try: 
-        for filepath, content in state["file_contents"].items():
-            chunks = text_splitter.split_text(content)
-            for i, chunk in enumerate(chunks):
-                all_chunks.append({
-                    "accountId": state["account_id"],
-                    "repo": state["repo"],
-                    "filepath": filepath,
-                    "chunkIndex": i,
-                    "content": chunk,
-                    "createdAt": datetime.utcnow()
-                })
+        for filepath in stale_files:
+            all_chunks.extend(await run_blocking(
+                build_chunk_docs, state["account_id"], state["repo"], filepath,
+                state["file_contents"][filepath], file_shas.get(filepath),
+            ))
     except Exception as e:
         print(f"❌ Error chunking and embedding: {e}")
         return state
-    # Embed all chunks
+    # Embed all chunks; the embedder batches them with other requests' chunks
     texts = [c["content"] for c in all_chunks]
-    embeds = embeddings.embed_documents(texts)
+    embeds = await get_embeddings().aembed_documents(texts)
     for c, e in zip(all_chunks, embeds):
-        c["embedding"] = e
-    # Store in MongoDB
+        c["embedding"] = encode_embedding(e)
+    # Store in MongoDB, evicting chunks from older versions of the same files first
     if all_chunks:
         print("all chunks")
-        vector_coll.insert_many(all_chunks)
-        print("⏳ Polling for vector index availability...")
-        max_retries = 8 
-        retries = 0
-        
-        while retries < max_retries:
-            try:
-                test_pipeline = [
-                    {
-                        "$vectorSearch": {
-                            "index": "vector_index",
-                            "queryVector": embeds[0] if embeds else [0.0] * 1536, 
-                            "path": "embedding",
-                            "numCandidates": 1,
-                            "limit": 1,
-                            "filter": {
-                                "accountId": state["account_id"],
-                                "repo": state["repo"]
-                            }
-                        }
-                    }
-                ]
-                test_results = list(vector_coll.aggregate(test_pipeline))
-                if test_results:
-                    print(f"✅ Vector index ready after {retries * 2} seconds")
-                    break
-                else:
-                    print(f"⏳ Vector index not ready, retrying in 2s... (attempt {retries + 1}/{max_retries})")
-                    time.sleep(2)
-                    retries += 1
-            except Exception as e:
-                print(f"⏳ Vector search error, retrying in 2s... (attempt {retries + 1}/{max_retries}): {e}")
-                time.sleep(2)
-                retries += 1
-        
-        if retries >= max_retries:
-            print("⚠️ Vector index polling timed out after 15 seconds, proceeding anyway")
-    
+        for filepath in stale_files:
+            deleted = await run_blocking(get_vector_coll().delete_many, {
+                "accountId": state["account_id"],
+                "repo": state["repo"],
+                "filepath": filepath,
+                "cacheKey": {"$ne": cache_keys[filepath]},
+            })
+            chunk_cache_stats["evicted_chunks"] += deleted.deleted_count
+        await run_blocking(get_vector_coll().insert_many, all_chunks)
+        # Don't wait for the vector index: it serves these files from memory until it catches up
+        await get_retrieval().index_chunks(state["account_id"], state["repo"], all_chunks)
+        await lexical_index_cache.index_chunks(state["account_id"], state["repo"], all_chunks)
+
     state["embedded_chunks"] = all_chunks
     print(f"Embedded chunks: {len(state['embedded_chunks'])}")
     return state
 
-def embed_user_query(state: CodeQueryState):
+async def embed_user_query(state: CodeQueryState):
+    if state["user_query_emb"] is not None:
+        return state  # already embedded for path ranking
     print(f"Embedding user query for {state['account_id']} {state['repo']}")
     try:
-        state["user_query_emb"] = embeddings.embed_query(state["user_query"])
+        state["user_query_emb"] = await get_embeddings().aembed_query(state["user_query"])
     except Exception as e:
         print(f"❌ Error embedding user query: {e}")
         return state
     return state
 
-def vector_search(state: CodeQueryState, top_k=5):
-    print(f"Vector searching for {state['account_id']} {state['repo']}")
-    print("here inside vector search")
+async def vector_candidates(state: CodeQueryState, top_k: int) -> list:
+    # Files embedded moments ago (by this or another request) that Atlas hasn't indexed yet are
+    # ranked in memory by the retrieval backend, so there is no need to wait for the index
+    if state["user_query_emb"] is None:
+        return []
     try:
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",
-                    "queryVector": state["user_query_emb"],
-                    "path": "embedding",
-                    "numCandidates": 100,
-                    "limit": top_k,
-                    "filter": {
-                        "accountId": state["account_id"],
-                        "repo": state["repo"],
-                            "filepath": { "$in": state["top_files"] }
-                    }
-                }
-            }
-        ]
-        try:
-            results = list(vector_coll.aggregate(pipeline))
-            print(f"Vector search results: {len(results)} chunks found")
-            state["relevant_chunks"] = results
-        except Exception as e:
-            print(f"❌ Vector search failed: {e}")
-            # Fallback: get chunks without vector search
-            fallback_results = list(vector_coll.find({
-                "accountId": state["account_id"],
-                "repo": state["repo"],
-                "filepath": { "$in": state["top_files"] }
-            }).limit(top_k))
-            print(f"Fallback results: {len(fallback_results)} chunks")
-            state["relevant_chunks"] = fallback_results
+        results = await get_retrieval().search(
+            state["account_id"], state["repo"], state["user_query_emb"], top_k, filepaths=state["top_files"],
+        )
     except Exception as e:
         print(f"❌ Vector search failed: {e}")
-        # Fallback: get chunks without vector search
-        
+        return []
+    print(f"Vector search results: {len(results)} chunks from {len(state['top_files'])} files")
+    return results
+
+async def lexical_candidates(state: CodeQueryState, top_k: int) -> list:
+    # Exact identifiers and error strings from anywhere in the indexed repo, not just the top files
+    try:
+        index = await lexical_index_cache.get(
+            state["account_id"], state["repo"], lambda: load_repo_chunks(state["account_id"], state["repo"]),
+        )
+        return await run_blocking(index.search, state["user_query"], top_k)
+    except Exception as e:
+        print(f"❌ Lexical search failed: {e}")
+        return []
 
-    print(f"Relevant chunks: {len(state['relevant_chunks'])}")
+async def hybrid_search(state: CodeQueryState, top_k=RETRIEVAL_CANDIDATES):
+    print(f"Hybrid searching for {state['account_id']} {state['repo']}")
+    vector, lexical = await asyncio.gather(vector_candidates(state, top_k), lexical_candidates(state, top_k))
+    # Fuse by rank, then keep what fits the context budget with overlapping neighbours merged
+    state["relevant_chunks"] = pack(fuse([vector, lexical]))
+    print(f"Relevant chunks: {len(state['relevant_chunks'])} passages from {len(vector)} vector and {len(lexical)} lexical candidates")
     return state
-def answer_with_llm(state: CodeQueryState):
+
+async def answer_with_llm(state: CodeQueryState):
     print(f"Answering with LLM for {state['account_id']} {state['repo']}")
     # Build context with file paths
     context_parts = []
@@ -255,51 +354,64 @@ def answer_with_llm(state: CodeQueryState):
     for chunk in state["relevant_chunks"]:
         filepath = chunk.get("filepath", "unknown")
         content = chunk["content"]
-        context_parts.append(f"File: {filepath}\n{content}")
+        lines = f" (lines {chunk['startLine']}-{chunk['endLine']})" if chunk.get("startLine") else ""
+        context_parts.append(f"File: {filepath}{lines}\n{content}")
     
     context = "\n\n".join(context_parts)
     prompt = f"User query: {state["user_query"]}\nRelevant code:\n{context}\n\nAnswer the user's question using the code above. When referencing code, mention the file path. keep the answer concise and not too long"
-    response = llm.invoke(prompt)
+    response = await get_llm().ainvoke(prompt)
     state["answer"] = str(response.content) if hasattr(response, 'content') else str(response)
     print(f"Answer: {state['answer']}")
     return state
 
 # --- LANGGRAPH WORKFLOW ---
-graph = StateGraph(CodeQueryState)
-graph.add_node("fetch_file_list", fetch_file_list)
-graph.add_node("select_top_files", select_top_files)
-graph.add_node("fetch_files_content", fetch_files_content)
-graph.add_node("chunk_and_embed", chunk_and_embed)
-graph.add_node("embed_user_query", embed_user_query)
-graph.add_node("vector_search", vector_search)
-graph.add_node("answer_with_llm", answer_with_llm)
-
-graph.set_entry_point("fetch_file_list")
-graph.add_edge("fetch_file_list", "select_top_files")
-graph.add_edge("select_top_files", "fetch_files_content")
-graph.add_edge("fetch_files_content", "chunk_and_embed")
-graph.add_edge("chunk_and_embed", "embed_user_query")
-graph.add_edge("embed_user_query", "vector_search")
-graph.add_edge("vector_search", "answer_with_llm")
-graph.add_edge("answer_with_llm", END)
-
-code_query_workflow = graph.compile()
-
-def run_agent(user_query, account_id, repo, owner, installation_id):
-    state: CodeQueryState = {
+def build_code_query_graph():
+    graph = StateGraph(CodeQueryState)
+    graph.add_node("fetch_file_list", fetch_file_list)
+    graph.add_node("select_top_files", select_top_files)
+    graph.add_node("fetch_files_content", fetch_files_content)
+    graph.add_node("chunk_and_embed", chunk_and_embed)
+    graph.add_node("embed_user_query", embed_user_query)
+    graph.add_node("hybrid_search", hybrid_search)
+    graph.add_node("answer_with_llm", answer_with_llm)
+
+    graph.set_entry_point("fetch_file_list")
+    graph.add_edge("fetch_file_list", "select_top_files")
+    graph.add_edge("select_top_files", "fetch_files_content")
+    graph.add_edge("fetch_files_content", "chunk_and_embed")
+    graph.add_edge("chunk_and_embed", "embed_user_query")
+    graph.add_edge("embed_user_query", "hybrid_search")
+    graph.add_edge("hybrid_search", "answer_with_llm")
+    graph.add_edge("answer_with_llm", END)
+
+    return graph.compile()
+
+# Compiled on first use rather than at import
+@lru_cache(maxsize=None)
+def get_code_query_workflow():
+    return traced_graph(build_code_query_graph(), "code_query")
+
+def initial_state(user_query, account_id, repo, owner, installation_id) -> CodeQueryState:
+    return {
         "user_query": user_query,
         "account_id": account_id,
         "repo": repo,
         "owner": owner,
         "installation_id": installation_id,
         "filepaths": [],
+        "path_index": None,
         "top_files": [],
         "file_contents": {},
+        "file_shas": {},
+        "indexed_files": [],
         "chunks": [],
         "embedded_chunks": [],
         "user_query_emb": None,
         "relevant_chunks": [],
         "answer": None,
     }
-    final_state = code_query_workflow.invoke(state)
+
+async def run_agent(user_query, account_id, repo, owner, installation_id):
+    state = initial_state(user_query, account_id, repo, owner, installation_id)
+    final_state = await get_code_query_workflow().ainvoke(state)
     return final_state["answer"]
\ No newline at end of file
@@ -0,0 +1,82 @@
+import os
+from typing import Dict, List, Tuple
+from agents.diffpacker import estimate_tokens
+
+# --- CONFIGURATION ---
+RRF_K = 60  # rank damping for reciprocal-rank fusion; the usual default
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CODE_QUERY_CONTEXT_TOKENS", "1500"))  # code shown to the answering LLM
+MAX_OVERLAP_CHARS = 400  # longest chunk overlap looked for when stitching neighbours together
+
+ChunkKey = Tuple[str, int]
+
+
+def chunk_key(chunk: dict) -> ChunkKey:
+    return chunk.get("filepath", "unknown"), int(chunk.get("chunkIndex") or 0)
+
+def fuse(rankings: List[List[dict]], k: int = RRF_K) -> List[dict]:
+    """
+    Reciprocal-rank fusion: each chunk scores sum(1 / (k + rank)) over the rankings it
+    appears in, so chunks both retrievers agree on come first without calibrating their
+    scores against each other. Chunks are identified by file and chunk index.
+    """
+    fused: Dict[ChunkKey, dict] = {}
+    scores: Dict[ChunkKey, float] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking):
+            key = chunk_key(chunk)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            fused[key] = {**fused.get(key, {}), **chunk}
+    order = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [{**fused[key], "rrf_score": round(scores[key], 5)} for key in order]
+
+def _stitch(left: str, right: str) -> str:
+    """Join consecutive chunks of a file, dropping the text the splitter repeated in both."""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), 0, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + "\n" + right
+
+def pack(chunks: List[dict], budget: int = CONTEXT_TOKEN_BUDGET) -> List[dict]:
+    """
+    Take chunks in ranked order while they fit in `budget` tokens, then merge chunks that
+    are neighbours in the same file into one passage without the splitter's overlap, so
+    the prompt never carries the same lines twice. Passages keep the rank of their best chunk.
+    """
+    selected: List[dict] = []
+    seen = set()
+    used = 0
+    for chunk in chunks:
+        key = chunk_key(chunk)
+        if key in seen:
+            continue
+        cost = estimate_tokens(chunk["content"])
+        if used + cost > budget:
+            continue
+        seen.add(key)
+        selected.append({**chunk, "rank": len(selected)})
+        used += cost
+
+    passages: List[dict] = []
+    by_file: Dict[str, List[dict]] = {}
+    for chunk in selected:
+        by_file.setdefault(chunk.get("filepath", "unknown"), []).append(chunk)
+    for file_chunks in by_file.values():
+        file_chunks.sort(key=chunk_key)
+        current, last = dict(file_chunks[0]), chunk_key(file_chunks[0])[1]
+        for chunk in file_chunks[1:]:
+            index = chunk_key(chunk)[1]
+            if index == last + 1:
+                if current.get("endLine") and (chunk.get("startLine") or 0) > current["endLine"]:
+                    # Syntax chunks are whole lines that don't overlap
+                    current["content"] += "\n" + chunk["content"]
+                    current["endLine"] = chunk["endLine"]
+                    current["symbols"] = current["symbols"] + [s for s in chunk["symbols"] if s not in current["symbols"]]
+                else:
+                    current["content"] = _stitch(current["content"], chunk["content"])
+                current["rank"] = min(current["rank"], chunk["rank"])
+            else:
+                passages.append(current)
+                current = dict(chunk)
+            last = index
+        passages.append(current)
+    return sorted(passages, key=lambda p: p["rank"])
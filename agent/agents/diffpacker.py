@@ -0,0 +1,176 @@
+import os
+import re
+import math
+from typing import List, Dict
+from pydantic import BaseModel
+from agents.workerpool import run_blocking
+
+# --- CONFIGURATION ---
+CHARS_PER_TOKEN = 4  # first estimate; a diff large enough to meet a budget is then counted by the model
+# "model": count diffs that could meet their budget with the model's tokenizer; "estimate": chars/4 only
+TOKEN_COUNT = os.environ.get("PR_DIFF_TOKEN_COUNT", "model")
+FILE_LIST_MAX_FILES = 300  # longer file lists are cut off in the prompt header
+SECTION_TOKENS = 12  # per-file separators and the "(... N more hunks omitted)" note
+FOOTER_TOKENS = 20
+
+# Per-node token budgets for the diff portion of each prompt; PR_DIFF_BUDGET_<NODE> overrides
+DEFAULT_BUDGETS = {
+    "summary": 4000,
+    "risk": 12000,
+    "tests": 10000,
+    "checklist": 10000,
+}
+
+CRITICAL_PATTERNS = re.compile(
+    r"(auth|security|crypto|password|secret|token|permission|payment|billing|migration|schema|"
+    r"database|config|settings|dockerfile|\.github/workflows|\.env|middleware|server\.|main\.)",
+    re.IGNORECASE,
+)
+TEST_PATTERNS = re.compile(r"(^|/)(tests?|__tests__|spec)(/|$)|(_test|\.test|\.spec|test_)[^/]*$", re.IGNORECASE)
+LOW_VALUE_PATTERNS = re.compile(
+    r"(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|poetry\.lock|Cargo\.lock|go\.sum|\.min\.(js|css)$|"
+    r"(^|/)(dist|build|vendor|node_modules|__generated__)/|\.snap$|\.svg$|\.map$|"
+    r"_pb2(_grpc)?\.pyi?$|\.pb\.go$|\.generated\.|\.g\.dart$)",
+    re.IGNORECASE,
+)
+_HUNK_HEADER = re.compile(r"^@@ .* @@", re.MULTILINE)
+
+# How much each node cares about test files relative to source files
+TEST_WEIGHT = {"summary": 0.5, "risk": 0.6, "tests": 1.2, "checklist": 0.7}
+
+
+def budget_for(node: str) -> int:
+    return int(os.environ.get(f"PR_DIFF_BUDGET_{node.upper()}", DEFAULT_BUDGETS[node]))
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class Hunk(BaseModel):
+    filename: str
+    text: str
+    tokens: int
+    churn: int
+    critical: bool
+    is_test: bool
+    low_value: bool
+    order: int  # position within the file, so packed hunks keep their original order
+
+
+class PackedDiff(BaseModel):
+    """Every changed file split into hunks with token counts, computed once per PR."""
+    files: List[Dict]  # filename, additions, deletions, hunk count, in PR order
+    hunks: List[Hunk]
+    token_ratio: float = 1.0  # model tokens per estimated token, once measured
+
+    def tokens(self, text: str) -> int:
+        """Tokens of prompt text around the hunks (file list, section headers), at the measured ratio."""
+        return math.ceil(estimate_tokens(text) * self.token_ratio)
+
+
+def split_hunks(patch: str) -> List[str]:
+    starts = [m.start() for m in _HUNK_HEADER.finditer(patch)]
+    if not starts:
+        return [patch] if patch else []
+    starts.append(len(patch))
+    return [patch[starts[i]:starts[i + 1]].rstrip("\n") for i in range(len(starts) - 1)]
+
+def pack_diff(changed_files: list) -> PackedDiff:
+    files, hunks = [], []
+    for f in changed_files:
+        filename = f.get("filename", "unknown")
+        patch = f.get("patch") or ""
+        critical = bool(CRITICAL_PATTERNS.search(filename))
+        is_test = bool(TEST_PATTERNS.search(filename))
+        low_value = bool(LOW_VALUE_PATTERNS.search(filename))
+        file_hunks = split_hunks(patch)
+        added = removed = 0
+        for order, text in enumerate(file_hunks):
+            lines = text.splitlines()
+            plus = sum(1 for line in lines if line.startswith("+"))
+            minus = sum(1 for line in lines if line.startswith("-"))
+            added += plus
+            removed += minus
+            hunks.append(Hunk(
+                filename=filename, text=text, tokens=estimate_tokens(text), churn=plus + minus,
+                critical=critical, is_test=is_test, low_value=low_value, order=order,
+            ))
+        files.append({
+            "filename": filename,
+            "additions": f.get("additions", added),
+            "deletions": f.get("deletions", removed),
+            "hunks": len(file_hunks),
+        })
+    return PackedDiff(files=files, hunks=hunks)
+
+def calibrate(packed: PackedDiff, measured: int) -> PackedDiff:
+    """Rescale every hunk's estimate so they add up to `measured`, the model's count for all of them."""
+    estimated = sum(h.tokens for h in packed.hunks)
+    if not estimated or not measured:
+        return packed
+    ratio = measured / estimated
+    hunks = [h.model_copy(update={"tokens": math.ceil(h.tokens * ratio)}) for h in packed.hunks]
+    return packed.model_copy(update={"hunks": hunks, "token_ratio": ratio})
+
+async def count_tokens(packed: PackedDiff, model, budget: int) -> PackedDiff:
+    """
+    Count the diff with the model's own tokenizer (one count_tokens call for every hunk
+    together) when its estimate comes within half of `budget`, the smallest budget it is
+    packed into; smaller diffs fit whatever the exact count, so they skip the call.
+    """
+    if TOKEN_COUNT != "model" or sum(h.tokens for h in packed.hunks) < budget // 2:
+        return packed
+    try:
+        measured = await run_blocking(model.get_num_tokens, "\n".join(h.text for h in packed.hunks))
+    except Exception as e:
+        print(f"⚠️ Could not count diff tokens with the model, packing by estimate: {e}")
+        return packed
+    return calibrate(packed, measured)
+
+def _priority(hunk: Hunk, node: str) -> float:
+    score = 1.0 + min(hunk.churn, 200) / 20
+    if hunk.critical:
+        score *= 3
+    if hunk.is_test:
+        score *= TEST_WEIGHT[node]
+    if hunk.low_value:
+        score *= 0.05
+    # Prefer the first hunks of a file; later ones often repeat the same change
+    return score / (1 + 0.25 * hunk.order)
+
+def file_list(packed: PackedDiff) -> str:
+    lines = [f"- {f['filename']} (+{f['additions']}/-{f['deletions']})" for f in packed.files[:FILE_LIST_MAX_FILES]]
+    if len(packed.files) > FILE_LIST_MAX_FILES:
+        lines.append(f"- ... and {len(packed.files) - FILE_LIST_MAX_FILES} more files")
+    return "\n".join(lines)
+
+def render(packed: PackedDiff, node: str, budget: int = None) -> tuple[str, List[str]]:
+    """
+    Render the highest-priority hunks for `node` within its token budget. Returns the
+    prompt text (a list of every changed file followed by the selected hunks grouped per
+    file) and the files that had no hunk included.
+    """
+    budget = budget if budget is not None else budget_for(node)
+    header = file_list(packed)
+    remaining = budget - packed.tokens(header) - FOOTER_TOKENS
+    by_file: Dict[str, List[Hunk]] = {}
+    for hunk in sorted(packed.hunks, key=lambda h: _priority(h, node), reverse=True):
+        # The first hunk of a file also pays for the file's section header and omission note
+        cost = hunk.tokens + (0 if hunk.filename in by_file else packed.tokens(hunk.filename) + SECTION_TOKENS)
+        if cost <= remaining:
+            by_file.setdefault(hunk.filename, []).append(hunk)
+            remaining -= cost
+
+    sections = []
+    for f in packed.files:
+        file_hunks = sorted(by_file.get(f["filename"], []), key=lambda h: h.order)
+        if file_hunks:
+            omitted = f["hunks"] - len(file_hunks)
+            body = "\n".join(h.text for h in file_hunks)
+            note = f"\n(... {omitted} more hunks omitted)" if omitted else ""
+            sections.append(f"{f['filename']}:\n{body}{note}")
+    dropped = [f["filename"] for f in packed.files if f["filename"] not in by_file and f["hunks"]]
+    text = f"{header}\n\nDiff:\n" + "\n\n".join(sections)
+    if dropped:
+        text += f"\n\n({len(dropped)} files omitted from the diff to fit the prompt budget)"
+    return text, dropped
@@ -0,0 +1,194 @@
+import os
+import time
+import random
+import asyncio
+import weakref
+from typing import Awaitable, Callable, List, Optional
+from langchain_core.embeddings import Embeddings
+from agents.diffpacker import estimate_tokens
+from agents.ratelimit import Quota, build_backend
+from agents.singleflight import SingleFlight, payload_key
+
+# --- CONFIGURATION ---
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "128"))  # texts per API call; VoyageAI takes up to 128
+EMBED_BATCH_TOKENS = int(os.environ.get("EMBED_BATCH_TOKENS", "100000"))  # estimated; VoyageAI caps a call at 120k
+EMBED_BATCH_WINDOW = float(os.environ.get("EMBED_BATCH_WINDOW_MS", "10")) / 1000  # wait for other callers' texts
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))  # calls in flight per process
+# Budget for every worker together when RATE_LIMIT_BACKEND=redis, else per process; "limit/period_seconds"
+EMBED_REQUEST_RATE = os.environ.get("EMBED_REQUEST_RATE", "300/60")
+EMBED_TOKEN_RATE = os.environ.get("EMBED_TOKEN_RATE", "1000000/60")
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "5"))
+EMBED_RETRY_BASE_DELAY = 0.5  # seconds; doubled per attempt, with full jitter
+EMBED_RETRY_MAX_DELAY = 20.0
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_TTL = float(os.environ.get("QUERY_EMBEDDING_TTL_SECONDS", "86400"))  # vectors only change with the model
+
+# VoyageAI SDK errors worth retrying; matched by name so the SDK isn't imported here
+RETRYABLE_ERRORS = {"RateLimitError", "ServiceUnavailableError", "ServerError", "APIConnectionError", "Timeout", "TryAgain"}
+
+# Every live Embedder, for /cache-stats; the client pool creates them on first use
+embedders: "weakref.WeakSet[Embedder]" = weakref.WeakSet()
+
+
+def _status(e: Exception) -> Optional[int]:
+    return getattr(e, "http_status", None) or getattr(getattr(e, "response", None), "status_code", None)
+
+def is_rate_limited(e: Exception) -> bool:
+    return _status(e) == 429 or type(e).__name__ == "RateLimitError"
+
+def is_retryable(e: Exception) -> bool:
+    status = _status(e)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(e).__name__ in RETRYABLE_ERRORS or isinstance(e, (TimeoutError, ConnectionError))
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so workers throttled together don't retry together."""
+    return random.uniform(0, min(EMBED_RETRY_MAX_DELAY, EMBED_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class Embedder(Embeddings):
+    """
+    Embedding client every agent goes through, wrapping the model client.
+
+    Document texts from concurrent callers are collected for EMBED_BATCH_WINDOW and sent
+    in batches bounded by text count and estimated tokens. At most EMBED_CONCURRENCY
+    calls run at once, paced by a request and a token budget (GCRA, shared through Redis
+    when the rate limiter is). Throttling and server errors are retried with jittered
+    backoff; a 429 also pauses every other call briefly. Query vectors are cached, and
+    identical queries in flight share one call.
+    """
+
+    def __init__(self, inner: Embeddings, model: str, backend=None):
+        self.inner = inner
+        self.model = model
+        self.backend = backend if backend is not None else build_backend()
+        self.requests = Quota.parse(EMBED_REQUEST_RATE)
+        self.tokens = Quota.parse(EMBED_TOKEN_RATE)
+        self.queries = SingleFlight("query_embedding", ttl=QUERY_EMBEDDING_TTL, max_size=QUERY_EMBEDDING_CACHE_SIZE)
+        self._semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: set[asyncio.Task] = set()  # the loop only holds weak references to tasks
+        self._paused_until = 0.0
+        self.stats = {"calls": 0, "texts": 0, "retries": 0, "rate_limited": 0, "failures": 0, "throttled_seconds": 0.0}
+        embedders.add(self)
+
+    def summary(self) -> dict:
+        return {**self.stats, "throttled_seconds": round(self.stats["throttled_seconds"], 3),
+                "query_cache": self.queries.summary(), **self.backend.summary()}
+
+    # --- PACING ---
+    async def _take(self, name: str, quota: Quota, cost: int):
+        # A call costlier than the burst could never fit; it drains the whole bucket instead
+        cost = min(cost, quota.burst)
+        while True:
+            try:
+                allowed, retry_after, _ = await self.backend.acquire(
+                    f"embed:{self.model}:{name}", quota.emission, quota.tolerance, cost,
+                )
+            except Exception as e:
+                print(f"⚠️ Embedding budget backend failed, not pacing: {e}")
+                return
+            if allowed:
+                return
+            self.stats["throttled_seconds"] += retry_after
+            await asyncio.sleep(retry_after)
+
+    async def _call(self, fn: Callable[[], Awaitable], texts: List[str]):
+        tokens = sum(estimate_tokens(t) for t in texts)
+        async with self._semaphore:
+            for attempt in range(EMBED_MAX_RETRIES + 1):
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self.stats["throttled_seconds"] += pause
+                    await asyncio.sleep(pause)
+                await self._take("requests", self.requests, 1)
+                await self._take("tokens", self.tokens, tokens)
+                self.stats["calls"] += 1
+                try:
+                    result = await fn()
+                    self.stats["texts"] += len(texts)
+                    return result
+                except Exception as e:
+                    if attempt == EMBED_MAX_RETRIES or not is_retryable(e):
+                        self.stats["failures"] += 1
+                        raise
+                    delay = retry_delay(attempt)
+                    self.stats["retries"] += 1
+                    if is_rate_limited(e):
+                        self.stats["rate_limited"] += 1
+                        # The provider's limit is shared, so every call backs off, not just this one
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    print(f"⏳ Embedding call failed ({type(e).__name__}), retrying in {delay:.1f}s (attempt {attempt + 1}/{EMBED_MAX_RETRIES})")
+                    await asyncio.sleep(delay)
+
+    # --- BATCHING ---
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            batch, self._pending, self._pending_tokens = self._pending, [], 0
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: list[tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = await self._call(lambda: self.inner.aembed_documents(texts), texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if self._pending and (len(self._pending) >= EMBED_BATCH_SIZE or self._pending_tokens + tokens > EMBED_BATCH_TOKENS):
+                self._flush()
+            future = loop.create_future()
+            self._pending.append((text, future))
+            self._pending_tokens += tokens
+            futures.append(future)
+        if self._timer is None:
+            self._timer = loop.call_later(EMBED_BATCH_WINDOW, self._flush)
+        return list(await asyncio.gather(*futures))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.queries.run(
+            payload_key(self.model, text.strip()),
+            lambda: self._call(lambda: self.inner.aembed_query(text), [text]),
+        )
+
+    # --- SYNC ---
+    # Not paced or shared with the async path; kept for LangChain callers that need it
+    def _call_sync(self, fn: Callable):
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == EMBED_MAX_RETRIES or not is_retryable(e):
+                    raise
+                self.stats["retries"] += 1
+                time.sleep(retry_delay(attempt))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = texts[start:start + EMBED_BATCH_SIZE]
+            vectors.extend(self._call_sync(lambda: self.inner.embed_documents(batch)))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call_sync(lambda: self.inner.embed_query(text))
@@ -0,0 +1,50 @@
+import json
+import time
+from typing import Any, AsyncIterator, Callable, Optional
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+async def stream_graph(graph, inputs, to_result: Callable[[dict], Any] = lambda s: s,
+                       token_nodes: Optional[set] = None) -> AsyncIterator[str]:
+    """
+    Run a compiled graph with astream_events and translate it into server-sent events:
+    node_started / node_finished (with seconds) for every graph node, token for each
+    streamed LLM chunk emitted inside `token_nodes` (all nodes when None), then a final
+    result event, or error if the run raised.
+    """
+    start = time.perf_counter()
+    started: dict[str, float] = {}
+    yield sse("started", {"at": 0.0})
+    try:
+        async for event in graph.astream_events(inputs, version="v2"):
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
+            # Node runs are the chain events whose name is the node itself
+            if kind == "on_chain_start" and node and event["name"] == node:
+                started[event["run_id"]] = time.perf_counter()
+                yield sse("node_started", {"node": node, "at": round(time.perf_counter() - start, 3)})
+            elif kind == "on_chain_end" and event["run_id"] in started:
+                seconds = time.perf_counter() - started.pop(event["run_id"])
+                yield sse("node_finished", {"node": node, "seconds": round(seconds, 3)})
+            elif kind == "on_chat_model_stream" and (token_nodes is None or node in token_nodes):
+                text = event["data"]["chunk"].content
+                if isinstance(text, str) and text:
+                    yield sse("token", {"node": node, "text": text})
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                # The root run ends last and carries the final state
+                yield sse("result", to_result(event["data"]["output"]))
+    except Exception as e:
+        yield sse("error", {"error": str(e)})
+    yield sse("done", {"seconds": round(time.perf_counter() - start, 3)})
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream, or the first byte waits for the last one
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
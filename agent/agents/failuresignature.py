@@ -0,0 +1,224 @@
+import os
+import re
+import time
+import zlib
+import hashlib
+from collections import OrderedDict, defaultdict
+from typing import List, Optional
+import numpy as np
+from pydantic import BaseModel
+from agents.logreducer import is_error_line
+
+# --- CONFIGURATION ---
+SIGNATURE_CACHE_SIZE = int(os.environ.get("CI_SIGNATURE_CACHE_SIZE", "5000"))
+SIGNATURE_TTL = int(os.environ.get("CI_SIGNATURE_TTL_SECONDS", str(24 * 3600)))
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("CI_SIGNATURE_SIMILARITY", "0.8"))  # estimated Jaccard; >1 disables clustering
+MAX_FRAMES = 5
+MAX_TESTS = 5
+MAX_KEY_ERROR_LINES = 20  # masked error lines in the exact-match key
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 4 rows per band: pairs above ~0.7 Jaccard almost always share a band
+
+ERROR_CLASS_PATTERN = re.compile(r"\b([A-Z][A-Za-z0-9_]*(?:\.[A-Z][A-Za-z0-9_]*)*(?:Error|Exception|Failure|Panic))\b")
+ERROR_CODE_PATTERN = re.compile(r"(npm ERR! code [A-Z0-9_]+|error\[E\d+\]|error TS\d+|exit code \d+)", re.IGNORECASE)
+TEST_PATTERNS = [
+    re.compile(r"FAILED\s+(\S+::\S+)"),  # pytest
+    re.compile(r"--- FAIL: (\S+)"),  # go test
+    re.compile(r"●\s+(.+?)\s*$"),  # jest
+    re.compile(r"(\w+\(\S+\))\s+(?:Time elapsed.*)?<<< (?:FAILURE|ERROR)"),  # junit / surefire
+    re.compile(r"✕\s+(.+?)(?:\s+\(\d+\s*ms\))?\s*$"),  # mocha / vitest
+]
+FRAME_PATTERNS = [
+    re.compile(r'File "([^"]+)", line \d+, in (\S+)'),  # python
+    re.compile(r"at (?:async )?([\w$.<>]+) \(([^):]+):\d+:\d+\)"),  # node
+    re.compile(r"at ([\w$.]+)\(([\w$]+\.(?:java|kt|scala)):\d+\)"),  # jvm
+]
+
+_MASKS = [
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE), "<uuid>"),
+    (re.compile(r"\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{7,64}\b", re.IGNORECASE), "<hash>"),
+    (re.compile(r"0x[0-9a-f]+", re.IGNORECASE), "<addr>"),
+    (re.compile(r"(?:[A-Za-z]:)?(?:[\w.@~-]*[/\\])+([\w.@-]+)"), r"\1"),  # keep only the file name of a path
+    (re.compile(r"\d+(?:\.\d+)?"), "<n>"),
+]
+
+
+def mask(text: str) -> str:
+    """Mask the parts of a log line that change between otherwise identical failures."""
+    for pattern, replacement in _MASKS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+class FailureSignature(BaseModel):
+    key: str
+    error_class: str = ""
+    tests: List[str] = []
+    frames: List[str] = []
+    masked_errors: List[str] = []  # masked error lines, the basis for near-duplicate matching
+
+
+def extract_signature(log_excerpt: str) -> FailureSignature:
+    error_classes, error_codes, tests, frames, masked_errors = [], [], [], [], []
+    for line in log_excerpt.splitlines():
+        if line.startswith(("[CI log reduced", "--- lines", "[... ")):
+            continue
+        for pattern in TEST_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                tests.append(mask(match.group(1)))
+        for pattern in FRAME_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                path, func = (match.group(1), match.group(2)) if pattern is FRAME_PATTERNS[0] else (match.group(2), match.group(1))
+                frames.append(f"{os.path.basename(path)}:{func}")
+        error_classes.extend(ERROR_CLASS_PATTERN.findall(line))
+        error_codes.extend(mask(code) for code in ERROR_CODE_PATTERN.findall(line))
+        if is_error_line(line):
+            masked_errors.append(mask(line))
+
+    # The last exception class is the one the job died with; earlier ones are often causes.
+    # Tool error codes ("exit code 1") only identify a failure when there is no exception.
+    error_class = (error_classes or error_codes or [""])[-1]
+    tests = sorted(set(tests))[:MAX_TESTS]
+    frames = list(dict.fromkeys(frames))[-MAX_FRAMES:]  # innermost frames
+    # The error lines always count: the same exception class alone says little about the cause
+    if error_classes or tests or frames or masked_errors:
+        basis = "\n".join(["|".join([error_class, ",".join(tests), ",".join(frames)])] + masked_errors[:MAX_KEY_ERROR_LINES])
+    else:
+        basis = mask(log_excerpt[-2000:])
+    return FailureSignature(
+        key=hashlib.sha1(basis.encode("utf-8")).hexdigest(),
+        error_class=error_class,
+        tests=tests,
+        frames=frames,
+        masked_errors=masked_errors[:200],
+    )
+
+
+# --- MINHASH ---
+_rng = np.random.default_rng(20240501)
+_MINHASH_A = _rng.integers(1, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_MINHASH_B = _rng.integers(0, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def minhash(signature: FailureSignature) -> Optional[np.ndarray]:
+    tokens = " ".join(signature.masked_errors + signature.frames + signature.tests).split()
+    shingles = {" ".join(tokens[i:i + 3]) for i in range(max(len(tokens) - 2, 1))} if tokens else set()
+    if not shingles:
+        return None
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Multiply-shift hashing; uint64 overflow wraps, which is what we want here
+    return ((hashes[:, None] * _MINHASH_A + _MINHASH_B) >> np.uint64(32)).min(axis=0)
+
+def _bands(values: np.ndarray) -> List[tuple[int, bytes]]:
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    return [(band, values[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+
+
+def _entry_key(signature: FailureSignature, account_id: str, repo: str) -> str:
+    return hashlib.sha1(f"{account_id}|{repo}|{signature.key}".encode("utf-8")).hexdigest()
+
+
+class SignatureCache:
+    """
+    Signature -> explanation cache with TTL and LRU eviction, scoped per (account, repo) so
+    one tenant's failures never answer another's. Lookups match the exact signature key
+    first, then near-duplicates through MinHash LSH. Every lookup that resolves to an
+    entry bumps that entry's failure count.
+    """
+
+    def __init__(self, max_size: int = SIGNATURE_CACHE_SIZE, ttl: int = SIGNATURE_TTL,
+                 threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._buckets: dict[tuple[int, bytes], set[str]] = defaultdict(set)
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if entry["minhash"] is not None:
+            for band in _bands(entry["minhash"]):
+                self._buckets[band].discard(key)
+                if not self._buckets[band]:
+                    del self._buckets[band]
+
+    def _live(self, key) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and entry["expires_at"] < time.time():
+            self._remove(key)
+            self.stats["expired"] += 1
+            return None
+        return entry
+
+    def _nearest(self, signature: FailureSignature, values: np.ndarray, scope: tuple[str, str]) -> Optional[dict]:
+        candidates = set()
+        for band in _bands(values):
+            candidates |= self._buckets.get(band, set())
+        best, best_similarity = None, self.threshold
+        for key in candidates:
+            entry = self._live(key)
+            # Similar logs that died with a different exception are different failures
+            if entry is None or entry["minhash"] is None or entry["error_class"] != signature.error_class:
+                continue
+            if (entry["account_id"], entry["repo"]) != scope:
+                continue
+            similarity = float(np.mean(entry["minhash"] == values))
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        return best
+
+    def get(self, signature: FailureSignature, account_id: str = "", repo: str = "") -> tuple[Optional[dict], str]:
+        """Return (entry, "exact" | "near") or (None, "miss"), looking only at the (account, repo)'s entries."""
+        entry, match = self._live(_entry_key(signature, account_id, repo)), "exact"
+        if entry is None and self.threshold <= 1:
+            values = minhash(signature)
+            entry, match = (self._nearest(signature, values, (account_id, repo)) if values is not None else None), "near"
+        if entry is None:
+            self.stats["misses"] += 1
+            return None, "miss"
+        self.stats["hits" if match == "exact" else "near_hits"] += 1
+        entry["count"] += 1
+        entry["last_seen"] = time.time()
+        self._entries.move_to_end(entry["key"])
+        return entry, match
+
+    def put(self, signature: FailureSignature, explanation: str, account_id: str = "", repo: str = ""):
+        key = _entry_key(signature, account_id, repo)
+        if key in self._entries:
+            self._remove(key)
+        now = time.time()
+        entry = {
+            "key": key,
+            "account_id": account_id,
+            "repo": repo,
+            "explanation": explanation,
+            "error_class": signature.error_class,
+            "tests": signature.tests,
+            "frames": signature.frames,
+            "count": 1,
+            "first_seen": now,
+            "last_seen": now,
+            "expires_at": now + self.ttl,
+            "minhash": minhash(signature),
+        }
+        self._entries[key] = entry
+        if entry["minhash"] is not None:
+            for band in _bands(entry["minhash"]):
+                self._buckets[band].add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def top(self, account_id: str, repo: Optional[str] = None, limit: int = 20) -> List[dict]:
+        """An account's most frequent cached failure signatures (optionally of one repo), for dashboards and triage."""
+        entries = [e for e in self._entries.values() if e["account_id"] == account_id and (repo is None or e["repo"] == repo)]
+        entries = sorted(entries, key=lambda e: e["count"], reverse=True)[:limit]
+        return [{k: v for k, v in e.items() if k != "minhash"} for e in entries]
+
+
+signature_cache = SignatureCache()
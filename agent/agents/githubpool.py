@@ -0,0 +1,337 @@
+import os
+import time
+import asyncio
+import base64
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+import httpx
+from agents.workerpool import run_blocking
+
+# --- CONFIGURATION ---
+# GitHub App credentials
+APP_ID = os.environ.get("GITHUB_APP_ID")
+PRIVATE_KEY = os.environ.get("GITHUB_PRIVATE_KEY") or ""
+
+GITHUB_API = "https://api.github.com"
+TOKEN_REFRESH_MARGIN = 300  # refresh installation tokens this many seconds before they expire
+FETCH_CONCURRENCY = int(os.environ.get("GITHUB_FETCH_CONCURRENCY", "8"))  # concurrent file fetches per call
+RATE_LIMIT_FLOOR = 50  # background work pauses when fewer GitHub requests than this remain in the window
+MAX_RETRIES = 5
+INTERACTIVE_MAX_WAIT = 5  # longest rate-limit backoff a request-serving call waits out before failing
+TREE_CACHE_SIZE = 32
+PATH_CACHE_SIZE = 4096  # path -> blob SHA resolutions kept per process
+HEAD_MAX_AGE = float(os.environ.get("GITHUB_HEAD_MAX_AGE_SECONDS", "30"))  # how long file fetches trust a resolved HEAD
+BLOB_CACHE_DIR = os.environ.get("BLOB_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".blobcache"))
+BLOB_CACHE_MAX_BYTES = int(os.environ.get("BLOB_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+class BlobCache:
+    """
+    On-disk LRU of decoded file contents keyed by git blob SHA. Blobs are immutable, so
+    entries never go stale; the least recently used are deleted once the cache exceeds
+    max_bytes. get and put do disk IO: call them through run_blocking.
+    """
+
+    def __init__(self, root=BLOB_CACHE_DIR, max_bytes=BLOB_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries: Optional[OrderedDict[str, int]] = None  # sha -> size, oldest first
+        self._size = 0
+        self._lock = threading.Lock()  # worker threads share the LRU bookkeeping
+
+    def _path(self, sha):
+        return os.path.join(self.root, sha[:2], sha)
+
+    def _load(self):
+        """Rebuild LRU order from file mtimes the first time the cache is used."""
+        if self._entries is not None:
+            return
+        found = []
+        if os.path.isdir(self.root):
+            for shard in os.scandir(self.root):
+                if shard.is_dir():
+                    for entry in os.scandir(shard.path):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name, stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((sha, size) for _, sha, size in found)
+        self._size = sum(size for _, _, size in found)
+
+    def get(self, sha) -> Optional[str]:
+        with self._lock:
+            self._load()
+            known = sha in self._entries
+        if known:
+            try:
+                with open(self._path(sha), encoding="utf-8") as f:
+                    content = f.read()
+                os.utime(self._path(sha))
+            except FileNotFoundError:
+                known = False
+        with self._lock:
+            if not known:
+                if sha in self._entries:
+                    self._size -= self._entries.pop(sha)  # evicted, or deleted behind our back
+                self.stats["misses"] += 1
+                return None
+            if sha in self._entries:
+                self._entries.move_to_end(sha)
+            self.stats["hits"] += 1
+        return content
+
+    def put(self, sha, content: str):
+        with self._lock:
+            self._load()
+            if sha in self._entries:
+                return
+        path = self._path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        with self._lock:
+            if sha in self._entries:
+                return  # another thread stored it meanwhile
+            self._entries[sha] = size
+            self._size += size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_sha, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.stats["evictions"] += 1
+                try:
+                    os.remove(self._path(old_sha))
+                except FileNotFoundError:
+                    pass
+
+
+class GitHubPool:
+    """
+    Shared GitHub access for every request. Installation tokens are cached until shortly
+    before they expire and REST calls share one keep-alive HTTP connection pool. File
+    contents go through a BlobCache; what HEAD and each fetched path resolve to is
+    remembered with its ETag, so files seen before are revalidated with conditional
+    requests or, while HEAD hasn't moved, not requested at all.
+    """
+
+    def __init__(self, app_id=APP_ID, private_key=PRIVATE_KEY, blob_cache: Optional[BlobCache] = None):
+        self.app_id = app_id
+        self.private_key = private_key
+        self.blob_cache = blob_cache or BlobCache()
+        self._tokens: dict[int, tuple[str, float]] = {}
+        self._token_locks: dict[int, asyncio.Lock] = {}
+        self._trees: OrderedDict[tuple[str, str, str], dict[str, str]] = OrderedDict()
+        self._heads: dict[tuple[str, str, str], tuple[str, Optional[str], float]] = {}  # (owner, repo, ref) -> (sha, etag, resolved at)
+        self._paths: OrderedDict[tuple[str, str, str], tuple[str, Optional[str], Optional[str]]] = OrderedDict()  # (owner, repo, path) -> (blob sha, etag, HEAD then)
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_loop = None
+        self.stats = {"token_fetches": 0, "requests": 0, "not_modified": 0, "rate_limit_waits": 0,
+                      "rate_limit_warnings": 0, "rate_limit_failures": 0}
+
+    # --- AUTH ---
+    async def token(self, installation_id: int) -> str:
+        cached = self._tokens.get(installation_id)
+        if cached and cached[1] - TOKEN_REFRESH_MARGIN > time.time():
+            return cached[0]
+        # One token exchange per installation even when many requests arrive together
+        lock = self._token_locks.setdefault(installation_id, asyncio.Lock())
+        async with lock:
+            cached = self._tokens.get(installation_id)
+            if cached and cached[1] - TOKEN_REFRESH_MARGIN > time.time():
+                return cached[0]
+            from githubkit import GitHub, AppAuthStrategy  # imported on first use; githubkit is slow to import
+            app = GitHub(AppAuthStrategy(self.app_id, self.private_key))
+            resp = (await app.rest.apps.async_create_installation_access_token(installation_id)).parsed_data
+            expires_at = resp.expires_at
+            if isinstance(expires_at, str):
+                expires_at = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._tokens[installation_id] = (resp.token, expires_at.timestamp())
+            self.stats["token_fetches"] += 1
+            return resp.token
+
+    # --- RAW REST ---
+    def _http_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop:
+            self._http = httpx.AsyncClient(
+                base_url=GITHUB_API,
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            )
+            self._http_loop = loop
+        return self._http
+
+    async def _get(self, installation_id, path, accept="application/vnd.github+json", params=None, etag=None,
+                   background=False) -> httpx.Response:
+        """
+        GET with the installation token, retrying 403/429 backoffs. With an etag the request
+        is conditional and may return a 304. Background callers (indexing) also pause near
+        the rate limit; calls serving a request only warn then, and fail rather than wait
+        out a backoff longer than INTERACTIVE_MAX_WAIT.
+        """
+        for attempt in range(MAX_RETRIES):
+            headers = {
+                "Authorization": f"Bearer {await self.token(installation_id)}",
+                "Accept": accept,
+                "X-GitHub-Api-Version": "2022-11-28",
+            }
+            if etag:
+                headers["If-None-Match"] = etag
+            self.stats["requests"] += 1
+            resp = await self._http_client().get(path, headers=headers, params=params)
+            remaining = resp.headers.get("x-ratelimit-remaining")
+            reset = resp.headers.get("x-ratelimit-reset")
+            if resp.status_code in (403, 429) and (remaining == "0" or "retry-after" in resp.headers):
+                retry_after = resp.headers.get("retry-after")
+                wait = int(retry_after) if retry_after else max(0, int(reset or 0) - time.time()) + 1
+                wait = min(wait, 2 ** attempt * 30)
+                if not background and wait > INTERACTIVE_MAX_WAIT:
+                    self.stats["rate_limit_failures"] += 1
+                    raise RuntimeError(f"GitHub rate limited ({resp.status_code}) for {path}, retry in {wait:.0f}s")
+                self.stats["rate_limit_waits"] += 1
+                print(f"⏳ GitHub rate limited ({resp.status_code}), retrying in {wait:.0f}s (attempt {attempt + 1}/{MAX_RETRIES})")
+                await asyncio.sleep(wait)
+                continue
+            if resp.status_code == 304:
+                self.stats["not_modified"] += 1  # conditional hits don't count against the rate limit
+                return resp
+            resp.raise_for_status()
+            if remaining is not None and reset is not None and int(remaining) <= RATE_LIMIT_FLOOR:
+                wait = max(0, int(reset) - time.time()) + 1
+                if background:
+                    self.stats["rate_limit_waits"] += 1
+                    print(f"⏳ GitHub rate limit low ({remaining} left), pausing for {wait:.0f}s")
+                    await asyncio.sleep(wait)
+                else:
+                    self.stats["rate_limit_warnings"] += 1
+                    print(f"⚠️ GitHub rate limit low ({remaining} left, resets in {wait:.0f}s)")
+            return resp
+        raise RuntimeError(f"GitHub rate limit retries exhausted for {path}")
+
+    async def head_commit(self, installation_id, owner, repo, ref="HEAD", max_age: float = 0.0, background=False) -> str:
+        """SHA of `ref`; reused without a request when resolved less than max_age seconds ago, else revalidated."""
+        key = (owner, repo, ref)
+        cached = self._heads.get(key)
+        if cached and time.monotonic() - cached[2] < max_age:
+            return cached[0]
+        resp = await self._get(installation_id, f"/repos/{owner}/{repo}/commits/{ref}", accept="application/vnd.github.sha",
+                               etag=cached[1] if cached else None, background=background)
+        sha = cached[0] if resp.status_code == 304 else resp.text.strip()
+        self._heads[key] = (sha, resp.headers.get("etag") or (cached[1] if cached else None), time.monotonic())
+        return sha
+
+    async def tree(self, installation_id, owner, repo, commit_sha, background=False) -> tuple[dict[str, dict], bool]:
+        """Return ({path: {"sha", "size"}}, truncated) for every blob in the commit's tree."""
+        key = (owner, repo, commit_sha)
+        if key in self._trees:
+            self._trees.move_to_end(key)
+            return self._trees[key], False
+        data = (await self._get(installation_id, f"/repos/{owner}/{repo}/git/trees/{commit_sha}", params={"recursive": "1"},
+                                background=background)).json()
+        blobs = {item["path"]: {"sha": item["sha"], "size": item.get("size", 0)} for item in data["tree"] if item["type"] == "blob"}
+        if not data.get("truncated"):
+            self._trees[key] = blobs
+            while len(self._trees) > TREE_CACHE_SIZE:
+                self._trees.popitem(last=False)
+        return blobs, bool(data.get("truncated"))
+
+    def cached_tree(self, owner, repo, commit_sha) -> Optional[dict[str, dict]]:
+        return self._trees.get((owner, repo, commit_sha))
+
+    def has_cached_tree(self, owner, repo) -> bool:
+        return any(o == owner and r == repo for o, r, _ in self._trees)
+
+    # --- CONTENT ---
+    async def blob_text(self, installation_id, owner, repo, sha, background=False) -> Optional[str]:
+        """Decoded blob content, or None for binary files."""
+        cached = await run_blocking(self.blob_cache.get, sha)
+        if cached is not None:
+            return cached
+        resp = await self._get(installation_id, f"/repos/{owner}/{repo}/git/blobs/{sha}", accept="application/vnd.github.raw",
+                               background=background)
+        try:
+            content = resp.content.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        await run_blocking(self.blob_cache.put, sha, content)
+        return content
+
+    def _remember_path(self, key, sha, etag, commit):
+        self._paths[key] = (sha, etag, commit)
+        self._paths.move_to_end(key)
+        while len(self._paths) > PATH_CACHE_SIZE:
+            self._paths.popitem(last=False)
+
+    async def _content_with_sha(self, installation_id, owner, repo, path, commit=None) -> tuple[Optional[str], Optional[str]]:
+        """
+        Content and blob SHA of a path on the default branch. A path resolved while HEAD was
+        already `commit` is served from the BlobCache without a request; one resolved earlier
+        is revalidated with its ETag, so an unchanged file costs a bodiless 304.
+        """
+        key = (owner, repo, path)
+        cached = self._paths.get(key)
+        content = etag = None
+        if cached is not None:
+            content = await run_blocking(self.blob_cache.get, cached[0])
+            if content is not None:
+                if commit is not None and cached[2] == commit:
+                    self._paths.move_to_end(key)
+                    return content, cached[0]
+                etag = cached[1]
+        resp = await self._get(installation_id, f"/repos/{owner}/{repo}/contents/{path}", etag=etag)
+        if resp.status_code == 304:
+            self._remember_path(key, cached[0], resp.headers.get("etag") or etag, commit)
+            return content, cached[0]
+        data = resp.json()
+        if isinstance(data, list) or data.get("type") != "file" or not data.get("content"):
+            return None, None
+        self._remember_path(key, data["sha"], resp.headers.get("etag"), commit)
+        cached_content = await run_blocking(self.blob_cache.get, data["sha"])
+        if cached_content is not None:
+            return cached_content, data["sha"]
+        try:
+            content = base64.b64decode(data["content"]).decode("utf-8")
+        except UnicodeDecodeError:
+            return None, data["sha"]
+        await run_blocking(self.blob_cache.put, data["sha"], content)
+        return content, data["sha"]
+
+    async def fetch_files(self, installation_id, owner, repo, paths) -> dict[str, tuple[str, str]]:
+        """
+        Fetch {path: (content, blob_sha)} concurrently. Once a repo has been seen, HEAD is
+        resolved (at most every HEAD_MAX_AGE seconds, conditionally) and paths whose blob
+        SHA is known for it, from the cached tree or an earlier fetch, cost no request; the
+        rest use the contents API. Paths that are missing, binary or not files are left out.
+        """
+        commit = None
+        if self.has_cached_tree(owner, repo) or any((owner, repo, p) in self._paths for p in paths):
+            try:
+                commit = await self.head_commit(installation_id, owner, repo, max_age=HEAD_MAX_AGE)
+            except Exception as e:
+                print(f"⚠️ Could not resolve HEAD of {owner}/{repo}, revalidating every file: {e}")
+        known = (self.cached_tree(owner, repo, commit) if commit else None) or {}
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def fetch_one(path):
+            async with semaphore:
+                try:
+                    if path in known:
+                        sha = known[path]["sha"]
+                        return path, await self.blob_text(installation_id, owner, repo, sha), sha
+                    content, sha = await self._content_with_sha(installation_id, owner, repo, path, commit)
+                    return path, content, sha
+                except Exception as e:
+                    print(f"❌ Could not fetch content for '{path}': {e}")
+                    return path, None, None
+
+        results = await asyncio.gather(*(fetch_one(p) for p in paths))
+        return {path: (content, sha) for path, content, sha in results if content is not None}
+
+
+github_pool = GitHubPool()
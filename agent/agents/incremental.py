@@ -0,0 +1,71 @@
+import os
+import hashlib
+from typing import List, Optional
+from pydantic import BaseModel
+
+# --- CONFIGURATION ---
+# Past this share of changed files a delta prompt saves little, so the PR is analyzed from scratch
+INCREMENTAL_MAX_CHANGED_FRACTION = float(os.environ.get("INCREMENTAL_MAX_CHANGED_FRACTION", "0.5"))
+
+
+class FileHash(BaseModel):
+    filename: str
+    patch_hash: str
+
+
+class Snapshot(BaseModel):
+    """What an analysis was computed from; returned with every analysis and sent back with the next push."""
+    description_hash: str = ""
+    files: List[FileHash] = []
+
+
+class FileDelta(BaseModel):
+    added: List[str] = []
+    modified: List[str] = []
+    removed: List[str] = []
+    unchanged: List[str] = []
+    description_changed: bool = False
+
+    @property
+    def changed(self) -> List[str]:
+        return self.added + self.modified
+
+    @property
+    def changed_fraction(self) -> float:
+        total = len(self.changed) + len(self.unchanged) + len(self.removed)
+        return (len(self.changed) + len(self.removed)) / total if total else 0.0
+
+    @property
+    def files_changed(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+
+def _hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def take_snapshot(pr_title: str, pr_body: str, changed_files: list) -> Snapshot:
+    return Snapshot(
+        description_hash=_hash(pr_title, pr_body or ""),
+        files=[FileHash(filename=f.get("filename", "unknown"), patch_hash=_hash(f.get("patch") or "")) for f in changed_files],
+    )
+
+def compare(previous: Optional[Snapshot], current: Snapshot) -> Optional[FileDelta]:
+    """Which files changed between two snapshots; None without a previous snapshot."""
+    if previous is None or not previous.files:
+        return None
+    before = {f.filename: f.patch_hash for f in previous.files}
+    delta = FileDelta(description_changed=previous.description_hash != current.description_hash)
+    for f in current.files:
+        if f.filename not in before:
+            delta.added.append(f.filename)
+        elif before[f.filename] != f.patch_hash:
+            delta.modified.append(f.filename)
+        else:
+            delta.unchanged.append(f.filename)
+    current_names = {f.filename for f in current.files}
+    delta.removed = [name for name in before if name not in current_names]
+    return delta
@@ -1,19 +1,52 @@
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
+from functools import lru_cache
 from langgraph.graph import StateGraph, END
 from pydantic import BaseModel, Field
 from typing import TypedDict, Any, Optional, List
 from dotenv import load_dotenv
+from agents.responsecache import SemanticResponseCache
+from agents.clients import clients
+from agents.tracing import traced_graph
+from agents.chains import chain_registry, structured_chain
 
 load_dotenv()
 
+# --- CONFIGURATION ---
+# Cosine similarity at which a previously triaged issue counts as the same issue; 0 keeps exact matches only
+ISSUE_CACHE_SIMILARITY = float(os.environ.get("ISSUE_CACHE_SIMILARITY", "0"))
+ISSUE_EMBEDDING_MODEL = os.environ.get("ISSUE_EMBEDDING_MODEL", "voyage-3-lite")
+
 # --- LANGCHAIN SETUP ---
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
+LLM_MODEL = "gemini-2.0-flash"
+
+def get_llm():
+    return clients.chat(LLM_MODEL, temperature=0)
+
+ISSUE_ANALYSIS_PROMPT = """Analyze this GitHub issue and provide a comprehensive analysis.
+
+Issue Title: {issue_title}
+Issue Description: {issue_body}
+
+Please analyze this issue and provide:
+1. A clear summary of what the issue is about
+2. Determine the type: bug (if the issue is about a bug in the repository code), feature (if issue is about adding a new functionality), enhancement (improvement), question (if issue is asking or seeking information), or danger (if the issue is asking to do something that may break the code, affect privacy, or harm the repo)
+3. Assess priority: high (critical/urgent), medium (important), or low (nice to have)
+4. Suggest specific actions to address the issue
+5. Identify related areas of the codebase that might be affected
+6. Estimate the effort required to resolve this issue
+7. Recommend appropriate labels
+
+Focus on being practical and actionable.
+
+For the labels field, provide a comma-separated list of relevant labels from: bug, feature, enhancement, question, danger.
+For the type field, choose exactly one from: bug, feature, enhancement, question, danger.
+For the priority field, choose exactly one from: high, medium, low."""
 
 # --- PYDANTIC MODELS ---
 class IssueInput(BaseModel):
     issue_title: str
     issue_body: str
+    account_id: Optional[str] = None  # cached analyses are only reused within the same account
 
 class IssueAnalysis(BaseModel):
     summary: str = Field(description="A concise summary of the issue")
@@ -24,41 +57,24 @@ class IssueAnalysis(BaseModel):
     estimated_effort: str = Field(description="Estimated time/effort to resolve this issue")
     labels: str = Field(description="Comma-separated list of relevant labels (bug, feature, enhancement, question, danger)")
 
+chain_registry.register("issue.analyze", get_llm, lambda model: structured_chain(None, model, IssueAnalysis, ISSUE_ANALYSIS_PROMPT))
+
 # --- AGENT STATE ---
 class IssueAnalysisState(TypedDict):
     issue_title: str
     issue_body: str
     analysis: Optional[IssueAnalysis]
+    analysis_failed: bool  # True when analysis is the fallback; those are never cached
 
 # --- GRAPH NODES ---
-def analyze_issue(state: IssueAnalysisState):
+async def analyze_issue(state: IssueAnalysisState):
     """Analyze the issue and generate comprehensive analysis."""
     
-    # Create structured output LLM
-    structured_llm = llm.with_structured_output(IssueAnalysis)
-    
-    prompt = f"""Analyze this GitHub issue and provide a comprehensive analysis.
-
-Issue Title: {state['issue_title']}
-Issue Description: {state['issue_body']}
-
-Please analyze this issue and provide:
-1. A clear summary of what the issue is about
-2. Determine the type: bug (if the issue is about a bug in the repository code), feature (if issue is about adding a new functionality), enhancement (improvement), question (if issue is asking or seeking information), or danger (if the issue is asking to do something that may break the code, affect privacy, or harm the repo)
-3. Assess priority: high (critical/urgent), medium (important), or low (nice to have)
-4. Suggest specific actions to address the issue
-5. Identify related areas of the codebase that might be affected
-6. Estimate the effort required to resolve this issue
-7. Recommend appropriate labels
-
-Focus on being practical and actionable.
-
-For the labels field, provide a comma-separated list of relevant labels from: bug, feature, enhancement, question, danger.
-For the type field, choose exactly one from: bug, feature, enhancement, question, danger.
-For the priority field, choose exactly one from: high, medium, low."""
+    # Structured output chain, built once and shared
+    chain = chain_registry.get("issue.analyze")
 
     try:
-        analysis = structured_llm.invoke(prompt)
+        analysis = await chain.ainvoke({"issue_title": state["issue_title"], "issue_body": state["issue_body"]})
         state["analysis"] = analysis
         return state
     except Exception as e:
@@ -73,6 +89,7 @@ For the priority field, choose exactly one from: high, medium, low."""
             estimated_effort="Unknown",
             labels="question"
         )
+        state["analysis_failed"] = True
         return state
 
 
@@ -89,16 +106,27 @@ def build_issue_agent_graph():
     return graph.compile()
 
 # --- EXPORT ---
-issue_agent_graph = build_issue_agent_graph()
+@lru_cache(maxsize=None)
+def get_issue_agent_graph():
+    return traced_graph(build_issue_agent_graph(), "issue")
 
-def run_issue_agent(issue_title: str, issue_body: str):
+def _issue_embedder():
+    return clients.embeddings(ISSUE_EMBEDDING_MODEL)
+
+# Templated and bot-filed issues (e.g. floods after a bad release) skip the LLM entirely
+issue_response_cache = SemanticResponseCache("issue", IssueAnalysis, get_embedder=_issue_embedder, threshold=ISSUE_CACHE_SIMILARITY)
+
+async def run_issue_agent(issue_title: str, issue_body: str, account_id: Optional[str] = None):
     """Run the issue analysis agent."""
     
-    state = IssueAnalysisState(
-        issue_title=issue_title,
-        issue_body=issue_body,
-        analysis=None
-    )
-    
-    result = issue_agent_graph.invoke(state)
-    return result["analysis"] 
\ No newline at end of file
+    async def analyze():
+        state = IssueAnalysisState(
+            issue_title=issue_title,
+            issue_body=issue_body,
+            analysis=None,
+            analysis_failed=False
+        )
+        result = await get_issue_agent_graph().ainvoke(state)
+        return result["analysis"], not result["analysis_failed"]
+
+    return await issue_response_cache.get_or_compute((issue_title, issue_body), analyze, scope=account_id or "") 
\ No newline at end of file
@@ -0,0 +1,176 @@
+import os
+import re
+import math
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Awaitable, Callable, Optional
+from agents.pathindex import tokenize, BM25_K1, BM25_B
+from agents.workerpool import run_blocking
+from agents.vectorstore import RESULT_FIELDS
+from agents.singleflight import SingleFlight
+
+# --- CONFIGURATION ---
+LEXICAL_INDEX_CACHE_SIZE = int(os.environ.get("LEXICAL_INDEX_CACHE_SIZE", "32"))  # repos kept in memory
+# Other workers update the chunk store too; a repo's index is reloaded after this long
+LEXICAL_INDEX_TTL = int(os.environ.get("LEXICAL_INDEX_TTL_SECONDS", "300"))
+IDENTIFIER_WEIGHT = 2.0  # a whole identifier or error word matched verbatim beats its split parts
+
+_IDENTIFIER = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*")
+
+
+def code_terms(text: str) -> dict[str, float]:
+    """
+    Term weights for code or a question about it: the split, lowercased parts of every
+    identifier (as for paths), plus whole compound identifiers such as `getUserById` or
+    `MAX_RETRIES` so a query naming one exactly ranks its definition first.
+    """
+    terms: dict[str, float] = defaultdict(float)
+    for token in tokenize(text):
+        terms[token] += 1.0
+    for identifier in _IDENTIFIER.findall(text):
+        whole = identifier.lower()
+        if len(whole) >= 4 and len(tokenize(identifier)) > 1:
+            terms[whole] += IDENTIFIER_WEIGHT
+    return terms
+
+
+class ChunkIndex:
+    """
+    BM25 over the chunks of one repo, updated in place as files are re-chunked. Searches
+    run on worker threads while updates arrive, so every method holds the index's lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.postings: dict[str, dict[str, float]] = defaultdict(dict)  # term -> chunk id -> tf
+        self.chunks: dict[str, dict] = {}  # chunk id -> the RESULT_FIELDS of the chunk
+        self.terms: dict[str, tuple[str, ...]] = {}  # chunk id -> its terms, for removal
+        self.lengths: dict[str, float] = {}
+        self.by_file: dict[str, set[str]] = defaultdict(set)
+        self.total_length = 0.0
+        self.loaded_at = time.monotonic()
+
+    def add(self, docs: list[dict]):
+        """Index chunk documents, replacing whatever was indexed for their files before."""
+        terms = [code_terms(doc["content"]) for doc in docs]  # before taking the lock, so searches aren't held up
+        with self._lock:
+            self._remove_files({d["filepath"] for d in docs})
+            for doc, doc_terms in zip(docs, terms):
+                self._add(doc, doc_terms)
+
+    def remove_files(self, filepaths):
+        with self._lock:
+            self._remove_files(filepaths)
+
+    def _add(self, doc: dict, terms: dict[str, float]):
+        chunk_id = f"{doc['filepath']}#{doc.get('chunkIndex', 0)}"
+        for term, tf in terms.items():
+            self.postings[term][chunk_id] = tf
+        self.chunks[chunk_id] = {k: doc.get(k) for k in RESULT_FIELDS}
+        self.terms[chunk_id] = tuple(terms)
+        self.lengths[chunk_id] = sum(terms.values())
+        self.total_length += self.lengths[chunk_id]
+        self.by_file[doc["filepath"]].add(chunk_id)
+
+    def _remove_files(self, filepaths):
+        for filepath in filepaths:
+            for chunk_id in self.by_file.pop(filepath, ()):
+                del self.chunks[chunk_id]
+                for term in self.terms.pop(chunk_id):
+                    postings = self.postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del self.postings[term]
+                self.total_length -= self.lengths.pop(chunk_id)
+
+    def search(self, query: str, top_k: int, filepaths: Optional[list[str]] = None) -> list[dict]:
+        """Top chunks by BM25, optionally only from some files; each result carries a `lexical_score`."""
+        with self._lock:
+            return self._search(query, top_k, filepaths)
+
+    def _search(self, query: str, top_k: int, filepaths: Optional[list[str]]) -> list[dict]:
+        n = len(self.chunks)
+        if not n:
+            return []
+        allowed = None
+        if filepaths is not None:
+            allowed = set().union(*(self.by_file.get(fp, set()) for fp in filepaths)) if filepaths else set()
+        avg_length = self.total_length / n
+        scores: dict[str, float] = defaultdict(float)
+        for term, weight in code_terms(query).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                if allowed is not None and chunk_id not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / avg_length)
+                scores[chunk_id] += weight * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [{**self.chunks[chunk_id], "lexical_score": round(score, 4)} for chunk_id, score in ranked]
+
+
+class LexicalIndexCache:
+    """
+    LRU of per-repo ChunkIndex objects, loaded from the chunk store on first use and
+    reloaded after `ttl`. Queries that arrive while a repo loads share that one load.
+    """
+
+    def __init__(self, max_size: int = LEXICAL_INDEX_CACHE_SIZE, ttl: int = LEXICAL_INDEX_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], ChunkIndex] = OrderedDict()
+        self._loads = SingleFlight("lexical_index", ttl=0, max_size=0)  # coalesces in-flight loads only
+        self._loading: dict[tuple[str, str], list[tuple[str, tuple]]] = {}  # updates made while a repo loads
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0, "chunks": 0}
+
+    def summary(self) -> dict:
+        return {**self.stats, "coalesced_loads": self._loads.stats["coalesced"]}
+
+    async def get(self, account_id: str, repo: str, load: Callable[[], Awaitable[list[dict]]]) -> ChunkIndex:
+        key = (account_id, repo)
+        index = self._entries.get(key)
+        if index is not None and time.monotonic() - index.loaded_at < self.ttl:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return index
+        return await self._loads.run(f"{account_id}|{repo}", lambda: self._load(key, load))
+
+    async def _load(self, key: tuple[str, str], load: Callable[[], Awaitable[list[dict]]]) -> ChunkIndex:
+        self._loading[key] = updates = []
+        try:
+            index = ChunkIndex()
+            await run_blocking(index.add, await load())
+            # Chunks stored while the repo was being read may be missing from what was read
+            for method, args in updates:
+                await run_blocking(getattr(index, method), *args)
+        finally:
+            del self._loading[key]
+        self.stats["loads"] += 1
+        self._entries[key] = index
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        self.stats["chunks"] = sum(len(i.chunks) for i in self._entries.values())
+        return index
+
+    async def _update(self, key: tuple[str, str], method: str, *args):
+        if key in self._loading:
+            self._loading[key].append((method, args))
+        index = self._entries.get(key)
+        if index is not None:
+            await run_blocking(getattr(index, method), *args)
+
+    async def index_chunks(self, account_id: str, repo: str, docs: list[dict]):
+        """Apply freshly stored chunks to a loaded repo; unloaded repos pick them up when loaded."""
+        await self._update((account_id, repo), "add", docs)
+
+    async def remove_files(self, account_id: str, repo: str, filepaths: list[str]):
+        await self._update((account_id, repo), "remove_files", filepaths)
+
+
+lexical_index_cache = LexicalIndexCache()
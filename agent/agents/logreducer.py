@@ -0,0 +1,191 @@
+import os
+import re
+import zlib
+import codecs
+from collections import deque
+from typing import AsyncIterator, Optional
+from agents.workerpool import run_blocking
+
+# --- CONFIGURATION ---
+EXCERPT_MAX_CHARS = int(os.environ.get("CI_LOG_EXCERPT_CHARS", "24000"))  # what the LLM sees, ~6k tokens
+BEFORE_CONTEXT = 8  # lines kept before an error line
+AFTER_CONTEXT = 20  # lines kept after the last error line of a window
+TAIL_LINES = 60  # the end of a failed log usually holds the final error and exit code
+MAX_WINDOWS = 40  # half from the start of the log, half from the end
+MAX_WINDOW_LINES = 200
+MAX_LINE_CHARS = 500
+
+ANSI_PATTERN = re.compile(r"\x1b\[[0-9;?]*[ -/]*[@-~]|\x1b\][^\x07]*\x07")
+TIMESTAMP_PATTERN = re.compile(
+    r"^\s*\[?(\d{4}-\d{2}-\d{2}[T ])?\d{2}:\d{2}:\d{2}([.,]\d+)?(Z|[+-]\d{2}:?\d{2})?\]?\s+"
+)
+ERROR_PATTERN = re.compile(
+    r"(error|exception|traceback|fatal|panic|failed|failure|assert|segmentation fault|timed? ?out|"
+    r"killed|exit code [1-9]|exited with [1-9]|\bFAIL\b|npm ERR!|##\[error\]|✗|✕)",
+    re.IGNORECASE,
+)
+# Summary lines that mention errors without reporting one
+BENIGN_PATTERN = re.compile(r"\b(0|no) (errors?|failures?|failed)\b", re.IGNORECASE)
+_DIGITS = re.compile(r"\d+")
+
+
+def clean_line(line: str) -> str:
+    # Progress bars redraw with \r; only the last state of the line matters
+    line = line.rsplit("\r", 1)[-1]
+    line = ANSI_PATTERN.sub("", line)
+    line = TIMESTAMP_PATTERN.sub("", line, count=1).rstrip()
+    if len(line) > MAX_LINE_CHARS:
+        line = line[:MAX_LINE_CHARS] + " [...]"
+    return line
+
+def is_error_line(line: str) -> bool:
+    return bool(ERROR_PATTERN.search(line)) and not BENIGN_PATTERN.search(line)
+
+
+class LogReducer:
+    """
+    Reduce a CI log to the parts worth explaining, fed one chunk at a time. Memory stays
+    bounded by the context/window/tail limits no matter how long the log is.
+    """
+
+    def __init__(self):
+        self._partial = ""
+        self._line_no = 0
+        self._before: deque[tuple[int, str]] = deque(maxlen=BEFORE_CONTEXT)
+        self._tail: deque[tuple[int, str]] = deque(maxlen=TAIL_LINES)
+        self._window: Optional[list[tuple[int, str]]] = None
+        self._after_left = 0
+        self._first_windows: list[list[tuple[int, str]]] = []
+        self._last_windows: deque[list[tuple[int, str]]] = deque(maxlen=MAX_WINDOWS // 2)
+        self._last_key: Optional[str] = None
+        self._repeats = 0
+        self.stats = {"chars": 0, "lines": 0, "collapsed_lines": 0, "windows": 0}
+
+    # --- INPUT ---
+    def feed(self, chunk: str):
+        self.stats["chars"] += len(chunk)
+        lines = (self._partial + chunk).split("\n")
+        self._partial = lines.pop()
+        # A "line" without newlines for megabytes is minified output; keep only its start
+        if len(self._partial) > MAX_LINE_CHARS * 4:
+            self._partial = self._partial[:MAX_LINE_CHARS * 4]
+        for line in lines:
+            self._line(line)
+
+    def close(self):
+        if self._partial:
+            self._line(self._partial)
+            self._partial = ""
+        self._flush_repeats()
+        self._close_window()
+
+    def _line(self, raw: str):
+        self._line_no += 1
+        self.stats["lines"] += 1
+        line = clean_line(raw)
+        # Collapse runs of lines that differ only in numbers (progress, retries, counters)
+        key = _DIGITS.sub("#", line)
+        if key == self._last_key:
+            self._repeats += 1
+            self.stats["collapsed_lines"] += 1
+            return
+        self._flush_repeats()
+        self._last_key = key
+        self._emit(line)
+
+    def _flush_repeats(self):
+        if self._repeats:
+            self._emit(f"[... previous line repeated {self._repeats} more times]")
+            self._repeats = 0
+
+    # --- WINDOWS ---
+    def _emit(self, line: str):
+        entry = (self._line_no, line)
+        self._tail.append(entry)
+        error = is_error_line(line)
+        if self._window is not None:
+            self._window.append(entry)
+            if error:
+                self._after_left = AFTER_CONTEXT
+            else:
+                self._after_left -= 1
+            if self._after_left <= 0 or len(self._window) >= MAX_WINDOW_LINES:
+                self._close_window()
+        elif error:
+            self._window = list(self._before) + [entry]
+            self._after_left = AFTER_CONTEXT
+            self._before.clear()
+        else:
+            self._before.append(entry)
+
+    def _close_window(self):
+        if not self._window:
+            self._window = None
+            return
+        self.stats["windows"] += 1
+        if len(self._first_windows) < MAX_WINDOWS // 2:
+            self._first_windows.append(self._window)
+        else:
+            self._last_windows.append(self._window)
+        self._window = None
+
+    # --- OUTPUT ---
+    def excerpt(self, max_chars: int = EXCERPT_MAX_CHARS) -> str:
+        """Error windows in log order plus the tail of the log, within max_chars."""
+        windows = self._first_windows + list(self._last_windows)
+        last_window_line = windows[-1][-1][0] if windows else 0
+        tail = [line for no, line in self._tail if no > last_window_line]
+
+        header = (
+            f"[CI log reduced from {self.stats['lines']} lines: {self.stats['windows']} error windows, "
+            f"{self.stats['collapsed_lines']} repeated lines collapsed]"
+        )
+        tail_text = "\n".join(tail)
+        tail_budget = max_chars // 4 if windows else max_chars
+        if len(tail_text) > tail_budget:
+            tail_text = tail_text[-tail_budget:]
+        budget = max_chars - len(header) - len(tail_text) - 100
+
+        # The first and last windows usually hold the root cause and the final failure
+        order = [0, len(windows) - 1] + list(range(1, len(windows) - 1)) if windows else []
+        chosen, rendered = set(), {}
+        for i in order:
+            if i in chosen:
+                continue
+            text = f"--- lines {windows[i][0][0]}-{windows[i][-1][0]} ---\n" + "\n".join(line for _, line in windows[i])
+            if len(text) > budget:
+                continue
+            chosen.add(i)
+            rendered[i] = text
+            budget -= len(text) + 2
+
+        parts = [header] + [rendered[i] for i in sorted(rendered)]
+        omitted = self.stats["windows"] - len(rendered)
+        if omitted:
+            parts.append(f"[... {omitted} more error windows omitted]")
+        if tail_text:
+            parts.append(f"--- end of log ---\n{tail_text}")
+        return "\n\n".join(parts)
+
+
+def reduce_text(log_text: str, max_chars: int = EXCERPT_MAX_CHARS) -> tuple[str, dict]:
+    reducer = LogReducer()
+    reducer.feed(log_text)
+    reducer.close()
+    return reducer.excerpt(max_chars), reducer.stats
+
+async def reduce_stream(chunks: AsyncIterator[bytes], content_encoding: Optional[str] = None,
+                        max_chars: int = EXCERPT_MAX_CHARS) -> tuple[str, dict]:
+    """Reduce an uploaded log as it arrives, optionally gzip-encoded, without buffering it."""
+    reducer = LogReducer()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if content_encoding == "gzip" else None
+    async for chunk in chunks:
+        if inflater is not None:
+            chunk = inflater.decompress(chunk)
+        text = decoder.decode(chunk)
+        if text:
+            await run_blocking(reducer.feed, text)
+    reducer.feed(decoder.decode(inflater.flush() if inflater is not None else b"", final=True))
+    reducer.close()
+    return reducer.excerpt(max_chars), reducer.stats
@@ -0,0 +1,110 @@
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# --- CONFIGURATION ---
+PREFIX = "codelense_"
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _render_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help, self.type = PREFIX + name, help, "counter"
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=SECONDS_BUCKETS):
+        self.name, self.help, self.type = PREFIX + name, help, "histogram"
+        self.buckets = tuple(buckets)
+        self._values: Dict[Labels, List[float]] = {}  # per-bucket counts, then +Inf count and sum
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[bisect.bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        out = []
+        with self._lock:
+            for labels, row in self._values.items():
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, row):
+                    cumulative += count
+                    out.append((self.name + "_bucket", labels + (("le", _number(bound)),), cumulative))
+                cumulative += row[len(self.buckets)]
+                out.append((self.name + "_bucket", labels + (("le", "+Inf"),), cumulative))
+                out.append((self.name + "_count", labels, cumulative))
+                out.append((self.name + "_sum", labels, row[-1]))
+        return out
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms in the Prometheus text format, without a client library.
+    Collectors are callables run at scrape time that yield (name, labels, value) gauge
+    samples, so existing `stats` dicts are exported without being rewritten as metrics.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Tuple[str, str, Callable[[], Iterable[Tuple[dict, float]]]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets=SECONDS_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def gauge_collector(self, name: str, help: str, collect: Callable[[], Iterable[Tuple[dict, float]]]):
+        self._collectors.append((PREFIX + name, help, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_render_labels(labels)} {_number(value)}")
+        for name, help, collect in self._collectors:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in collect():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"{name}{_render_labels(_labels(labels))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
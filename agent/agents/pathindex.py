@@ -0,0 +1,143 @@
+import os
+import re
+import math
+from collections import OrderedDict, defaultdict
+from typing import Optional
+import numpy as np
+
+# --- CONFIGURATION ---
+PATH_INDEX_CACHE_SIZE = int(os.environ.get("PATH_INDEX_CACHE_SIZE", "64"))  # repos kept in memory
+BM25_K1 = 1.2
+BM25_B = 0.75
+TRIGRAM_WEIGHT = 0.5  # fuzzy matches ("auth" -> "authentication") count for less than exact tokens
+EMBEDDING_WEIGHT = 4.0
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "be", "to", "of", "in", "on", "for", "and", "or", "how",
+    "what", "where", "which", "who", "why", "does", "do", "did", "this", "that", "it", "its", "with",
+    "from", "by", "as", "at", "can", "i", "we", "you", "my", "our", "me", "code", "file", "files",
+}
+
+_CAMEL = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+_SPLIT = re.compile(r"[^A-Za-z0-9]+")
+
+def tokenize(text: str) -> list[str]:
+    """Split paths or free text into lowercase tokens on separators and camelCase boundaries."""
+    tokens = []
+    for part in _SPLIT.split(text):
+        for token in _CAMEL.split(part):
+            token = token.lower()
+            if token and token not in STOPWORDS:
+                tokens.append(token)
+    return tokens
+
+def trigrams(token: str) -> set[str]:
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PathIndex:
+    """BM25 over path components plus a trigram index for fuzzy component matches."""
+
+    def __init__(self, filepaths: list[str]):
+        self.filepaths = filepaths
+        self.filepath_set = set(filepaths)
+        self.postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        self.trigram_postings: dict[str, set[str]] = defaultdict(set)
+        self.lengths = np.zeros(len(filepaths), dtype=np.float32)
+        self.path_vectors: Optional[np.ndarray] = None
+
+        for doc_id, path in enumerate(filepaths):
+            counts: dict[str, int] = defaultdict(int)
+            for token in tokenize(path):
+                counts[token] += 1
+            # The file name is what a question usually refers to; count it twice
+            for token in tokenize(os.path.basename(path)):
+                counts[token] += 1
+            self.lengths[doc_id] = sum(counts.values())
+            for token, tf in counts.items():
+                self.postings[token].append((doc_id, tf))
+        for token in self.postings:
+            for gram in trigrams(token):
+                self.trigram_postings[gram].add(token)
+        self.avg_length = float(self.lengths.mean()) if len(filepaths) else 0.0
+
+    def _bm25(self, scores: np.ndarray, token: str, weight: float):
+        postings = self.postings.get(token)
+        if not postings:
+            return
+        n = len(self.filepaths)
+        idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+        ids = np.fromiter((d for d, _ in postings), dtype=np.int64, count=len(postings))
+        tfs = np.fromiter((tf for _, tf in postings), dtype=np.float32, count=len(postings))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[ids] / self.avg_length)
+        scores[ids] += weight * idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+
+    def _similar_tokens(self, token: str) -> dict[str, float]:
+        """Indexed tokens sharing enough trigrams with `token`, with their similarity in [0, 1]."""
+        grams = trigrams(token)
+        overlap: dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self.trigram_postings.get(gram, ()):
+                overlap[candidate] += 1
+        similar = {}
+        for candidate, shared in overlap.items():
+            if candidate == token:
+                continue
+            similarity = shared / (len(grams) + len(trigrams(candidate)) - shared)
+            # Abbreviations and plurals ("auth"/"authentication", "webhook"/"webhooks") share a prefix
+            if len(candidate) >= 3 and (candidate.startswith(token) or token.startswith(candidate)):
+                similarity = max(similarity, 0.8)
+            if similarity >= 0.3:
+                similar[candidate] = similarity
+        return similar
+
+    def set_path_vectors(self, vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.path_vectors = np.asarray(vectors, dtype=np.float32) / np.maximum(norms, 1e-12)
+
+    def shortlist(self, query: str, limit: int, query_vector=None) -> list[str]:
+        """Return up to `limit` paths ranked by relevance to the query."""
+        if len(self.filepaths) <= limit:
+            return list(self.filepaths)
+        scores = np.zeros(len(self.filepaths), dtype=np.float32)
+        for token in set(tokenize(query)):
+            self._bm25(scores, token, 1.0)
+            if len(token) >= 3:
+                for similar, jaccard in self._similar_tokens(token).items():
+                    self._bm25(scores, similar, TRIGRAM_WEIGHT * jaccard)
+        if self.path_vectors is not None and query_vector is not None:
+            query = np.asarray(query_vector, dtype=np.float32)
+            scores += EMBEDDING_WEIGHT * np.maximum(self.path_vectors @ (query / max(np.linalg.norm(query), 1e-12)), 0)
+        top = np.argpartition(-scores, limit)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.filepaths[i] for i in top]
+
+
+class PathIndexCache:
+    """LRU of PathIndex objects keyed by (account, repo) and the file list version they were built from."""
+
+    def __init__(self, max_size: int = PATH_INDEX_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[tuple[str, str], tuple[str, PathIndex]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "builds": 0, "evictions": 0}
+
+    def get(self, key, version) -> Optional[PathIndex]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, key, version, index: PathIndex):
+        self.stats["builds"] += 1
+        self._entries[key] = (version, index)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+
+path_index_cache = PathIndexCache()
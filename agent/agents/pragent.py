@@ -1,10 +1,14 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.graph import StateGraph, END
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from langgraph.graph import StateGraph, START, END
 from pydantic import BaseModel
 import dotenv
-from typing import List
+import time
+from functools import lru_cache, wraps
+from typing import Annotated, Dict, List, Optional
+from agents.diffpacker import PackedDiff, pack_diff, count_tokens, render, budget_for, DEFAULT_BUDGETS
+from agents.incremental import FileDelta, Snapshot, compare, take_snapshot, INCREMENTAL_MAX_CHANGED_FRACTION
+from agents.clients import clients
+from agents.tracing import event, traced_graph
+from agents.chains import chain_registry, text_chain, structured_chain
 
 dotenv.load_dotenv()
 
@@ -44,12 +48,31 @@ AFFECTED_MODULES_PROMPT = """List the key modules or features affected by this P
 LABEL_SUGGESTION_PROMPT = """You are an AI assistant that suggests GitHub PR labels based on the PR's risk, test coverage, type, and content. Choose from: high-risk, medium-risk, low-risk, needs-tests, feature, bugfix, refactor, documentation, needs-review. Output a comma-separated list of the most relevant labels for this PR. Only include labels that are justified by the PR content."""
 
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+LLM_MODEL = "gemini-2.5-flash"
+
+def get_llm():
+    return clients.chat(LLM_MODEL)
+
+class PreviousPRAnalysis(BaseModel):
+    """The analysis returned for an earlier push of the same PR, with the snapshot it came with."""
+    summary: str = ""
+    risk: str = ""
+    suggested_tests: str = ""
+    checklist: str = ""
+    affected_modules: str = ""
+    labels: str = ""
+    snapshot: Optional[Snapshot] = None
 
 class PRInput(BaseModel):
     pr_title: str
     pr_body: str
     changed_files: list
+    account_id: Optional[str] = None  # installation account, for rate limiting
+    previous_analysis: Optional[PreviousPRAnalysis] = None
+
+def merge_dicts(left: Dict, right: Dict) -> Dict:
+    # Reducer so nodes running in the same step can each report their own entry
+    return {**(left or {}), **(right or {})}
 
 class AnalysisState(BaseModel):
     pr_title: str
@@ -61,71 +84,111 @@ class AnalysisState(BaseModel):
     checklist: str = ""
     affected_modules: str = ""
     labels: str = ""  # Comma-separated label names
+    packed_diff: Optional[PackedDiff] = None  # Hunks with token counts, built once by pack_diff
+    previous: Optional[PreviousPRAnalysis] = None
+    snapshot: Optional[Snapshot] = None  # Returned so the next push can be analyzed incrementally
+    delta: Optional[FileDelta] = None  # Set when only the files changed since `previous` are analyzed
+    dropped_files: Annotated[Dict[str, List[str]], merge_dicts] = {}  # Files left out of each node's prompt
+    node_timings: Annotated[Dict[str, float], merge_dicts] = {}  # Seconds spent in each node
 
 class LabelSuggestionOutput(BaseModel):
     labels: List[str]
 
-def summarize_pr_node(state):  # node function
-    # Include changed files information for a more comprehensive summary
-    files_info = "\n".join([f"- {f['filename']}: {f['patch'][:200]}..." for f in state.changed_files[:5]])  # Show first 5 files with truncated patches
-    input_text = f"PR Title: {state.pr_title}\n\nPR Description: {state.pr_body}\n\nChanged Files:\n{files_info}"
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", SUMMARY_SYSTEM_PROMPT),
-        ("user", "{input}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    return {"summary": chain.invoke({"input": input_text})}
-
-def estimate_risk_node(state):
-    files_text = "\n".join([f"{f['filename']}: {f['patch']}" for f in state.changed_files])
-    input_text = f"PR Title: {state.pr_title}\n\nPR Description: {state.pr_body}\n\nChanged Files:\n{files_text}"
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", RISK_SYSTEM_PROMPT),
-        ("user", "{input}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    return {"risk": chain.invoke({"input": input_text})}
-
-def suggest_tests_node(state):
-    combined = f"PR Title: {state.pr_title}\n\nPR Description: {state.pr_body}\n\nChanged Files:\n" + "\n".join([f"{f['filename']}: {f['patch']}" for f in state.changed_files])
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", TEST_SUGGESTION_PROMPT),
-        ("user", "{input}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    return {"suggested_tests": chain.invoke({"input": combined})}
-
-def generate_checklist_node(state):
-    input_text = f"PR Title: {state.pr_title}\n\nPR Description: {state.pr_body}\n\nChanged Files:\n" + "\n".join([f"{f['filename']}: {f['patch']}" for f in state.changed_files])
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", CHECKLIST_PROMPT),
-        ("user", "{input}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    return {"checklist": chain.invoke({"input": input_text})}
-
-def modules_summary_node(state):
+# Chains are built once and shared by every request; the model comes from the shared client pool on first use
+chain_registry.register("pr.summary", get_llm, lambda model: text_chain(SUMMARY_SYSTEM_PROMPT, model))
+chain_registry.register("pr.risk", get_llm, lambda model: text_chain(RISK_SYSTEM_PROMPT, model))
+chain_registry.register("pr.tests", get_llm, lambda model: text_chain(TEST_SUGGESTION_PROMPT, model))
+chain_registry.register("pr.checklist", get_llm, lambda model: text_chain(CHECKLIST_PROMPT, model))
+chain_registry.register("pr.modules", get_llm, lambda model: text_chain(AFFECTED_MODULES_PROMPT, model))
+chain_registry.register("pr.labels", get_llm, lambda model: structured_chain(LABEL_SUGGESTION_PROMPT, model, LabelSuggestionOutput))
+
+async def pack_diff_node(state):
+    # Split and size every patch once; each node then renders its own budgeted view
+    snapshot = take_snapshot(state.pr_title, state.pr_body, state.changed_files)
+    delta = compare(state.previous.snapshot, snapshot) if state.previous else None
+    if delta and (delta.description_changed or delta.changed_fraction > INCREMENTAL_MAX_CHANGED_FRACTION):
+        delta = None
+    files = state.changed_files
+    if delta is not None:
+        print(f"♻️ Incremental PR analysis: {len(delta.changed)} changed, {len(delta.removed)} removed, {len(delta.unchanged)} unchanged files")
+        changed = set(delta.changed)
+        files = [f for f in state.changed_files if f.get("filename", "unknown") in changed]
+    packed = await count_tokens(pack_diff(files), get_llm(), min(budget_for(node) for node in DEFAULT_BUDGETS))
+    update = {"packed_diff": packed, "snapshot": snapshot}
+    if delta is not None:
+        update["delta"] = delta
+    return update
+
+def diff_input(state, node, field):
+    diff, dropped = render(state.packed_diff, node)
+    input_text = f"PR Title: {state.pr_title}\n\nPR Description: {state.pr_body}\n\n"
+    if state.delta is None:
+        return input_text + f"Changed Files:\n{diff}", {node: dropped}
+    # Only the files that changed since the previous analysis are sent, with the previous result to update
+    delta = state.delta
+    input_text += (
+        f"This PR was analyzed at an earlier commit. The previous result was:\n{getattr(state.previous, field)}\n\n"
+        "Update that result for the changes since then, keeping whatever still holds, in the same format.\n"
+        f"Files unchanged since then: {', '.join(delta.unchanged) or 'none'}\n"
+        f"Files no longer changed by the PR: {', '.join(delta.removed) or 'none'}\n\n"
+        f"Files changed since the previous analysis:\n{diff}"
+    )
+    return input_text, {node: dropped}
+
+def reusable(field):
+    """Reuse the previous value of `field` when no file changed since the previous analysis."""
+    def decorate(fn):
+        @wraps(fn)
+        async def wrapper(state):
+            if state.delta is not None and not state.delta.files_changed:
+                event("cache", cache="pr_incremental", result="reused", field=field)
+                return {field: getattr(state.previous, field)}
+            return await fn(state)
+        return wrapper
+    return decorate
+
+@reusable("summary")
+async def summarize_pr_node(state):  # node function
+    # Changed files information for a more comprehensive summary, packed to the summary budget
+    input_text, dropped = diff_input(state, "summary", "summary")
+    chain = chain_registry.get("pr.summary")
+    return {"summary": await chain.ainvoke({"input": input_text}), "dropped_files": dropped}
+
+@reusable("risk")
+async def estimate_risk_node(state):
+    input_text, dropped = diff_input(state, "risk", "risk")
+    chain = chain_registry.get("pr.risk")
+    return {"risk": await chain.ainvoke({"input": input_text}), "dropped_files": dropped}
+
+@reusable("suggested_tests")
+async def suggest_tests_node(state):
+    combined, dropped = diff_input(state, "tests", "suggested_tests")
+    chain = chain_registry.get("pr.tests")
+    return {"suggested_tests": await chain.ainvoke({"input": combined}), "dropped_files": dropped}
+
+@reusable("checklist")
+async def generate_checklist_node(state):
+    input_text, dropped = diff_input(state, "checklist", "checklist")
+    chain = chain_registry.get("pr.checklist")
+    return {"checklist": await chain.ainvoke({"input": input_text}), "dropped_files": dropped}
+
+async def modules_summary_node(state):
+    # Only the file names go into this prompt, so edits to files already in the PR don't change it
+    if state.delta is not None and not (state.delta.added or state.delta.removed):
+        event("cache", cache="pr_incremental", result="reused", field="affected_modules")
+        return {"affected_modules": state.previous.affected_modules}
     files = ", ".join([f["filename"] for f in state.changed_files])
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", AFFECTED_MODULES_PROMPT),
-        ("user", "{input}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    return {"affected_modules": chain.invoke({"input": files})}
+    chain = chain_registry.get("pr.modules")
+    return {"affected_modules": await chain.ainvoke({"input": files})}
 
 
-def label_suggestion_node(state):
+@reusable("labels")
+async def label_suggestion_node(state):
     # Use the already generated analysis fields to suggest labels
     input_text = f"PR Title: {state.pr_title}\n\nPR Description: {state.pr_body}\n\nRisk: {state.risk}\nSuggested Tests: {state.suggested_tests}\nChecklist: {state.checklist}\nChanged Files: {[f['filename'] for f in state.changed_files]}"
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", LABEL_SUGGESTION_PROMPT),
-        ("user", "{input}")
-    ])
-    # Use Gemini's structured output with Pydantic
-    structured_llm = llm.with_structured_output(LabelSuggestionOutput)
-    chain = prompt | structured_llm
-    result = chain.invoke({"input": input_text})
+    # Gemini's structured output with Pydantic
+    chain = chain_registry.get("pr.labels")
+    result = await chain.ainvoke({"input": input_text})
     # Ensure result is a LabelSuggestionOutput instance
     if isinstance(result, dict):
         result = LabelSuggestionOutput(**result)
@@ -135,22 +198,52 @@ def label_suggestion_node(state):
     return {"labels": ", ".join(labels)}
 
 
+def timed_node(name, fn):
+    """Wrap a node so its wall time is reported in node_timings."""
+    @wraps(fn)
+    async def wrapper(state):
+        start = time.perf_counter()
+        update = await fn(state)
+        update["node_timings"] = {name: round(time.perf_counter() - start, 3)}
+        return update
+    return wrapper
+
+
+async def snapshot_node(state):
+    # Files left out of a prompt to fit its budget weren't analyzed; without them in the snapshot the next push analyzes them
+    dropped = {f for files in state.dropped_files.values() for f in files}
+    return {"snapshot": state.snapshot.model_copy(update={"files": [f for f in state.snapshot.files if f.filename not in dropped]})}
+
+
+# Nodes that only read the PR input and packed diff; they run concurrently in one step
+INDEPENDENT_NODES = {
+    "summarize_pr": summarize_pr_node,
+    "estimate_risk": estimate_risk_node,
+    "suggest_tests": suggest_tests_node,
+    "generate_checklist": generate_checklist_node,
+    "modules_summary": modules_summary_node,
+}
+
+
 def build_pr_agent_graph():
     builder = StateGraph(AnalysisState)
-    
-    builder.add_node("summarize_pr", summarize_pr_node)
-    builder.add_node("estimate_risk", estimate_risk_node)
-    builder.add_node("suggest_tests", suggest_tests_node)
-    builder.add_node("generate_checklist", generate_checklist_node)
-    builder.add_node("modules_summary", modules_summary_node)
-    builder.add_node("label_suggestion", label_suggestion_node)
-
-    builder.set_entry_point("summarize_pr")
-    builder.add_edge("summarize_pr", "estimate_risk")
-    builder.add_edge("estimate_risk", "suggest_tests")
-    builder.add_edge("suggest_tests", "generate_checklist")
-    builder.add_edge("generate_checklist", "modules_summary")
-    builder.add_edge("modules_summary", "label_suggestion")
-    builder.add_edge("label_suggestion", END)
+    builder.add_node("pack_diff", timed_node("pack_diff", pack_diff_node))
+    builder.add_edge(START, "pack_diff")
+
+    # Fan out from pack_diff to every independent node, then fan in on label_suggestion,
+    # which reads the risk/tests/checklist produced above
+    for name, fn in INDEPENDENT_NODES.items():
+        builder.add_node(name, timed_node(name, fn))
+        builder.add_edge("pack_diff", name)
+    builder.add_node("label_suggestion", timed_node("label_suggestion", label_suggestion_node))
+
+    builder.add_edge(list(INDEPENDENT_NODES), "label_suggestion")
+    builder.add_node("snapshot", snapshot_node)
+    builder.add_edge("label_suggestion", "snapshot")
+    builder.add_edge("snapshot", END)
 
     return builder.compile()
+
+@lru_cache(maxsize=None)
+def get_pr_agent_graph():
+    return traced_graph(build_pr_agent_graph(), "pr")
@@ -0,0 +1,221 @@
+import os
+import json
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from agents.metrics import metrics
+
+# --- CONFIGURATION ---
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")  # "memory" (per process) or "redis" (shared)
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))  # in-process keys before LRU eviction
+# "limit/period_seconds[:burst]" per endpoint; RATE_LIMITS='{"analyze-pr": "30/60"}' overrides
+DEFAULT_QUOTAS = {
+    "code-query": "2/60",
+    "analyze-pr": "10/60",
+    "analyze-refactor": "10/60",
+    "analyze-issue": "30/60",
+    "classify-ci-log": "30/60",
+}
+# Per-tenant overrides, e.g. RATE_LIMIT_TENANTS='{"12345": {"code-query": "20/60"}}'
+TENANT_QUOTAS: Dict[str, Dict[str, str]] = json.loads(os.environ.get("RATE_LIMIT_TENANTS", "{}"))
+
+decisions = metrics.counter("rate_limit_decisions_total", "Rate limit decisions by endpoint and result")
+
+
+@dataclass(frozen=True)
+class Quota:
+    limit: int
+    period: float
+    burst: int
+
+    @classmethod
+    def parse(cls, spec: str) -> "Quota":
+        rate, _, burst = spec.partition(":")
+        limit, _, period = rate.partition("/")
+        return cls(int(limit), float(period or 60), int(burst or limit))
+
+    @property
+    def emission(self) -> float:
+        """Seconds between requests at the sustained rate."""
+        return self.period / self.limit
+
+    @property
+    def tolerance(self) -> float:
+        """How far ahead of the sustained rate a key may run, i.e. the burst."""
+        return self.emission * self.burst
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # seconds until the request would be allowed; 0 when allowed
+    reset_after: float  # seconds until the bucket is full again
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+def gcra(tat: Optional[float], now: float, emission: float, tolerance: float, cost: int = 1) -> Tuple[bool, float, float]:
+    """
+    Generic cell rate algorithm. The only state per key is the theoretical arrival time
+    (TAT) of the next request. Returns (allowed, tat to store, retry_after).
+    """
+    tat = max(tat if tat is not None else now, now)
+    new_tat = tat + emission * cost
+    allow_at = new_tat - tolerance
+    if allow_at > now:
+        return False, tat, allow_at - now
+    return True, new_tat, 0.0
+
+
+# --- BACKENDS ---
+class MemoryBackend:
+    """
+    Per-process TATs, oldest-touched first. A key whose TAT has passed is indistinguishable
+    from a new key, so it is dropped; past RATE_LIMIT_MAX_KEYS the least recently seen key
+    is dropped, which at worst resets that key's bucket.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._tats: OrderedDict[str, float] = OrderedDict()
+        self.stats = {"evicted_idle": 0, "evicted_lru": 0}
+
+    async def acquire(self, key: str, emission: float, tolerance: float, cost: int) -> Tuple[bool, float, float]:
+        now = time.monotonic()
+        allowed, tat, retry_after = gcra(self._tats.get(key), now, emission, tolerance, cost)
+        self._tats[key] = tat
+        self._tats.move_to_end(key)
+        self._evict(now)
+        return allowed, retry_after, tat - now
+
+    def _evict(self, now: float):
+        # Amortized O(1): look at a couple of the least recently seen keys per call
+        for _ in range(2):
+            key, tat = next(iter(self._tats.items()))
+            if tat > now:
+                break
+            del self._tats[key]
+            self.stats["evicted_idle"] += 1
+        while len(self._tats) > self.max_keys:
+            self._tats.popitem(last=False)
+            self.stats["evicted_lru"] += 1
+
+    def summary(self) -> dict:
+        return {"backend": "memory", **self.stats, "keys": len(self._tats)}
+
+
+# GCRA in one atomic step on the Redis server, with server time so workers need no clock sync.
+# Keys expire when their bucket is full again, so idle tenants cost nothing.
+GCRA_SCRIPT = """
+redis.replicate_commands()
+local emission = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + emission * cost
+local allow_at = new_tat - tolerance
+if allow_at > now then
+  return {0, tostring(allow_at - now), tostring(tat - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0', tostring(new_tat - now)}
+"""
+
+class RedisBackend:
+    """Shared TATs in Redis, so the quota holds across every worker and replica."""
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL, client=None, prefix: str = "ratelimit:"):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package: pip install redis")
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(GCRA_SCRIPT)
+
+    async def acquire(self, key: str, emission: float, tolerance: float, cost: int) -> Tuple[bool, float, float]:
+        allowed, retry_after, offset = await self._script(keys=[self.prefix + key], args=[emission, tolerance, cost])
+        return bool(int(allowed)), float(retry_after), float(offset)
+
+    def summary(self) -> dict:
+        return {"backend": "redis"}
+
+
+def build_backend():
+    return RedisBackend() if RATE_LIMIT_BACKEND == "redis" else MemoryBackend()
+
+
+# --- LIMITER ---
+class RateLimiter:
+    """
+    Per-endpoint, per-tenant GCRA limiter. Quotas come from DEFAULT_QUOTAS/RATE_LIMITS with
+    per-tenant overrides from RATE_LIMIT_TENANTS. Endpoints without a quota are not limited.
+    A failing shared backend lets requests through rather than taking the service down.
+    """
+
+    def __init__(self, backend=None, quotas: Optional[Dict[str, str]] = None,
+                 tenant_quotas: Optional[Dict[str, Dict[str, str]]] = None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend if backend is not None else build_backend()
+        specs = quotas if quotas is not None else {**DEFAULT_QUOTAS, **json.loads(os.environ.get("RATE_LIMITS", "{}"))}
+        self.quotas = {endpoint: Quota.parse(spec) for endpoint, spec in specs.items()}
+        self.tenant_quotas = {
+            tenant: {endpoint: Quota.parse(spec) for endpoint, spec in overrides.items()}
+            for tenant, overrides in (tenant_quotas if tenant_quotas is not None else TENANT_QUOTAS).items()
+        }
+        self.enabled = enabled
+        self.stats = {"allowed": 0, "limited": 0, "backend_errors": 0}
+
+    def quota(self, endpoint: str, tenant: str) -> Optional[Quota]:
+        return self.tenant_quotas.get(tenant, {}).get(endpoint) or self.quotas.get(endpoint)
+
+    def max_cost(self, endpoint: str, tenant: str) -> Optional[int]:
+        """The most requests one call may charge (the burst); None when the endpoint is unlimited."""
+        quota = self.quota(endpoint, tenant)
+        return quota.burst if self.enabled and quota is not None else None
+
+    async def check(self, endpoint: str, tenant: str, cost: int = 1) -> Optional[Decision]:
+        """
+        Charge `cost` requests to tenant's quota for endpoint; None when the endpoint is
+        unlimited. A cost above max_cost is never allowed: reject those calls up front.
+        """
+        quota = self.quota(endpoint, tenant)
+        if not self.enabled or quota is None:
+            return None
+        try:
+            allowed, retry_after, offset = await self.backend.acquire(
+                f"{endpoint}:{tenant}", quota.emission, quota.tolerance, cost,
+            )
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            print(f"⚠️ Rate limit backend failed, allowing request: {e}")
+            return None
+        remaining = max(0, int((quota.tolerance - offset) / quota.emission))
+        decision = Decision(allowed, quota.limit, remaining, retry_after, offset)
+        self.stats["allowed" if allowed else "limited"] += 1
+        decisions.inc(endpoint=endpoint, result="allowed" if allowed else "limited")
+        return decision
+
+    def summary(self) -> dict:
+        return {**self.stats, **self.backend.summary()}
+
+
+rate_limiter = RateLimiter()
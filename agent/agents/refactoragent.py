@@ -1,12 +1,24 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
-from langchain.prompts import ChatPromptTemplate
+from agents.clients import clients
+from agents.tracing import traced_graph
+from agents.chains import chain_registry, structured_chain
+from agents.diffpacker import Hunk, PackedDiff, pack_diff, count_tokens, CHARS_PER_TOKEN, LOW_VALUE_PATTERNS, SECTION_TOKENS
+from agents.incremental import Snapshot, compare, take_snapshot
 from pydantic import BaseModel, Field
+import os
+import re
+import asyncio
 import dotenv
+from functools import lru_cache
 from typing import Any, TypedDict, List, Optional
 
 dotenv.load_dotenv()
 
+# --- CONFIGURATION ---
+SHARD_TOKENS = int(os.environ.get("REFACTOR_SHARD_TOKENS", "8000"))  # diff tokens per refactor prompt
+SHARD_CONCURRENCY = int(os.environ.get("REFACTOR_SHARD_CONCURRENCY", "4"))  # shard prompts in flight per PR
+MAX_SHARDS = int(os.environ.get("REFACTOR_MAX_SHARDS", "16"))  # files past this many shards are not reviewed
+
 REFACTOR_PROMPT = """You are an expert code reviewer and refactoring specialist. Given a pull request with changed files, analyze the code and suggest specific refactoring improvements.
 
 Focus on:
@@ -26,42 +38,178 @@ If no meaningful refactoring is needed, return an empty list.
 Analyze the PR title, body, and changed files to identify potential refactoring opportunities.
 """
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+LLM_MODEL = "gemini-2.5-flash"
 
-class RefactorInput(BaseModel):
-    pr_title: str
-    pr_body: str
-    changed_files: List[dict]
-    final_analysis: Optional[dict] = None
+def get_llm():
+    return clients.chat(LLM_MODEL)
 
 class RefactorSuggestion(BaseModel):
     file_path: str = Field(description="The file path where the refactoring suggestion applies")
     suggestion: str = Field(description="A clear description of the refactoring suggestion")
     updated_code: str = Field(description="The updated code snippet showing the refactored version", default="")
+    start_line: Optional[int] = Field(description="Line in the new version of the file where the suggestion starts, if known", default=None)
 
 class RefactorAnalysis(BaseModel):
     refactor_suggestions: List[RefactorSuggestion] = Field(description="List of refactoring suggestions for the PR", default=[])
 
-def analyze_refactor_node(state: RefactorInput) -> dict[str, Any]:
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", REFACTOR_PROMPT),
-        ("user", "PR Title: {pr_title}\nPR Body: {pr_body}\nChanged Files: {changed_files}")
-    ])
-    
-    structured_llm = llm.with_structured_output(RefactorAnalysis)
-    chain = prompt | structured_llm
-    result = chain.invoke({
-        "pr_title": state.pr_title,
-        "pr_body": state.pr_body,
-        "changed_files": state.changed_files
-    })
-    return {
-        "final_analysis": result.model_dump()
-    }
+class PreviousRefactorAnalysis(BaseModel):
+    """The suggestions returned for an earlier push of the same PR, with the snapshot they came with."""
+    refactor_suggestions: List[RefactorSuggestion] = []
+    snapshot: Optional[Snapshot] = None
+
+class RefactorInput(BaseModel):
+    pr_title: str
+    pr_body: str
+    changed_files: List[dict]
+    final_analysis: Optional[dict] = None
+    account_id: Optional[str] = None  # installation account, for rate limiting
+    previous_analysis: Optional[PreviousRefactorAnalysis] = None
+
+chain_registry.register("refactor.analyze", get_llm, lambda model: structured_chain(
+    REFACTOR_PROMPT, model, RefactorAnalysis,
+    "PR Title: {pr_title}\nPR Body: {pr_body}\nChanged Files: {changed_files}",
+))
+
+class RefactorState(RefactorInput):
+    previous: Optional[PreviousRefactorAnalysis] = None
+    snapshot: Optional[Snapshot] = None  # Returned so the next push only reviews the files it changed
+    shards: List[str] = []  # rendered diff text per shard
+    shard_files: List[List[str]] = []  # the files in each shard
+    skipped_files: List[str] = []  # lockfiles, vendored and generated files, and files past MAX_SHARDS
+    carried_suggestions: List[RefactorSuggestion] = []  # previous suggestions for files unchanged since then
+    reviewed_files: List[str] = []  # files reviewed now or, unchanged since, on an earlier push
+    shard_analyses: List[dict] = []
+
+
+def _render_shard(hunks: List[Hunk]) -> str:
+    sections, current = [], None
+    for hunk in hunks:
+        if hunk.filename != current:
+            sections.append(f"\n{hunk.filename}:")
+            current = hunk.filename
+        sections.append(hunk.text)
+    return "\n".join(sections).strip()
+
+def plan_shards(packed: PackedDiff, budget: int = SHARD_TOKENS) -> tuple[List[str], List[List[str]], List[str]]:
+    """
+    Split the reviewable hunks into shards of at most `budget` tokens, keeping the files in
+    PR order so neighbouring files land together. A file only spans shards when it is
+    bigger than a shard itself. Returns the rendered shards, the files in each and the
+    skipped files.
+    """
+    skipped = [f["filename"] for f in packed.files if LOW_VALUE_PATTERNS.search(f["filename"])]
+    by_file: dict[str, List[Hunk]] = {}
+    for hunk in packed.hunks:
+        if not hunk.low_value:
+            by_file.setdefault(hunk.filename, []).append(hunk)
+
+    shards: List[List[Hunk]] = []
+    current: List[Hunk] = []
+    used = 0
+    for filename, hunks in by_file.items():
+        header = packed.tokens(filename) + SECTION_TOKENS
+        # Start a new shard rather than split a file that fits in one on its own
+        if current and used + header + sum(h.tokens for h in hunks) > budget:
+            shards.append(current)
+            current, used = [], 0
+        for hunk in hunks:
+            cost = hunk.tokens + (header if not current or current[-1].filename != filename else 0)
+            if current and used + cost > budget:
+                shards.append(current)
+                current, used = [], 0
+                cost = hunk.tokens + header
+            if cost > budget:
+                # A single hunk bigger than a shard is cut down to fit
+                hunk = hunk.model_copy(update={"text": hunk.text[:int((budget - header) * CHARS_PER_TOKEN / packed.token_ratio)] + "\n(... hunk truncated)"})
+                cost = budget
+            current.append(hunk)
+            used += cost
+    if current:
+        shards.append(current)
+    if len(shards) > MAX_SHARDS:
+        kept = {h.filename for shard in shards[:MAX_SHARDS] for h in shard}
+        skipped += [f for f in by_file if f not in kept]
+        shards = shards[:MAX_SHARDS]
+    return [_render_shard(shard) for shard in shards], [list(dict.fromkeys(h.filename for h in shard)) for shard in shards], skipped
+
+async def plan_shards_node(state: RefactorState) -> dict[str, Any]:
+    snapshot = take_snapshot(state.pr_title, state.pr_body, state.changed_files)
+    delta = compare(state.previous.snapshot, snapshot) if state.previous else None
+    files, carried, reviewed = state.changed_files, [], []
+    if delta is not None:
+        # Suggestions are per file, so files whose patch is unchanged keep theirs whatever else changed
+        changed, unchanged = set(delta.changed), set(delta.unchanged)
+        files = [f for f in state.changed_files if f.get("filename", "unknown") in changed]
+        carried = [s for s in state.previous.refactor_suggestions if s.file_path in unchanged]
+        reviewed = delta.unchanged  # the previous snapshot only holds files that were reviewed
+        print(f"♻️ Incremental refactor review: {len(changed)} changed files, {len(carried)} suggestions kept")
+    shards, shard_files, skipped = plan_shards(await count_tokens(pack_diff(files), get_llm(), SHARD_TOKENS))
+    if skipped:
+        print(f"⏭️ Refactor review skips {len(skipped)} files: {skipped[:10]}")
+    print(f"🧩 Refactor review in {len(shards)} shards")
+    return {"shards": shards, "shard_files": shard_files, "skipped_files": skipped, "carried_suggestions": carried,
+            "reviewed_files": reviewed, "snapshot": snapshot}
+
+async def analyze_shards_node(state: RefactorState) -> dict[str, Any]:
+    chain = chain_registry.get("refactor.analyze")
+    semaphore = asyncio.Semaphore(SHARD_CONCURRENCY)
+
+    async def analyze(index: int, diff: str):
+        async with semaphore:
+            note = f"(Part {index + 1} of {len(state.shards)} of this PR; the other files are reviewed separately)\n" if len(state.shards) > 1 else ""
+            result = await chain.ainvoke({
+                "pr_title": state.pr_title,
+                "pr_body": state.pr_body,
+                "changed_files": note + diff,
+            })
+            if isinstance(result, dict):
+                result = RefactorAnalysis(**result)
+            return result.model_dump()
+
+    results = await asyncio.gather(*(analyze(i, diff) for i, diff in enumerate(state.shards)), return_exceptions=True)
+    analyses = [r for r in results if not isinstance(r, Exception)]
+    failed = [r for r in results if isinstance(r, Exception)]
+    if failed and not analyses:
+        raise failed[0]
+    for error in failed:
+        print(f"⚠️ Refactor shard failed, continuing with the others: {error}")
+    # A file split across shards only counts as reviewed when every part of it was
+    failed_files = {f for files, r in zip(state.shard_files, results) if isinstance(r, Exception) for f in files}
+    reviewed = {f for files, r in zip(state.shard_files, results) if not isinstance(r, Exception) for f in files} - failed_files
+    return {"shard_analyses": analyses, "reviewed_files": state.reviewed_files + sorted(reviewed)}
+
+def _suggestion_key(suggestion: RefactorSuggestion) -> tuple:
+    if suggestion.start_line is not None:
+        return suggestion.file_path, suggestion.start_line
+    return suggestion.file_path, re.sub(r"\W+", " ", suggestion.suggestion.lower()).strip()
+
+def merge_suggestions(analyses: List[dict]) -> RefactorAnalysis:
+    """Concatenate shard suggestions, keeping the first per file and location (or per wording when no line is given)."""
+    merged: dict[tuple, RefactorSuggestion] = {}
+    for analysis in analyses:
+        for suggestion in RefactorAnalysis(**analysis).refactor_suggestions:
+            merged.setdefault(_suggestion_key(suggestion), suggestion)
+    return RefactorAnalysis(refactor_suggestions=list(merged.values()))
+
+async def merge_suggestions_node(state: RefactorState) -> dict[str, Any]:
+    carried = RefactorAnalysis(refactor_suggestions=state.carried_suggestions).model_dump()
+    merged = merge_suggestions([carried] + state.shard_analyses)
+    # Skipped files and files of failed shards stay out of the snapshot, so the next push reviews them
+    reviewed = set(state.reviewed_files)
+    snapshot = state.snapshot.model_copy(update={"files": [f for f in state.snapshot.files if f.filename in reviewed]})
+    return {"final_analysis": {**merged.model_dump(), "snapshot": snapshot.model_dump()}}
 
 def build_refactor_agent_graph():
-    builder = StateGraph(RefactorInput)
-    builder.add_node("analyze_refactor", analyze_refactor_node)
-    builder.set_entry_point("analyze_refactor")
-    builder.add_edge("analyze_refactor", END)
-    return builder.compile() 
\ No newline at end of file
+    builder = StateGraph(RefactorState)
+    builder.add_node("plan_shards", plan_shards_node)
+    builder.add_node("analyze_shards", analyze_shards_node)
+    builder.add_node("merge_suggestions", merge_suggestions_node)
+    builder.set_entry_point("plan_shards")
+    builder.add_edge("plan_shards", "analyze_shards")
+    builder.add_edge("analyze_shards", "merge_suggestions")
+    builder.add_edge("merge_suggestions", END)
+    return builder.compile()
+
+@lru_cache(maxsize=None)
+def get_refactor_agent_graph():
+    return traced_graph(build_refactor_agent_graph(), "refactor")
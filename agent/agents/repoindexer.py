@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+from datetime import datetime
+from typing import Optional, List
+from pydantic import BaseModel
+from agents.workerpool import run_blocking
+from agents.githubpool import github_pool
+from agents.codequeryagent import (
+    get_embeddings,
+    build_chunk_docs,
+    get_vector_coll,
+    get_indexjob_coll,
+    get_retrieval,
+    CHUNK_CONFIG,
+    EMBEDDING_MODEL,
+)
+from agents.vectorstore import encode_embedding
+from agents.lexicalindex import lexical_index_cache
+
+# --- CONFIGURATION ---
+FETCH_CONCURRENCY = int(os.environ.get("INDEXER_FETCH_CONCURRENCY", "8"))  # concurrent blob fetches
+# Fetched files waiting on embeddings; enough that their chunks fill the embedder's batches
+EMBED_FILE_CONCURRENCY = int(os.environ.get("INDEXER_EMBED_FILE_CONCURRENCY", "64"))
+MAX_FILE_BYTES = 512 * 1024  # larger files are almost always generated or vendored
+
+# One indexing run per repo at a time; later pushes queue behind the current run
+_repo_locks: dict[tuple[str, str], asyncio.Lock] = {}
+
+# --- PYDANTIC MODELS ---
+class IndexRepoInput(BaseModel):
+    account_id: str
+    repo: str
+    owner: str
+    installation_id: int
+    changed_paths: Optional[List[str]] = None  # None walks the whole tree
+    removed_paths: List[str] = []
+
+# --- GITHUB HELPERS ---
+async def list_repo_blobs(installation_id, owner, repo_name):
+    """
+    Return ({path: blob_sha} for every indexable file on the default branch, truncated).
+    A truncated tree is missing files, so absence from it doesn't mean a file was deleted.
+    """
+    # Rate limiting and retries are handled by the shared GitHub pool
+    commit_sha = await github_pool.head_commit(installation_id, owner, repo_name, background=True)
+    tree, truncated = await github_pool.tree(installation_id, owner, repo_name, commit_sha, background=True)
+    if truncated:
+        print(f"⚠️ Tree for {owner}/{repo_name} was truncated by GitHub, indexing the returned part without removing anything")
+    return {path: item["sha"] for path, item in tree.items() if (item["size"] or 0) <= MAX_FILE_BYTES}, truncated
+
+# --- INDEX HELPERS ---
+async def _indexed_shas(account_id, repo):
+    """Map filepath -> blobSha for chunks already stored with the current chunk/embedding config."""
+    rows = await run_blocking(lambda: list(get_vector_coll().aggregate([
+        {"$match": {"accountId": account_id, "repo": repo, "chunkConfig": CHUNK_CONFIG, "embeddingModel": EMBEDDING_MODEL}},
+        {"$group": {"_id": "$filepath", "blobSha": {"$first": "$blobSha"}}},
+    ])))
+    return {row["_id"]: row["blobSha"] for row in rows}
+
+async def _update_job(account_id, repo, **fields):
+    fields["updatedAt"] = datetime.utcnow()
+    await run_blocking(
+        get_indexjob_coll().update_one,
+        {"accountId": account_id, "repo": repo},
+        {"$set": fields},
+        upsert=True,
+    )
+
+async def _embed_and_store(account_id, repo, filepath, content, blob_sha):
+    docs = await run_blocking(build_chunk_docs, account_id, repo, filepath, content, blob_sha)
+    # The embedder packs chunks from concurrently indexed files into full batches and paces them
+    vectors = await get_embeddings().aembed_documents([d["content"] for d in docs])
+    for doc, vector in zip(docs, vectors):
+        doc["embedding"] = encode_embedding(vector)
+    # Replace the file's previous version only once the new chunks are fully embedded
+    await run_blocking(get_vector_coll().delete_many, {"accountId": account_id, "repo": repo, "filepath": filepath})
+    if docs:
+        await run_blocking(get_vector_coll().insert_many, docs)
+        await get_retrieval().index_chunks(account_id, repo, docs)
+        await lexical_index_cache.index_chunks(account_id, repo, docs)
+    else:
+        await get_retrieval().remove_files(account_id, repo, [filepath])
+        await lexical_index_cache.remove_files(account_id, repo, [filepath])
+    return len(docs)
+
+# --- INDEXER ---
+async def index_repository(params: IndexRepoInput):
+    """
+    Bring the codechunk index for a repo up to date.
+
+    Without changed_paths the whole default-branch tree is compared against what is
+    already indexed; with them only those paths are considered. Files are stored one at
+    a time, so a run that dies part way is resumed by simply running it again: files
+    whose blob SHA is already indexed are skipped.
+    """
+    key = (params.account_id, params.repo)
+    lock = _repo_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        start = time.perf_counter()
+        full_walk = params.changed_paths is None
+        await _update_job(params.account_id, params.repo, status="running", startedAt=datetime.utcnow(), lastError=None)
+        repo_name = params.repo.split('/')[-1]
+        stats = {"indexed": 0, "skipped": 0, "removed": 0, "failed": 0, "chunks": 0}
+
+        try:
+            tree, truncated = await list_repo_blobs(params.installation_id, params.owner, repo_name)
+            indexed = await _indexed_shas(params.account_id, params.repo)
+
+            candidates = tree if full_walk else {p: tree[p] for p in params.changed_paths if p in tree}
+            removed = set(params.removed_paths) - set(tree)
+            # A truncated tree is missing files: only the push's own removals are known deletions
+            if full_walk and not truncated:
+                removed |= set(indexed) - set(tree)
+            elif not truncated:
+                # A "changed" path that is no longer in the tree was deleted by a later commit
+                removed |= {p for p in params.changed_paths if p not in tree}
+
+            if removed:
+                result = await run_blocking(get_vector_coll().delete_many, {
+                    "accountId": params.account_id, "repo": params.repo, "filepath": {"$in": list(removed)},
+                })
+                stats["removed"] = result.deleted_count
+                await get_retrieval().remove_files(params.account_id, params.repo, list(removed))
+                await lexical_index_cache.remove_files(params.account_id, params.repo, list(removed))
+
+            pending = {p: sha for p, sha in candidates.items() if indexed.get(p) != sha}
+            stats["skipped"] = len(candidates) - len(pending)
+            print(f"📚 Indexing {params.repo}: {len(pending)} files to embed, {stats['skipped']} up to date, {len(removed)} removed")
+
+            semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+            embed_slots = asyncio.Semaphore(EMBED_FILE_CONCURRENCY)
+
+            async def index_one(filepath, blob_sha):
+                async with embed_slots:
+                    try:
+                        # Only the fetch is bounded by FETCH_CONCURRENCY; files wait for embeddings without holding it
+                        async with semaphore:
+                            content = await github_pool.blob_text(params.installation_id, params.owner, repo_name, blob_sha, background=True)
+                        if content is None:
+                            stats["skipped"] += 1
+                            return
+                        chunk_count = await _embed_and_store(params.account_id, params.repo, filepath, content, blob_sha)
+                        stats["chunks"] += chunk_count
+                        stats["indexed"] += 1
+                    except Exception as e:
+                        stats["failed"] += 1
+                        print(f"❌ Could not index '{filepath}': {e}")
+
+            await asyncio.gather(*(index_one(p, sha) for p, sha in pending.items()))
+            # Backends may hold per-file changes back; write them out once per run
+            await get_retrieval().flush(params.account_id, params.repo)
+        except Exception as e:
+            await _update_job(params.account_id, params.repo, status="failed", lastError=str(e), stats=stats)
+            raise
+
+        # Queries only trust the index of repos that have had at least one full walk
+        fields = {"status": "partial" if stats["failed"] or truncated else "ready", "stats": stats}
+        if full_walk and not truncated:
+            fields["fullWalkAt"] = datetime.utcnow()
+        await _update_job(params.account_id, params.repo, **fields)
+        stats["seconds"] = round(time.perf_counter() - start, 2)
+        print(f"✅ Indexed {params.repo}: {stats}")
+        return stats
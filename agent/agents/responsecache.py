@@ -0,0 +1,183 @@
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional, Type
+import numpy as np
+from pydantic import BaseModel
+from agents.workerpool import run_blocking
+from agents.clients import clients
+from agents.tracing import event
+
+# --- CONFIGURATION ---
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "2000"))  # entries kept in memory per cache
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESPONSE_CACHE_PERSIST = os.environ.get("RESPONSE_CACHE_PERSIST", "0") == "1"  # also store entries in MongoDB
+DB_NAME = "code-lense"
+
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_VOLATILE = re.compile(
+    r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"  # uuids
+    r"|\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{7,64}\b"  # commit shas, hashes
+    r"|\d{4}-\d{2}-\d{2}[T ][\d:.]+Z?"  # timestamps
+    r"|\b\d{5,}\b",  # run ids, issue numbers, ports
+    re.IGNORECASE,
+)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(*parts: str) -> str:
+    """Normalize text so templated or bot-generated duplicates compare equal."""
+    text = "\n".join(parts)
+    text = _HTML_COMMENT.sub(" ", text)  # issue template instructions
+    text = _VOLATILE.sub("#", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class SemanticResponseCache:
+    """
+    Cache of structured LLM responses keyed by normalized input and a scope (e.g. the
+    account). Lookups try the exact normalized text, then (when an embedder and threshold
+    are set) the most similar cached input of the same scope by cosine similarity, then
+    the optional MongoDB layer.
+    """
+
+    def __init__(self, name: str, schema: Type[BaseModel], get_embedder: Optional[Callable[[], Any]] = None, threshold: float = 0.0,
+                 max_size: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL,
+                 persist: bool = RESPONSE_CACHE_PERSIST):
+        self.name = name
+        self.schema = schema
+        self.get_embedder = get_embedder if threshold > 0 else None  # resolved on first use
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()  # key -> (response, expires_at)
+        self._keys: list[str] = []  # row order of _vectors
+        self._scopes: list[str] = []  # scope of each row of _vectors
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._collection = None
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0}
+
+    def hit_rate(self) -> float:
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"] + self.stats["persistent_hits"]
+        total = hits + self.stats["misses"]
+        return round(hits / total, 3) if total else 0.0
+
+    def summary(self) -> dict:
+        return {**self.stats, "hit_rate": self.hit_rate(), "entries": len(self._entries)}
+
+    # --- PERSISTENT LAYER ---
+    def _coll(self):
+        if self._collection is None:
+            coll = clients.mongo()[DB_NAME][f"{self.name}responsecache"]
+            coll.create_index("key", unique=True)
+            coll.create_index("createdAt", expireAfterSeconds=self.ttl)
+            self._collection = coll
+        return self._collection
+
+    async def _load(self, key, scope) -> Optional[dict]:
+        doc = await run_blocking(lambda: self._coll().find_one({"key": key}, {"response": 1, "embedding": 1}))
+        if doc is None:
+            return None
+        self._store(key, scope, doc["response"], doc.get("embedding"))
+        return doc["response"]
+
+    async def _save(self, key, scope, normalized, response, vector):
+        await run_blocking(
+            lambda: self._coll().update_one(
+                {"key": key},
+                {"$set": {"scope": scope, "normalized": normalized[:2000], "response": response, "embedding": vector,
+                          "createdAt": datetime.utcnow()}},
+                upsert=True,
+            )
+        )
+
+    # --- MEMORY LAYER ---
+    def _store(self, key, scope, response: dict, vector=None):
+        if key not in self._entries and vector is not None and self.get_embedder is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+            self._vectors = vector[None, :] if not self._keys else np.vstack([self._vectors, vector])
+            self._keys.append(key)
+            self._scopes.append(scope)
+        self._entries[key] = (response, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        if key in self._keys:
+            row = self._keys.index(key)
+            self._keys.pop(row)
+            self._scopes.pop(row)
+            self._vectors = np.delete(self._vectors, row, axis=0)
+
+    def _fresh(self, key) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _most_similar(self, vector, scope) -> Optional[str]:
+        rows = [i for i, s in enumerate(self._scopes) if s == scope]
+        if not rows:
+            return None
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self._vectors[rows] @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        best = int(np.argmax(scores))
+        return self._keys[rows[best]] if scores[best] >= self.threshold else None
+
+    # --- LOOKUP ---
+    async def get_or_compute(self, parts: tuple[str, ...], compute: Callable[[], Awaitable[tuple[BaseModel, bool]]], scope: str = ""):
+        """
+        Return the response cached for `parts` within `scope`, or await `compute()`, which
+        returns the response and whether it may be cached (fallback responses after an
+        error are not). Responses are never served across scopes.
+        """
+        normalized = normalize(*parts)
+        key = hashlib.sha256(f"{scope}\0{normalized}".encode("utf-8")).hexdigest()
+
+        cached = self._fresh(key)
+        if cached is not None:
+            self.stats["exact_hits"] += 1
+            event("cache", cache=f"{self.name}_responses", result="exact")
+            return self.schema(**cached)
+
+        vector = None
+        if self.get_embedder is not None:
+            try:
+                vector = await self.get_embedder().aembed_query(normalized[:8000])
+                similar = self._most_similar(vector, scope)
+                cached = self._fresh(similar) if similar else None
+                if cached is not None:
+                    self.stats["semantic_hits"] += 1
+                    event("cache", cache=f"{self.name}_responses", result="semantic")
+                    return self.schema(**cached)
+            except Exception as e:
+                print(f"⚠️ {self.name} cache embedding lookup failed, continuing without it: {e}")
+
+        if self.persist:
+            cached = await self._load(key, scope)
+            if cached is not None:
+                self.stats["persistent_hits"] += 1
+                event("cache", cache=f"{self.name}_responses", result="persistent")
+                return self.schema(**cached)
+
+        self.stats["misses"] += 1
+        event("cache", cache=f"{self.name}_responses", result="miss")
+        response, cacheable = await compute()
+        if cacheable:
+            data = response.model_dump()
+            self._store(key, scope, data, vector)
+            if self.persist:
+                await self._save(key, scope, normalized, data, vector)
+        return response
@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+from agents.tracing import event
+
+# --- CONFIGURATION ---
+COALESCE_TTL = float(os.environ.get("COALESCE_TTL_SECONDS", "30"))  # how long a finished result answers repeats
+COALESCE_CACHE_SIZE = int(os.environ.get("COALESCE_CACHE_SIZE", "512"))
+
+
+def payload_key(*parts: Any) -> str:
+    """Stable hash of a request payload (titles, bodies, changed files)."""
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"),
+                         default=lambda o: o.model_dump() if hasattr(o, "model_dump") else str(o))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Deduplicates identical requests. Callers with the same key while a computation is
+    running await that one computation instead of starting their own, and a result that
+    finished less than `ttl` seconds ago is returned as is, which absorbs webhook retries
+    and double-clicks. Failures are shared by the callers that were waiting but never cached.
+    """
+
+    def __init__(self, name: str, ttl: float = COALESCE_TTL, max_size: int = COALESCE_CACHE_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._recent: OrderedDict[str, tuple[Any, float]] = OrderedDict()  # key -> (result, expires_at)
+        self.stats = {"executions": 0, "coalesced": 0, "recent_hits": 0, "failures": 0}
+
+    def summary(self) -> dict:
+        return {**self.stats, "inflight": len(self._inflight), "recent": len(self._recent)}
+
+    def _remember(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            self.stats["failures"] += 1
+            return
+        self._recent[key] = (task.result(), time.monotonic() + self.ttl)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_size:
+            self._recent.popitem(last=False)
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        recent = self._recent.get(key)
+        if recent is not None:
+            if recent[1] > time.monotonic():
+                self.stats["recent_hits"] += 1
+                event("cache", cache=f"{self.name}_singleflight", result="recent")
+                return recent[0]
+            del self._recent[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            event("cache", cache=f"{self.name}_singleflight", result="coalesced")
+        else:
+            self.stats["executions"] += 1
+            event("cache", cache=f"{self.name}_singleflight", result="miss")
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._remember(key, t))
+        # A caller that goes away must not cancel the run the others are waiting on
+        return await asyncio.shield(task)
@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import secrets
+import contextvars
+from collections import deque
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableBinding
+from langchain_core.runnables.config import ensure_config
+from agents.metrics import metrics, SIZE_BUCKETS
+
+try:  # Spans are also emitted through OpenTelemetry when its API is installed
+    from opentelemetry import trace as otel_trace
+    _otel = otel_trace.get_tracer("code-lense")
+except ImportError:  # pragma: no cover
+    otel_trace = _otel = None
+
+# --- CONFIGURATION ---
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "200"))  # recent request traces kept for /traces
+UNTRACED_PATHS = {"/metrics", "/health", "/ready", "/traces"}
+CHARS_PER_TOKEN = 4  # token estimate when a provider reports no usage
+# USD per million tokens as (input, output); MODEL_PRICES='{"model": [in, out]}' overrides or adds models
+MODEL_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "voyage-code-2": (0.12, 0.0),
+    "voyage-3-lite": (0.02, 0.0),
+    **{k: tuple(v) for k, v in json.loads(os.environ.get("MODEL_PRICES", "{}")).items()},
+}
+
+# --- METRICS ---
+http_seconds = metrics.histogram("http_request_seconds", "Time until the last response byte, by route")
+http_request_bytes = metrics.histogram("http_request_bytes", "Request body size", SIZE_BUCKETS)
+http_response_bytes = metrics.histogram("http_response_bytes", "Response body size", SIZE_BUCKETS)
+node_seconds = metrics.histogram("node_seconds", "Wall time of each LangGraph node")
+node_errors = metrics.counter("node_errors_total", "LangGraph nodes that raised")
+llm_seconds = metrics.histogram("llm_seconds", "Wall time of each chat model call")
+llm_tokens = metrics.counter("llm_tokens_total", "Chat model tokens by direction (estimated when the provider reports none)")
+llm_prompt_chars = metrics.histogram("llm_prompt_chars", "Characters sent to the chat model per call", SIZE_BUCKETS)
+llm_retries = metrics.counter("llm_retries_total", "Retried chat model calls")
+llm_errors = metrics.counter("llm_errors_total", "Chat model calls that raised")
+embedding_seconds = metrics.histogram("embedding_seconds", "Wall time of each embedding call")
+embedding_texts = metrics.counter("embedding_texts_total", "Texts embedded")
+embedding_tokens = metrics.counter("embedding_tokens_total", "Estimated tokens embedded")
+cost_usd = metrics.counter("estimated_cost_usd_total", "Estimated model spend from token counts and MODEL_PRICES")
+
+
+def _price(model: str, input_tokens: int, output_tokens: int = 0) -> float:
+    price_in, price_out = MODEL_PRICES.get(model.split("/")[-1], (0.0, 0.0))
+    return (input_tokens * price_in + output_tokens * price_out) / 1e6
+
+
+# --- SPANS ---
+class Span:
+    """One timed operation, kept in-process for /traces and mirrored to an OpenTelemetry span."""
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"] = None, **attributes):
+        self.trace = trace
+        self.name = name
+        self.parent_id = parent.span_id if parent else None
+        self.attributes: Dict[str, Any] = attributes
+        self.status = "ok"
+        self.start = time.time()
+        self._perf = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.otel = None
+        if _otel is not None:
+            context = otel_trace.set_span_in_context(parent.otel) if parent is not None and parent.otel else None
+            self.otel = _otel.start_span(name, context=context, attributes=_otel_attributes(attributes))
+        span_context = self.otel.get_span_context() if self.otel else None
+        # Reuse OpenTelemetry ids when a real SDK is recording, so both views correlate
+        if span_context is not None and span_context.is_valid:
+            self.span_id = f"{span_context.span_id:016x}"
+        else:
+            self.span_id = secrets.token_hex(8)
+        trace.spans.append(self)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        if self.otel:
+            self.otel.set_attributes(_otel_attributes(attributes))
+
+    def end(self, error: Optional[BaseException] = None) -> float:
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self._perf
+            if error is not None:
+                self.status = "error"
+                self.attributes["error"] = f"{type(error).__name__}: {error}"[:500]
+            if self.otel:
+                if error is not None:
+                    self.otel.record_exception(error)
+                    self.otel.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, str(error)[:200]))
+                self.otel.end()
+        return self.seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": int(self.start * 1e9),
+            "duration_ms": round(self.seconds * 1000, 2) if self.seconds is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+def _otel_attributes(attributes: dict) -> dict:
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in attributes.items() if v is not None}
+
+
+class Trace:
+    def __init__(self, name: str, **attributes):
+        self.spans: List[Span] = []
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(self, name, **attributes)
+        context = self.root.otel.get_span_context() if self.root.otel else None
+        if context is not None and context.is_valid:
+            self.trace_id = f"{context.trace_id:032x}"
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.root.end(error)
+        recent_traces.append(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "duration_ms": self.root.to_dict()["duration_ms"],
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+recent_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+# LangChain run id -> span for runs that got one, and -> parent run id for those that didn't,
+# so a model call deep inside a chain is attributed to the node that made it
+_run_spans: Dict[UUID, Span] = {}
+_run_parents: Dict[UUID, Optional[UUID]] = {}
+
+def _span_for_run(run_id: Optional[UUID]) -> Optional[Span]:
+    while run_id is not None:
+        span = _run_spans.get(run_id)
+        if span is not None:
+            return span
+        run_id = _run_parents.get(run_id)
+    return None
+
+def current_span() -> Optional[Span]:
+    """Innermost span for the running graph node, else the request's root span."""
+    callbacks = ensure_config().get("callbacks")
+    span = _span_for_run(getattr(callbacks, "parent_run_id", None))
+    if span is not None:
+        return span
+    trace = _current_trace.get()
+    return trace.root if trace else None
+
+def event(name: str, **attributes):
+    """Record a point-in-time event (e.g. a cache hit) on the current span."""
+    span = current_span()
+    if span is None:
+        return
+    span.attributes.setdefault("events", []).append({"name": name, "at_ms": round((time.time() - span.start) * 1000, 2), **attributes})
+    if span.otel:
+        span.otel.add_event(name, _otel_attributes(attributes))
+
+
+# --- LANGGRAPH / LANGCHAIN ---
+class GraphTracer(BaseCallbackHandler):
+    """
+    Callback handler bound to a compiled graph. Every graph run, node and chat model
+    call inside it gets a span; node and model timings, token counts, prompt sizes,
+    retries and estimated cost go to the metrics registry.
+    """
+
+    run_inline = True  # bookkeeping only; don't hop to an executor per event
+
+    def __init__(self, graph: str):
+        self.graph = graph
+
+    def _start(self, run_id, parent_run_id, name, **attributes) -> Span:
+        parent = _span_for_run(parent_run_id)
+        if parent is not None:
+            span = Span(parent.trace, name, parent, **attributes)
+        else:
+            request = _current_trace.get()
+            if request is not None:
+                span = Span(request, name, request.root, **attributes)
+            else:
+                # Outside a request (background indexing, benchmarks): the graph run is its own trace
+                span = Trace(name, **attributes).root
+                span.attributes["owns_trace"] = True
+        _run_spans[run_id] = span
+        return span
+
+    def _end(self, run_id, error=None) -> Optional[Span]:
+        _run_parents.pop(run_id, None)
+        span = _run_spans.pop(run_id, None)
+        if span is not None:
+            span.end(error)
+            if span.attributes.pop("owns_trace", False):
+                recent_traces.append(span.trace)
+        return span
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # The handler only sees this graph's runs, so an unknown parent means the graph was
+        # called from outside (e.g. a batch lambda) and this is its root run
+        if parent_run_id is None or (parent_run_id not in _run_spans and parent_run_id not in _run_parents):
+            self._start(run_id, None, f"graph {self.graph}", graph=self.graph)
+        elif node and kwargs.get("name") == node:
+            self._start(run_id, parent_run_id, f"node {node}", graph=self.graph, node=node)
+        else:
+            _run_parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span is not None and "node" in span.attributes:
+            node_seconds.observe(span.seconds, graph=self.graph, node=span.attributes["node"])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        span = self._end(run_id, error)
+        if span is not None and "node" in span.attributes:
+            node_seconds.observe(span.seconds, graph=self.graph, node=span.attributes["node"])
+            node_errors.inc(graph=self.graph, node=span.attributes["node"])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or (serialized or {}).get("kwargs", {}).get("model") or "unknown"
+        prompt_chars = sum(len(str(m.content)) for batch in messages for m in batch)
+        self._start(run_id, parent_run_id, f"llm {model}", graph=self.graph,
+                    node=metadata.get("langgraph_node"), model=str(model), prompt_chars=prompt_chars)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span is None:
+            return
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        message = getattr(generation, "message", None)
+        usage = getattr(message, "usage_metadata", None) or {}
+        output_chars = len(generation.text) if generation is not None else 0
+        input_tokens = usage.get("input_tokens") or span.attributes["prompt_chars"] // CHARS_PER_TOKEN
+        output_tokens = usage.get("output_tokens") or output_chars // CHARS_PER_TOKEN
+        cost = _price(span.attributes["model"], input_tokens, output_tokens)
+        span.set(input_tokens=input_tokens, output_tokens=output_tokens, output_chars=output_chars,
+                 estimated_usage=not usage, estimated_cost_usd=round(cost, 8))
+
+        labels = {"graph": self.graph, "node": span.attributes["node"] or "", "model": span.attributes["model"]}
+        llm_seconds.observe(span.seconds, **labels)
+        llm_prompt_chars.observe(span.attributes["prompt_chars"], graph=self.graph, node=labels["node"])
+        llm_tokens.inc(input_tokens, direction="input", **labels)
+        llm_tokens.inc(output_tokens, direction="output", **labels)
+        cost_usd.inc(cost, model=labels["model"])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self._end(run_id, error)
+        if span is not None:
+            llm_errors.inc(graph=self.graph, node=span.attributes["node"] or "", model=span.attributes["model"])
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        span = _span_for_run(run_id)
+        node = span.attributes.get("node") if span else None
+        if span is not None:
+            span.set(retries=span.attributes.get("retries", 0) + 1)
+        llm_retries.inc(graph=self.graph, node=node or "")
+
+def traced_graph(graph, name: str):
+    """Bind a GraphTracer to a compiled graph; every invoke, stream and batch is traced."""
+    # Not graph.with_config: LangGraph lets a caller's callbacks (e.g. astream_events') replace
+    # bound ones, while a RunnableBinding merges both lists
+    return RunnableBinding(bound=graph, config={"callbacks": [GraphTracer(name)], "run_name": name})
+
+
+class TracedEmbeddings(Embeddings):
+    """Embedding client wrapper. Embeddings emit no LangChain callbacks, so calls are timed here."""
+
+    def __init__(self, inner: Embeddings, model: str):
+        self.inner = inner
+        self.model = model
+
+    def _record(self, op: str, texts: List[str], start_perf: float, span: Optional[Span], error=None):
+        seconds = time.perf_counter() - start_perf
+        tokens = sum(len(t) for t in texts) // CHARS_PER_TOKEN
+        embedding_seconds.observe(seconds, model=self.model, op=op)
+        embedding_texts.inc(len(texts), model=self.model, op=op)
+        embedding_tokens.inc(tokens, model=self.model)
+        cost_usd.inc(_price(self.model, tokens), model=self.model)
+        if span is not None:
+            span.set(texts=len(texts), input_tokens=tokens)
+            span.end(error)
+
+    def _span(self, op: str) -> Optional[Span]:
+        parent = current_span()
+        return Span(parent.trace, f"embed {op}", parent, model=self.model) if parent is not None else None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        span, start = self._span("documents"), time.perf_counter()
+        try:
+            vectors = self.inner.embed_documents(texts)
+        except Exception as e:
+            self._record("documents", texts, start, span, e)
+            raise
+        self._record("documents", texts, start, span)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        span, start = self._span("query"), time.perf_counter()
+        try:
+            vector = self.inner.embed_query(text)
+        except Exception as e:
+            self._record("query", [text], start, span, e)
+            raise
+        self._record("query", [text], start, span)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        span, start = self._span("documents"), time.perf_counter()
+        try:
+            vectors = await self.inner.aembed_documents(texts)
+        except Exception as e:
+            self._record("documents", texts, start, span, e)
+            raise
+        self._record("documents", texts, start, span)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        span, start = self._span("query"), time.perf_counter()
+        try:
+            vector = await self.inner.aembed_query(text)
+        except Exception as e:
+            self._record("query", [text], start, span, e)
+            raise
+        self._record("query", [text], start, span)
+        return vector
+
+
+# --- HTTP ---
+class TracingMiddleware:
+    """
+    ASGI middleware: one trace per request, rooted in a server span. Duration runs to the
+    last response byte, so streamed and NDJSON responses are measured end to end.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNTRACED_PATHS:
+            return await self.app(scope, receive, send)
+        trace = Trace(f"{scope['method']} {scope['path']}", method=scope["method"], path=scope["path"])
+        token = _current_trace.set(trace)
+        sizes = {"request": 0, "response": 0}
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def counting_receive():
+            message = await receive()
+            sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finish()
+            await send(message)
+
+        finished = {"done": False}
+
+        def finish(error=None):
+            if finished["done"]:
+                return
+            finished["done"] = True
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            trace.root.set(route=path, status_code=status["code"],
+                           request_bytes=sizes["request"], response_bytes=sizes["response"])
+            if trace.root.otel:
+                trace.root.otel.update_name(f"{scope['method']} {path}")
+            seconds = time.perf_counter() - started
+            http_seconds.observe(seconds, method=scope["method"], route=path, status=status["code"])
+            http_request_bytes.observe(sizes["request"], route=path)
+            http_response_bytes.observe(sizes["response"], route=path)
+            trace.finish(error)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        except Exception as e:
+            finish(e)
+            raise
+        finally:
+            finish()
+            _current_trace.reset(token)
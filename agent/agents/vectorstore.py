@@ -0,0 +1,659 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+import numpy as np
+from agents.workerpool import run_blocking
+
+# --- CONFIGURATION ---
+# "atlas": Atlas $vectorSearch with the local index as fallback; "local": local index only
+RETRIEVAL_BACKEND = os.environ.get("RETRIEVAL_BACKEND", "atlas")
+VECTOR_STORE_DIR = os.environ.get("VECTOR_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".vectorstore"))
+ATLAS_INDEX_NAME = "vector_index"
+IVF_MIN_VECTORS = 4096  # below this an exact scan is faster than probing clusters
+IVF_NPROBE = 8
+IVF_ITERATIONS = 8
+IVF_TRAIN_PER_LIST = 32  # k-means trains on a sample of this many vectors per cluster
+# Changed chunks are searched from a small side index and merged into a repo's persisted
+# index (re-clustered and rewritten) once they reach this many rows or this share of it
+LOCAL_COMPACT_MIN_ROWS = int(os.environ.get("LOCAL_COMPACT_MIN_ROWS", "2048"))
+LOCAL_COMPACT_RATIO = float(os.environ.get("LOCAL_COMPACT_RATIO", "0.1"))
+READINESS_INITIAL_DELAY = 0.25  # first Atlas readiness probe, doubled after each miss
+READINESS_MAX_DELAY = 4.0
+READINESS_TIMEOUT = 60.0
+# Files changed since Atlas last caught up are held in memory up to these bounds, oldest dropped first
+READINESS_MAX_PENDING_FILES = 2000
+READINESS_MAX_PENDING_ROWS = 10000
+# How codechunk and the local index hold embeddings: "float32" (as returned by the model), "int8" (a
+# quarter of the size; BSON int8 vectors, which Atlas can index) or "float16" (half; local backend only)
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "float32")
+STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+SCORE_BLOCK_ROWS = 8192  # compressed rows are widened to float32 this many at a time
+
+# How long Atlas takes to make freshly inserted chunks searchable
+index_readiness_stats = {"tracked": 0, "ready": 0, "timeouts": 0, "probes": 0, "pending_searches": 0, "pending_evictions": 0,
+                         "last_lag_seconds": None, "max_lag_seconds": 0.0, "total_lag_seconds": 0.0}
+
+# Fields copied from codechunk documents into search results
+RESULT_FIELDS = ("filepath", "chunkIndex", "content", "blobSha", "cacheKey", "startLine", "endLine", "symbols")
+
+
+def encode_embedding(vector):
+    """A model embedding as stored in codechunk under EMBEDDING_STORAGE."""
+    if EMBEDDING_STORAGE == "float32":
+        return vector
+    from bson.binary import Binary, BinaryVectorDtype
+    array = np.asarray(vector, dtype=np.float32)
+    if EMBEDDING_STORAGE == "float16":
+        return Binary(array.astype(np.float16).tobytes())
+    # Scaled per vector to use the whole int8 range; cosine similarity ignores the scale
+    peak = float(np.abs(array).max()) or 1.0
+    return Binary.from_vector(np.round(array * (127 / peak)).astype(np.int8).tolist(), BinaryVectorDtype.INT8)
+
+def decode_embedding(value) -> np.ndarray:
+    """Any stored embedding (float array, int8 vector or float16 bytes) as float32."""
+    if isinstance(value, bytes):
+        if getattr(value, "subtype", None) == 9:  # BSON vector
+            return np.asarray(value.as_vector().data, dtype=np.float32)
+        return np.frombuffer(value, dtype=np.float16).astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+def compress(vectors: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Normalized float32 rows in the EMBEDDING_STORAGE dtype, plus the per-row factor that
+    turns a dot product with them back into cosine similarity (None when it is 1).
+    """
+    if EMBEDDING_STORAGE == "float16":
+        return vectors.astype(np.float16), None
+    if EMBEDDING_STORAGE == "int8" and len(vectors):
+        peaks = np.maximum(np.abs(vectors).max(axis=1, keepdims=True), 1e-12)
+        quantized = np.round(vectors * (127 / peaks)).astype(np.int8)
+        norms = np.linalg.norm(quantized.astype(np.float32), axis=1)
+        return quantized, (1 / np.maximum(norms, 1e-12)).astype(np.float32)
+    return vectors, None
+
+
+class RetrievalBackend(ABC):
+    """Similarity search over the code chunks of one (account, repo)."""
+
+    @abstractmethod
+    async def index_chunks(self, account_id: str, repo: str, docs: list[dict]) -> None:
+        """Make freshly stored chunk documents (with embeddings) searchable, replacing older versions of their files."""
+
+    @abstractmethod
+    async def remove_files(self, account_id: str, repo: str, filepaths: list[str]) -> None:
+        """Drop every chunk of the given files."""
+
+    @abstractmethod
+    async def search(self, account_id: str, repo: str, query_vector: list[float], top_k: int, filepaths: Optional[list[str]] = None) -> list[dict]:
+        """Return the top_k most similar chunks, optionally restricted to some files."""
+
+    async def flush(self, account_id: str, repo: str) -> None:
+        """Persist changes the backend is still holding back, e.g. at the end of an indexing run."""
+
+
+# --- ATLAS ---
+class _Readiness:
+    """
+    Per-repo state shared by every request: the files changed since Atlas last caught up,
+    and the single poller that probes Atlas for the newest chunk.
+    """
+
+    def __init__(self):
+        self.behind = False
+        self.probe: Optional[dict] = None
+        self.probe_at = 0.0
+        self.since: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # filepath -> (changed at, (vectors, meta, scales) of its new chunks or None when removed), oldest first
+        self.pending: dict[str, tuple[float, Optional[tuple]]] = {}
+        self.rows = 0  # chunks held in `pending`
+        self.version = 0
+        self.index: Optional[tuple[int, "_RepoIndex"]] = None  # pending chunks as of `version`
+
+    def _drop(self, filepath):
+        _, part = self.pending.pop(filepath)
+        if part is not None:
+            self.rows -= len(part[1])
+
+    def change(self, filepath, part):
+        if filepath in self.pending:
+            self._drop(filepath)
+        self.pending[filepath] = (time.monotonic(), part)
+        self.rows += len(part[1]) if part is not None else 0
+        # Past the bounds the oldest changes are left to Atlas, which has most likely indexed them by now
+        while len(self.pending) > READINESS_MAX_PENDING_FILES or self.rows > READINESS_MAX_PENDING_ROWS:
+            self._drop(next(iter(self.pending)))
+            index_readiness_stats["pending_evictions"] += 1
+        self.version += 1
+
+    def caught_up(self, until: float):
+        """Atlas has indexed everything changed up to `until`; those files are served by Atlas again."""
+        for filepath in [fp for fp, (at, _) in self.pending.items() if at <= until]:
+            self._drop(filepath)
+        self.version += 1
+
+    def give_up(self):
+        """Stop serving changed files from memory; removed ones stay excluded from Atlas results."""
+        for filepath in [fp for fp, (_, part) in self.pending.items() if part is not None]:
+            self._drop(filepath)
+        self.version += 1
+
+
+class AtlasVectorBackend(RetrievalBackend):
+    """
+    Atlas $vectorSearch over the codechunk collection, which Atlas indexes on its own.
+
+    Writers don't wait for Atlas to catch up. index_chunks records the newest chunk (and
+    remove_files a removed file) as a probe, and a single background task per repo searches
+    for it with exponential backoff, recording the observed indexing lag in
+    index_readiness_stats. Until the probe is found, the files changed since are left out
+    of $vectorSearch and their new chunks are ranked in memory instead, so freshly embedded
+    code is searchable straight away.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._readiness: dict[tuple[str, str], _Readiness] = {}
+
+    def _pipeline(self, account_id, repo, query_vector, limit, num_candidates, filepaths=None, exclude=None):
+        query_filter = {"accountId": account_id, "repo": repo}
+        if filepaths is not None:
+            query_filter["filepath"] = {"$in": filepaths}
+        elif exclude:
+            query_filter["filepath"] = {"$nin": exclude}
+        return [
+            {
+                "$vectorSearch": {
+                    "index": ATLAS_INDEX_NAME,
+                    "queryVector": query_vector,
+                    "path": "embedding",
+                    "numCandidates": num_candidates,
+                    "limit": limit,
+                    "filter": query_filter,
+                }
+            },
+            # Atlas reports cosine/dot similarity as (1 + sim) / 2; map it back to match the local backend
+            {"$addFields": {"score": {"$subtract": [{"$multiply": [{"$meta": "vectorSearchScore"}, 2]}, 1]}}},
+            {"$project": {"embedding": 0}},
+        ]
+
+    def _any_vector(self, account_id, repo) -> Optional[list[float]]:
+        doc = self.collection.find_one({"accountId": account_id, "repo": repo, "embedding": {"$exists": True}}, {"embedding": 1})
+        return decode_embedding(doc["embedding"]).tolist() if doc else None
+
+    async def _probe(self, account_id, repo, probe) -> bool:
+        if probe.get("removed"):
+            # Caught up once the removed file's chunks no longer come back, whatever the query
+            vector = await run_blocking(self._any_vector, account_id, repo)
+            if vector is None:
+                return True
+            pipeline = self._pipeline(account_id, repo, vector, limit=1, num_candidates=10, filepaths=[probe["filepath"]])
+            return not await run_blocking(lambda: list(self.collection.aggregate(pipeline)))
+        pipeline = self._pipeline(account_id, repo, probe["embedding"], limit=1, num_candidates=10, filepaths=[probe["filepath"]])
+        results = await run_blocking(lambda: list(self.collection.aggregate(pipeline)))
+        return bool(results) and results[0].get("cacheKey") == probe["cacheKey"]
+
+    async def _poll(self, key, state: _Readiness):
+        delay = READINESS_INITIAL_DELAY
+        while True:
+            probe, probe_at, since = state.probe, state.probe_at, state.since
+            try:
+                index_readiness_stats["probes"] += 1
+                found = await self._probe(*key, probe)
+            except Exception as e:
+                print(f"⏳ Vector readiness probe failed for {key[1]}: {e}")
+                found = False
+            lag = time.monotonic() - since
+            if found and probe is state.probe:
+                index_readiness_stats["ready"] += 1
+                index_readiness_stats["last_lag_seconds"] = round(lag, 3)
+                index_readiness_stats["max_lag_seconds"] = max(index_readiness_stats["max_lag_seconds"], round(lag, 3))
+                index_readiness_stats["total_lag_seconds"] += lag
+                print(f"✅ Vector index caught up for {key[1]} after {lag:.2f}s")
+                state.caught_up(probe_at)
+                state.behind = False
+                return
+            if found:
+                delay = READINESS_INITIAL_DELAY  # a newer probe arrived while this one was in flight
+                continue
+            if lag > READINESS_TIMEOUT:
+                index_readiness_stats["timeouts"] += 1
+                print(f"⚠️ Vector index for {key[1]} still behind after {lag:.0f}s, giving up on this probe")
+                state.give_up()
+                state.behind = False
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, READINESS_MAX_DELAY)
+
+    def _track(self, key, state: _Readiness, probe: dict):
+        """Make `probe` the change to wait for, starting the repo's poller unless it is running."""
+        if not state.behind:
+            state.since = time.monotonic()
+            index_readiness_stats["tracked"] += 1
+        state.probe, state.probe_at, state.behind = probe, time.monotonic(), True
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._poll(key, state))
+
+    async def index_chunks(self, account_id, repo, docs):
+        # Documents are already in codechunk; Atlas picks them up asynchronously
+        if not docs:
+            return
+        key = (account_id, repo)
+        state = self._readiness.setdefault(key, _Readiness())
+        for filepath, part in LocalVectorBackend._split_by_file(docs).items():
+            state.change(filepath, part)
+        self._track(key, state, docs[-1])
+
+    async def remove_files(self, account_id, repo, filepaths):
+        # Atlas may still return the deleted chunks for a while; keep the files out of its results
+        if not filepaths:
+            return
+        key = (account_id, repo)
+        state = self._readiness.setdefault(key, _Readiness())
+        for filepath in filepaths:
+            state.change(filepath, None)
+        self._track(key, state, {"filepath": filepaths[-1], "removed": True})
+
+    async def _pending_index(self, state: _Readiness) -> "_RepoIndex":
+        if state.index is None or state.index[0] != state.version:
+            version = state.version
+            parts = [part for _, part in state.pending.values() if part is not None]
+            state.index = (version, await run_blocking(_RepoIndex.concat, parts))
+        return state.index[1]
+
+    async def search(self, account_id, repo, query_vector, top_k, filepaths=None):
+        state = self._readiness.get((account_id, repo))
+        pending = list(state.pending) if state is not None else []
+        if not pending:
+            pipeline = self._pipeline(account_id, repo, query_vector, limit=top_k, num_candidates=100, filepaths=filepaths)
+            return await run_blocking(lambda: list(self.collection.aggregate(pipeline)))
+
+        in_memory = pending if filepaths is None else [fp for fp in filepaths if fp in state.pending]
+        in_atlas = None if filepaths is None else [fp for fp in filepaths if fp not in state.pending]
+        results = []
+        if in_atlas is None or in_atlas:
+            pipeline = self._pipeline(account_id, repo, query_vector, limit=top_k, num_candidates=100,
+                                      filepaths=in_atlas, exclude=pending)
+            results = await run_blocking(lambda: list(self.collection.aggregate(pipeline)))
+        if in_memory:
+            index_readiness_stats["pending_searches"] += 1
+            index = await self._pending_index(state)
+            results += await run_blocking(index.search, query_vector, top_k, in_memory)
+        return sorted(results, key=lambda r: r.get("score", 0.0), reverse=True)[:top_k]
+
+
+# --- LOCAL ---
+class _RepoIndex:
+    """
+    Normalized embedding matrix, in the EMBEDDING_STORAGE dtype, plus chunk metadata for one
+    repo, with an optional IVF layer. For int8 rows `scales` maps dot products to cosines.
+    """
+
+    def __init__(self, vectors: np.ndarray, meta: list[dict], scales: Optional[np.ndarray] = None):
+        self.vectors = vectors
+        self.meta = meta
+        self.scales = scales
+        self.centroids = None
+        self.lists = None
+        self.trained_size = 0
+        self._file_rows: Optional[dict[str, np.ndarray]] = None
+
+    @property
+    def file_rows(self) -> dict[str, np.ndarray]:
+        """filepath -> the rows of its chunks, built on first use."""
+        if self._file_rows is None:
+            rows: dict[str, list[int]] = {}
+            for i, m in enumerate(self.meta):
+                rows.setdefault(m["filepath"], []).append(i)
+            self._file_rows = {filepath: np.asarray(r) for filepath, r in rows.items()}
+        return self._file_rows
+
+    def rows_of(self, filepaths) -> np.ndarray:
+        found = [self.file_rows[fp] for fp in filepaths if fp in self.file_rows]
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def concat(parts: list[tuple[np.ndarray, list[dict], Optional[np.ndarray]]]) -> "_RepoIndex":
+        """One index over several (vectors, meta, scales) parts, skipping empty ones."""
+        parts = [part for part in parts if len(part[1])]
+        if not parts:
+            return _RepoIndex(np.zeros((0, 0), dtype=np.float32), [])
+        scales = [part[2] for part in parts if part[2] is not None]
+        return _RepoIndex(
+            np.concatenate([part[0] for part in parts]),
+            [m for part in parts for m in part[1]],
+            np.concatenate(scales) if scales else None,
+        )
+
+    @staticmethod
+    def normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def dot(self, rows, matrix: np.ndarray) -> np.ndarray:
+        """Unscaled rows @ matrix, widening compressed rows a block at a time rather than all at once."""
+        rows = np.arange(len(self.vectors)) if rows is None else rows
+        out = np.empty((len(rows),) + matrix.shape[1:], dtype=np.float32)
+        for start in range(0, len(rows), SCORE_BLOCK_ROWS):
+            block = rows[start:start + SCORE_BLOCK_ROWS]
+            out[start:start + len(block)] = np.asarray(self.vectors[block], dtype=np.float32) @ matrix
+        return out
+
+    def build_ivf(self, previous: Optional["_RepoIndex"] = None):
+        """
+        Cluster vectors with a few rounds of spherical k-means on a sample, so search only
+        scans the nearest clusters. Centroids from `previous` are reused until the index has
+        doubled in size; only the cluster assignment is recomputed.
+        """
+        n = len(self.vectors)
+        if n < IVF_MIN_VECTORS:
+            self.centroids, self.lists, self.trained_size = None, None, 0
+            return
+        if previous is not None and previous.centroids is not None and n < 2 * previous.trained_size:
+            centroids, self.trained_size = previous.centroids, previous.trained_size
+        else:
+            nlist = int(np.sqrt(n))
+            rng = np.random.default_rng(0)
+            sample = self.normalize(self.vectors[np.sort(rng.choice(n, min(n, nlist * IVF_TRAIN_PER_LIST), replace=False))])
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(IVF_ITERATIONS):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = sample[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = self.normalize(centroids)
+            self.trained_size = n
+        # A row's scale doesn't change which centroid is nearest
+        assign = np.argmax(self.dot(None, centroids.T), axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assign == c) for c in range(len(centroids))]
+
+    def search(self, query_vector, top_k, filepaths=None, dead: Optional[np.ndarray] = None) -> list[dict]:
+        """Top_k rows by cosine similarity, skipping rows flagged in `dead`."""
+        if not self.meta:
+            return []
+        query = self.normalize(query_vector)[0]
+        candidates = None
+        if self.centroids is not None:
+            nearest = np.argsort(-(self.centroids @ query))[:IVF_NPROBE]
+            candidates = np.concatenate([self.lists[c] for c in nearest])
+        if filepaths is not None:
+            allowed = set(filepaths)
+            mask = np.fromiter((m["filepath"] in allowed for m in self.meta), dtype=bool, count=len(self.meta))
+            if dead is not None:
+                mask &= ~dead
+            filtered = np.flatnonzero(mask)
+            if candidates is not None:
+                probed = np.intersect1d(candidates, filtered)
+                # The probed clusters may hold too few of the allowed files; scan them all instead
+                candidates = probed if len(probed) >= top_k else filtered
+            else:
+                candidates = filtered
+        if candidates is None:
+            candidates = np.arange(len(self.meta))
+        if dead is not None:
+            candidates = candidates[~dead[candidates]]
+        if len(candidates) == 0:
+            return []
+        scores = self.dot(candidates, query)
+        if self.scales is not None:
+            scores *= self.scales[candidates]
+        order = np.argsort(-scores)[:top_k]
+        return [{**self.meta[candidates[i]], "score": float(scores[i])} for i in order]
+
+
+class _LiveIndex:
+    """
+    One repo in the local backend: its persisted _RepoIndex (`base`, loaded on first search)
+    plus the files changed since, whose new chunks are searched from a small side index.
+    The changes are merged into the base, re-clustered and persisted only once they grow
+    large or an indexing run flushes them, so storing a file doesn't rewrite the repo.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()  # guards the fields below; only held briefly
+        self.io = threading.Lock()  # one load or compaction of the repo at a time
+        self.base: Optional[_RepoIndex] = None
+        self.dead: Optional[np.ndarray] = None  # base rows superseded by `changed`
+        # filepath -> (change number, (vectors, meta, scales) of its new chunks or None when removed)
+        self.changed: dict[str, tuple[int, Optional[tuple]]] = {}
+        self.seq = 0
+        self.delta: Optional[_RepoIndex] = None  # the chunks in `changed`, built on demand
+
+    def mark_dead(self, filepaths):
+        if self.base is None:
+            return
+        rows = self.base.rows_of(filepaths)
+        if len(rows):
+            # Replaced rather than updated in place, so searches already running keep a consistent view
+            dead = self.dead.copy() if self.dead is not None else np.zeros(len(self.base.meta), dtype=bool)
+            dead[rows] = True
+            self.dead = dead
+
+    def apply(self, changes: dict[str, Optional[tuple]]) -> bool:
+        """Record the new chunks (None for removed files) of some files; True once a compaction is due."""
+        with self.lock:
+            for filepath, part in changes.items():
+                self.seq += 1
+                self.changed[filepath] = (self.seq, part)
+            self.mark_dead(changes)
+            self.delta = None
+            backlog = sum(len(part[1]) for _, part in self.changed.values() if part is not None)
+            backlog += int(self.dead.sum()) if self.dead is not None else 0
+            size = len(self.base.meta) if self.base is not None else 0
+            return backlog >= max(LOCAL_COMPACT_MIN_ROWS, size * LOCAL_COMPACT_RATIO)
+
+    def view(self) -> tuple[_RepoIndex, Optional[np.ndarray], _RepoIndex]:
+        with self.lock:
+            if self.delta is None:
+                self.delta = _RepoIndex.concat([part for _, part in self.changed.values() if part is not None])
+            return self.base, self.dead, self.delta
+
+
+class LocalVectorBackend(RetrievalBackend):
+    """
+    In-process similarity search. Each repo's embeddings are held as a normalized NumPy
+    matrix, persisted under VECTOR_STORE_DIR and reopened memory-mapped. A repo that is
+    not loaded yet is hydrated from the chunk documents (with embeddings) in codechunk.
+    """
+
+    def __init__(self, collection, root=VECTOR_STORE_DIR):
+        self.collection = collection
+        self.root = root
+        self._indexes: dict[tuple[str, str], _LiveIndex] = {}
+        self._lock = threading.Lock()  # guards _indexes only; each repo has its own locks
+
+    def _dir(self, account_id, repo):
+        digest = hashlib.sha256(f"{account_id}|{repo}".encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, digest)
+
+    def _persist(self, account_id, repo, index: _RepoIndex):
+        path = self._dir(account_id, repo)
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.tmp.npy"), np.asarray(index.vectors))
+        if index.scales is not None:
+            np.save(os.path.join(path, "scales.tmp.npy"), index.scales)
+        with open(os.path.join(path, "meta.tmp.json"), "w") as f:
+            json.dump(index.meta, f)
+        if index.scales is not None:
+            os.replace(os.path.join(path, "scales.tmp.npy"), os.path.join(path, "scales.npy"))
+        os.replace(os.path.join(path, "vectors.tmp.npy"), os.path.join(path, "vectors.npy"))
+        os.replace(os.path.join(path, "meta.tmp.json"), os.path.join(path, "meta.json"))
+        if index.scales is None:
+            # Left over from an int8 index: drop it rather than pair it with float rows later
+            try:
+                os.remove(os.path.join(path, "scales.npy"))
+            except FileNotFoundError:
+                pass
+
+    def _load_from_disk(self, account_id, repo) -> Optional[_RepoIndex]:
+        path = self._dir(account_id, repo)
+        try:
+            vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            scales = np.load(os.path.join(path, "scales.npy")) if vectors.dtype == np.int8 else None
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # Written under another EMBEDDING_STORAGE, or torn by a crash: rebuild from codechunk
+        if len(meta) != len(vectors) or (len(meta) and vectors.dtype != STORAGE_DTYPES[EMBEDDING_STORAGE]):
+            return None
+        if scales is not None and len(scales) != len(vectors):
+            return None
+        return _RepoIndex(vectors, meta, scales)
+
+    def _docs(self, account_id, repo, filepaths=None) -> list[dict]:
+        query = {"accountId": account_id, "repo": repo, "embedding": {"$exists": True}}
+        if filepaths is not None:
+            query["filepath"] = {"$in": filepaths}
+        projection = {field: 1 for field in RESULT_FIELDS}
+        projection.update({"embedding": 1, "_id": 0})
+        return list(self.collection.find(query, projection))
+
+    @staticmethod
+    def _split(docs) -> tuple[np.ndarray, list[dict], Optional[np.ndarray]]:
+        if not docs:
+            return np.zeros((0, 0), dtype=np.float32), [], None
+        vectors, scales = compress(_RepoIndex.normalize([decode_embedding(d["embedding"]) for d in docs]))
+        meta = [{field: d.get(field) for field in RESULT_FIELDS} for d in docs]
+        return vectors, meta, scales
+
+    @classmethod
+    def _split_by_file(cls, docs) -> dict[str, tuple]:
+        by_file: dict[str, list[dict]] = {}
+        for doc in docs:
+            by_file.setdefault(doc["filepath"], []).append(doc)
+        return {filepath: cls._split(file_docs) for filepath, file_docs in by_file.items()}
+
+    def _live(self, key) -> _LiveIndex:
+        with self._lock:
+            live = self._indexes.get(key)
+            if live is None:
+                live = self._indexes[key] = _LiveIndex()
+            return live
+
+    def _load(self, key, live: _LiveIndex):
+        with live.io:
+            if live.base is not None:
+                return
+            index = self._load_from_disk(*key)
+            if index is None:
+                index = _RepoIndex(*self._split(self._docs(*key)))
+                self._persist(*key, index)
+            index.build_ivf()
+            index.file_rows  # built before taking the lock
+            with live.lock:
+                live.base = index
+                live.mark_dead(live.changed)
+
+    def _compact(self, key, live: _LiveIndex):
+        """Merge the changed files into the base index, re-cluster it and persist it."""
+        with live.io:
+            with live.lock:
+                if not live.changed:
+                    return
+                snapshot, base, dead = dict(live.changed), live.base, live.dead
+            if base is None:
+                # Not loaded in this process, but other workers may serve from the persisted copy: update it.
+                # Without one, the next search hydrates from codechunk, which already holds these changes.
+                base = self._load_from_disk(*key)
+                if base is not None:
+                    dead = np.zeros(len(base.meta), dtype=bool)
+                    dead[base.rows_of(snapshot)] = True
+            merged = None
+            if base is not None:
+                keep = np.flatnonzero(~dead) if dead is not None else np.arange(len(base.meta))
+                merged = _RepoIndex.concat([
+                    (np.asarray(base.vectors[keep]), [base.meta[i] for i in keep], base.scales[keep] if base.scales is not None else None),
+                    *[part for _, part in snapshot.values() if part is not None],
+                ])
+                merged.build_ivf(previous=base)
+                self._persist(*key, merged)
+                merged.file_rows  # built before taking the lock
+            with live.lock:
+                # Files changed again during the merge stay in the side index
+                live.changed = {fp: entry for fp, entry in live.changed.items() if snapshot.get(fp) is not entry}
+                live.base, live.dead, live.delta = merged, None, None
+                live.mark_dead(live.changed)
+
+    def _apply(self, key, changes: dict[str, Optional[tuple]]):
+        live = self._live(key)
+        if live.apply(changes):
+            self._compact(key, live)
+
+    async def index_chunks(self, account_id, repo, docs):
+        if docs:
+            await run_blocking(lambda: self._apply((account_id, repo), self._split_by_file(docs)))
+
+    async def remove_files(self, account_id, repo, filepaths):
+        if filepaths:
+            await run_blocking(self._apply, (account_id, repo), dict.fromkeys(filepaths))
+
+    async def flush(self, account_id, repo):
+        live = self._indexes.get((account_id, repo))
+        if live is not None and live.changed:
+            await run_blocking(self._compact, (account_id, repo), live)
+
+    def _search(self, account_id, repo, query_vector, top_k, filepaths):
+        key = (account_id, repo)
+        live = self._live(key)
+        if live.base is None:
+            self._load(key, live)
+        if filepaths is not None:
+            # Chunks written by another worker process are pulled in on demand
+            with live.lock:
+                missing = [fp for fp in filepaths if fp not in live.changed and fp not in live.base.file_rows]
+            if missing:
+                docs = self._docs(account_id, repo, missing)
+                if docs:
+                    self._apply(key, self._split_by_file(docs))
+        base, dead, delta = live.view()
+        results = base.search(query_vector, top_k, filepaths, dead) + delta.search(query_vector, top_k, filepaths)
+        return sorted(results, key=lambda r: r["score"], reverse=True)[:top_k]
+
+    async def search(self, account_id, repo, query_vector, top_k, filepaths=None):
+        return await run_blocking(self._search, account_id, repo, query_vector, top_k, filepaths)
+
+
+# --- FALLBACK ---
+class FallbackBackend(RetrievalBackend):
+    """Serve from the primary backend, switching to the secondary when the primary errors."""
+
+    def __init__(self, primary: RetrievalBackend, secondary: RetrievalBackend):
+        self.primary = primary
+        self.secondary = secondary
+
+    async def index_chunks(self, account_id, repo, docs):
+        await self.primary.index_chunks(account_id, repo, docs)
+        await self.secondary.index_chunks(account_id, repo, docs)
+
+    async def remove_files(self, account_id, repo, filepaths):
+        await self.primary.remove_files(account_id, repo, filepaths)
+        await self.secondary.remove_files(account_id, repo, filepaths)
+
+    async def flush(self, account_id, repo):
+        await self.primary.flush(account_id, repo)
+        await self.secondary.flush(account_id, repo)
+
+    async def search(self, account_id, repo, query_vector, top_k, filepaths=None):
+        try:
+            return await self.primary.search(account_id, repo, query_vector, top_k, filepaths)
+        except Exception as e:
+            print(f"❌ Primary vector search failed, using local index: {e}")
+            return await self.secondary.search(account_id, repo, query_vector, top_k, filepaths)
+
+
+def build_retrieval_backend(collection) -> RetrievalBackend:
+    # Atlas can't index float16 bytes
+    if RETRIEVAL_BACKEND == "local" or EMBEDDING_STORAGE == "float16":
+        return LocalVectorBackend(collection)
+    return FallbackBackend(AtlasVectorBackend(collection), LocalVectorBackend(collection))
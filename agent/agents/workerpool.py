@@ -0,0 +1,19 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# --- CONFIGURATION ---
+# Upper bound on threads used for calls that have no async client (pymongo, text splitting)
+MAX_WORKERS = int(os.environ.get("AGENT_MAX_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="agent-worker")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a synchronous call on the bounded worker pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+def shutdown():
+    """Stop accepting work and wait for in-flight blocking calls."""
+    _executor.shutdown(wait=True)
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the per-request LangChain and Pydantic overhead.
+
+Uses a zero-latency fake model so only framework work is measured: building
+prompt/structured-output chains, formatting prompts, running a chain end to
+end, and validating the Pydantic models the agents pass around. Compares the
+old per-request chain construction with the shared chain registry.
+
+Usage: python -m benchmarks.chain_overhead [--iterations 2000]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Clients are constructed at import; dummy credentials keep them offline
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("VOYAGE_API_KEY", "benchmark")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+from agents import pragent, citestagent, issueagent
+from agents.chains import chain_registry, text_chain, structured_chain
+from agents.clients import clients
+from benchmarks.fakes import FakeChatModel
+
+PR_INPUT = "PR Title: Add cache\n\nPR Description: Adds a cache\n\nChanged Files:\n- a.py (+1/-0)\n\nDiff:\na.py:\n+x = 1"
+ISSUE = {"issue_title": "Crash on start", "issue_body": "App crashes with KeyError when the config file is missing"}
+
+
+async def measure(fn, iterations):
+    """Mean and p50 in microseconds of awaiting fn() `iterations` times, after a short warm-up."""
+    for _ in range(min(50, iterations)):
+        await fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.fmean(samples), statistics.median(samples)
+
+def cases(model):
+    async def build_text_chain():
+        text_chain(pragent.RISK_SYSTEM_PROMPT, model)
+
+    async def build_structured_chain():
+        structured_chain(citestagent.EXPLANATION_PROMPT, model, citestagent.CILogAnalysis)
+
+    async def rebuild_and_run_text_chain():
+        await text_chain(pragent.RISK_SYSTEM_PROMPT, model).ainvoke({"input": PR_INPUT})
+
+    async def registry_text_chain():
+        await chain_registry.get("pr.risk").ainvoke({"input": PR_INPUT})
+
+    async def rebuild_and_run_structured_chain():
+        chain = structured_chain(None, model, issueagent.IssueAnalysis, issueagent.ISSUE_ANALYSIS_PROMPT)
+        await chain.ainvoke(ISSUE)
+
+    async def registry_structured_chain():
+        await chain_registry.get("issue.analyze").ainvoke(ISSUE)
+
+    prompt_only = chain_registry.get("pr.risk").first
+
+    async def format_prompt():
+        await prompt_only.ainvoke({"input": PR_INPUT})
+
+    async def validate_state():
+        pragent.AnalysisState(pr_title="t", pr_body="b", changed_files=[{"filename": "a.py", "patch": "+x"}]).model_dump()
+
+    async def validate_structured_output():
+        issueagent.IssueAnalysis.model_validate({name: "x" for name in issueagent.IssueAnalysis.model_fields})
+
+    return {
+        "build text chain": build_text_chain,
+        "build structured chain": build_structured_chain,
+        "format prompt only": format_prompt,
+        "text chain, rebuilt per call": rebuild_and_run_text_chain,
+        "text chain, from registry": registry_text_chain,
+        "structured chain, rebuilt per call": rebuild_and_run_structured_chain,
+        "structured chain, from registry": registry_structured_chain,
+        "AnalysisState validate+dump": validate_state,
+        "IssueAnalysis validate": validate_structured_output,
+    }
+
+async def main_async(args):
+    model = FakeChatModel(latency=0)
+    clients.override("chat", model)
+    chain_registry.warm()
+    print(f"{'case':<36} {'mean us':>10} {'p50 us':>10}")
+    for name, fn in cases(model).items():
+        mean, p50 = await measure(fn, args.iterations)
+        print(f"{name:<36} {mean:10.1f} {p50:10.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    asyncio.run(main_async(parser.parse_args()))
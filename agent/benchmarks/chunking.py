@@ -0,0 +1,146 @@
+"""
+Benchmark of the syntax-aware chunker against the RecursiveCharacterTextSplitter it replaced.
+
+Both chunkers run over real source trees (this repository by default; point --roots at a
+larger checkout or site-packages for more signal). For each one it reports chunk count,
+characters and estimated tokens sent to the embedding model, and throughput.
+
+Quality is measured on Python files, whose functions `ast` locates exactly:
+  - whole: functions and classes small enough for one chunk that some chunk holds entirely
+  - found@k: every function with a docstring is queried by the docstring's first line,
+    with the offline hash embedder and with the BM25 chunk index; found when a top-k
+    chunk holds its `def` line
+  - complete@k: the passages packed from the top-k chunks hold the whole function
+
+Usage: python -m benchmarks.chunking [--roots DIR ...] [--top-k 5] [--max-queries 2000]
+"""
+import os
+import re
+import ast
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Clients are constructed at import; dummy credentials keep them offline
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("VOYAGE_API_KEY", "benchmark")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+import numpy as np
+from agents.codechunker import chunk_code, language_for
+from agents.codequeryagent import get_text_splitter, CHUNK_SIZE
+from agents.contextpacker import pack
+from agents.diffpacker import estimate_tokens
+from agents.lexicalindex import ChunkIndex
+from agents.repoindexer import MAX_FILE_BYTES
+from benchmarks.fakes import HashEmbeddings
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SKIP_DIRS = {"node_modules", ".git", "__pycache__", "dist", "build", ".next", ".vectorstore", ".venv", "venv"}
+_SPACE = re.compile(r"\s+")
+
+CHUNKERS = {
+    "recursive": lambda path, text: [{"content": c} for c in get_text_splitter().split_text(text)],
+    "syntax": lambda path, text: chunk_code(path, text, CHUNK_SIZE),
+}
+
+
+def load_corpus(roots):
+    files = {}
+    for root in roots:
+        for directory, dirs, names in os.walk(root):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            for name in names:
+                path = os.path.join(directory, name)
+                if language_for(path) and os.path.getsize(path) <= MAX_FILE_BYTES:
+                    with open(path, encoding="utf-8", errors="replace") as f:
+                        files[os.path.relpath(path, root)] = f.read()
+    return files
+
+def python_definitions(files):
+    """(filepath, def line, whole source, docstring query) for every function and class in the Python files."""
+    definitions = []
+    for path, text in files.items():
+        if not path.endswith(".py"):
+            continue
+        try:
+            tree = ast.parse(text)
+        except SyntaxError:
+            continue
+        lines = text.split("\n")
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                source = "\n".join(lines[start - 1:node.end_lineno])
+                docstring = (ast.get_docstring(node) or "").strip().split("\n")[0]
+                definitions.append((path, lines[node.lineno - 1].strip(), source, docstring))
+    return definitions
+
+def squash(text):
+    return _SPACE.sub("", text)
+
+def run_chunker(name, files):
+    start = time.perf_counter()
+    chunks = []
+    for path, text in files.items():
+        for i, chunk in enumerate(CHUNKERS[name](path, text)):
+            chunks.append({**chunk, "filepath": path, "chunkIndex": i})
+    return chunks, time.perf_counter() - start
+
+def quality(chunks, definitions, top_k, max_queries):
+    by_file = {}
+    for chunk in chunks:
+        by_file.setdefault(chunk["filepath"], []).append(squash(chunk["content"]))
+    fitting = [d for d in definitions if len(d[2]) <= CHUNK_SIZE]
+    whole = sum(any(squash(d[2]) in c for c in by_file.get(d[0], [])) for d in fitting)
+
+    queries = [d for d in definitions if len(d[3].split()) >= 3]
+    random.Random(0).shuffle(queries)
+    queries = queries[:max_queries]
+    embedder = HashEmbeddings()
+    matrix = np.array(embedder.embed_documents([c["content"] for c in chunks]), dtype=np.float32)
+    lexical = ChunkIndex()
+    lexical.add(chunks)
+
+    results = {}
+    for retriever in ("vector", "bm25"):
+        found = complete = 0
+        for path, def_line, source, query in queries:
+            if retriever == "vector":
+                scores = matrix @ np.array(embedder.embed_query(query), dtype=np.float32)
+                ranked = [chunks[i] for i in np.argsort(-scores)[:top_k]]
+            else:
+                ranked = lexical.search(query, top_k)
+            found += any(c["filepath"] == path and def_line in c["content"] for c in ranked)
+            target = squash(source)
+            complete += any(p["filepath"] == path and target in squash(p["content"]) for p in pack(ranked))
+        results[retriever] = (found / len(queries) if queries else 0.0, complete / len(queries) if queries else 0.0)
+    return whole / len(fitting) if fitting else 0.0, len(fitting), len(queries), results
+
+def main(args):
+    files = load_corpus(args.roots)
+    total_bytes = sum(len(t) for t in files.values())
+    definitions = python_definitions(files)
+    print(f"corpus: {len(files)} files, {total_bytes / 1e6:.2f} MB, {len(definitions)} Python definitions")
+    get_text_splitter()  # import langchain outside the timed run
+
+    print(f"{'chunker':<10} {'chunks':>8} {'chars':>11} {'tokens':>10} {'MB/s':>7} {'whole':>7}"
+          f" {'vec found':>10} {'vec compl':>10} {'bm25 found':>11} {'bm25 compl':>11}")
+    for name in CHUNKERS:
+        chunks, seconds = run_chunker(name, files)
+        chars = sum(len(c["content"]) for c in chunks)
+        tokens = sum(estimate_tokens(c["content"]) for c in chunks)
+        whole, fitting, queried, results = quality(chunks, definitions, args.top_k, args.max_queries)
+        print(f"{name:<10} {len(chunks):>8} {chars:>11} {tokens:>10} {total_bytes / seconds / 1e6:>7.1f} {whole:>7.1%}"
+              f" {results['vector'][0]:>10.1%} {results['vector'][1]:>10.1%}"
+              f" {results['bm25'][0]:>11.1%} {results['bm25'][1]:>11.1%}")
+    print(f"whole: of {fitting} definitions up to {CHUNK_SIZE} chars; found/complete: @{args.top_k} over {queried} docstring queries")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roots", nargs="+", default=[REPO_ROOT])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--max-queries", type=int, default=2000)
+    main(parser.parse_args())
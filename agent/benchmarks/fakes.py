@@ -0,0 +1,223 @@
+import asyncio
+import base64
+import hashlib
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+import httpx
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+from agents.codequeryagent import git_blob_sha
+from agents.ratelimit import gcra
+
+# --- FAKE CHAT MODEL ---
+def _placeholder(schema: type[BaseModel]) -> BaseModel:
+    """Build a schema instance with empty-but-valid values for every required field."""
+    values = {}
+    for name, field in schema.model_fields.items():
+        if not field.is_required():
+            continue
+        annotation = str(field.annotation).lower()
+        values[name] = [] if "list" in annotation else "fake"
+    return schema(**values)
+
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+def _prompt_chars(prompt) -> int:
+    messages = prompt.to_messages() if hasattr(prompt, "to_messages") else prompt
+    if isinstance(messages, str):
+        return len(messages)
+    return sum(len(str(m.content)) for m in messages)
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model that sleeps instead of calling an API: `latency` seconds per
+    call plus `prompt_latency` seconds per 1k prompt tokens, so prompt size shows up in
+    the numbers the way prefill time does with a real model.
+    """
+    latency: float = 0.2
+    prompt_latency: float = 0.0
+    response: str = "fake answer"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _delay(self, prompt) -> float:
+        if not self.prompt_latency:
+            return self.latency
+        return self.latency + self.prompt_latency * _prompt_chars(prompt) / 4000
+
+    def get_num_tokens(self, text: str) -> int:
+        # Words and punctuation marks, about what a BPE tokenizer makes of code; no API to call
+        return len(_WORDS.findall(text))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        # Same total latency as _agenerate, spread over the words of the response
+        words = self.response.split(" ")
+        delay = self._delay(messages)
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f" {word}"))
+
+    def with_structured_output(self, schema, **kwargs):
+        def build(prompt):
+            time.sleep(self._delay(prompt))
+            return _placeholder(schema)
+
+        async def abuild(prompt):
+            await asyncio.sleep(self._delay(prompt))
+            return _placeholder(schema)
+
+        return RunnableLambda(build, afunc=abuild)
+
+
+# --- FAKE EMBEDDINGS ---
+_TOKEN = re.compile(r"[A-Za-z0-9]+")
+
+class HashEmbeddings:
+    """
+    Deterministic feature-hashing embedder with the VoyageAIEmbeddings interface. Texts
+    sharing tokens get similar vectors, so retrieval results are meaningful offline.
+    """
+
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+# --- FAKE GITHUB ---
+class FakeGitHub:
+    """
+    Serves the GitHub REST endpoints GitHubPool uses (HEAD commit, recursive tree, raw
+    blobs, contents) from an in-memory {path: content} dict via httpx.MockTransport.
+    HEAD and contents carry ETags and answer a matching If-None-Match with a 304.
+    """
+
+    def __init__(self, files: Dict[str, str], latency: float = 0.0, commit: str = "0" * 40):
+        self.files = files
+        self.latency = latency
+        self.commit = commit
+        self.requests = 0
+        self.not_modified = 0
+        self._shas = {path: git_blob_sha(content) for path, content in files.items()}
+        self._blobs = {sha: files[path] for path, sha in self._shas.items()}
+
+    def _conditional(self, request: httpx.Request, etag: str, headers: dict) -> Optional[httpx.Response]:
+        headers["etag"] = etag
+        if request.headers.get("if-none-match") == etag:
+            self.not_modified += 1
+            return httpx.Response(304, headers=headers)
+        return None
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        path = request.url.path
+        headers = {"x-ratelimit-remaining": "5000", "x-ratelimit-reset": "0"}
+        if "/commits/" in path:
+            return self._conditional(request, f'"{self.commit}"', headers) or httpx.Response(200, text=self.commit, headers=headers)
+        if "/git/trees/" in path:
+            tree = [{"path": p, "type": "blob", "sha": self._shas[p], "size": len(c)} for p, c in self.files.items()]
+            return httpx.Response(200, json={"truncated": False, "tree": tree}, headers=headers)
+        if "/git/blobs/" in path:
+            content = self._blobs.get(path.rsplit("/", 1)[1])
+            if content is not None:
+                return httpx.Response(200, content=content.encode("utf-8"), headers=headers)
+        if "/contents/" in path:
+            file_path = path.split("/contents/", 1)[1]
+            if file_path in self.files:
+                content = self.files[file_path]
+                not_modified = self._conditional(request, f'"{self._shas[file_path]}"', headers)
+                if not_modified is not None:
+                    return not_modified
+                return httpx.Response(200, headers=headers, json={
+                    "type": "file",
+                    "sha": self._shas[file_path],
+                    "content": base64.b64encode(content.encode("utf-8")).decode("ascii"),
+                })
+        return httpx.Response(404, json={"message": "Not Found"}, headers=headers)
+
+    def install(self, pool):
+        """Point a GitHubPool at this fake: a fixed token and a mock HTTP transport."""
+        client = httpx.AsyncClient(base_url="https://api.github.com", transport=httpx.MockTransport(self.handle))
+
+        async def token(installation_id):
+            return "fake-installation-token"
+
+        pool.token = token
+        pool._http_client = lambda: client
+        return pool
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the redis.asyncio client used by RedisBackend. Keys expire like
+    Redis keys, and the GCRA script runs the same `gcra` step atomically, so several
+    limiters sharing one FakeRedis behave like several workers sharing one Redis.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.data: Dict[str, tuple] = {}  # key -> (value, expires_at)
+
+    def _get(self, key: str, now: float):
+        value, expires_at = self.data.get(key, (None, 0.0))
+        if value is not None and expires_at <= now:
+            del self.data[key]
+            return None
+        return value
+
+    def register_script(self, script: str):
+        async def run_gcra(keys, args):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            key, (emission, tolerance, cost) = keys[0], args
+            now = time.monotonic()
+            allowed, tat, retry_after = gcra(self._get(key, now), now, emission, tolerance, cost)
+            if allowed:
+                self.data[key] = (tat, tat)
+            return [int(allowed), str(retry_after), str(tat - now)]
+        return run_gcra
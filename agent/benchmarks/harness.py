@@ -0,0 +1,89 @@
+"""
+Wire every agent to local stand-ins so the whole service runs offline.
+
+install_fakes() overrides the Gemini models, VoyageAI embeddings, MongoDB
+(mongomock) and vector search (the in-process NumPy backend over the mock
+collection) in the shared client pool, puts FakeGitHub behind the GitHub pool,
+and seeds a synthetic repository.
+"""
+import os
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Clients are constructed at import; dummy credentials keep them offline
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("VOYAGE_API_KEY", "benchmark")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("GITHUB_APP_ID", "1")
+
+try:
+    import mongomock
+except ImportError:  # pragma: no cover
+    raise SystemExit("The offline benchmarks need mongomock: pip install mongomock")
+
+import main
+from agents import codequeryagent, repoindexer
+from agents.clients import clients
+from agents.ratelimit import rate_limiter
+from agents.githubpool import GitHubPool, BlobCache
+from agents.vectorstore import LocalVectorBackend
+from benchmarks.fakes import FakeChatModel, HashEmbeddings, FakeGitHub
+
+BENCH_ACCOUNT = "bench-account"
+BENCH_OWNER = "bench"
+BENCH_REPO = "bench/service"
+
+
+def synthetic_repo(files: int = 200) -> Dict[str, str]:
+    """A repo of small Python modules with distinct, searchable names."""
+    areas = ["auth", "billing", "webhooks", "indexer", "search", "cache", "models", "api"]
+    repo = {"README.md": "# Bench service\nSynthetic repository used by the offline benchmarks.\n"}
+    for i in range(files):
+        area = areas[i % len(areas)]
+        body = "\n\n".join(
+            f"def {area}_handler_{i}_{j}(request):\n"
+            f"    \"\"\"Handle {area} request {j} for module {i}.\"\"\"\n"
+            f"    value = request.get('{area}_{j}')\n"
+            f"    return {{'module': {i}, 'value': value}}"
+            for j in range(12)
+        )
+        repo[f"src/{area}/module_{i}.py"] = body + "\n"
+    return repo
+
+
+@dataclass
+class Fakes:
+    llm: FakeChatModel
+    embeddings: HashEmbeddings
+    github: FakeGitHub
+    mongo: "mongomock.MongoClient"
+    workdir: str
+
+
+def install_fakes(llm_latency: float = 0.2, embed_latency: float = 0.0, github_latency: float = 0.0,
+                  repo_files: int = 200, workdir: str = None, prompt_latency: float = 0.0) -> Fakes:
+    workdir = workdir or tempfile.mkdtemp(prefix="codelense-bench-")
+
+    llm = FakeChatModel(latency=llm_latency, prompt_latency=prompt_latency, response="Risk Level: Low. The change is small and covered by tests.")
+    embeddings = HashEmbeddings(latency=embed_latency)
+    mongo = mongomock.MongoClient()
+    clients.override("chat", llm)
+    clients.override("embeddings", embeddings)
+    clients.override("mongo", mongo)
+    vectors = mongo[codequeryagent.DB_NAME][codequeryagent.VECTOR_COLL]
+    clients.override("retrieval", LocalVectorBackend(vectors, root=os.path.join(workdir, "vectors")))
+
+    files = synthetic_repo(repo_files)
+    github = FakeGitHub(files, latency=github_latency)
+    pool = github.install(GitHubPool(blob_cache=BlobCache(root=os.path.join(workdir, "blobs"))))
+    # The GitHub pool is imported by name, so each importer needs the stand-in
+    for module in (codequeryagent, repoindexer, main):
+        module.github_pool = pool
+
+    codequeryagent.get_filelist_coll().insert_one({"accountId": BENCH_ACCOUNT, "repo": BENCH_REPO, "filepaths": list(files)})
+    # Benchmarks measure the service, not the per-account limiter
+    rate_limiter.enabled = False
+    return Fakes(llm=llm, embeddings=embeddings, github=github, mongo=mongo, workdir=workdir)
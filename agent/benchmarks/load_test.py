@@ -0,0 +1,68 @@
+"""
+Load test for the agent service.
+
+Replaces the Gemini client with a fake model of fixed latency and fires
+concurrent requests at the FastAPI app in-process. With an async execution
+path, throughput should scale with concurrency instead of staying flat.
+/code-query is left out because it also needs Mongo, VoyageAI and GitHub.
+
+Usage: python -m benchmarks.load_test [--latency 0.2] [--requests 32]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Clients are constructed at import; dummy credentials keep them offline
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("VOYAGE_API_KEY", "benchmark")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+import httpx
+import main
+from agents.clients import clients
+from benchmarks.fakes import FakeChatModel
+
+ENDPOINTS = {
+    "/analyze-issue": {"issue_title": "Crash on start", "issue_body": "App crashes with KeyError"},
+    "/analyze-pr": {"pr_title": "Add cache", "pr_body": "Adds a cache", "changed_files": [{"filename": "a.py", "patch": "+x = 1"}]},
+    "/classify-ci-log": {"log_text": "FAILED tests/test_a.py::test_x - AssertionError"},
+    "/analyze-refactor": {"pr_title": "Add cache", "pr_body": "Adds a cache", "changed_files": [{"filename": "a.py", "patch": "+x = 1"}]},
+}
+
+def install_fake_llm(latency):
+    clients.override("chat", FakeChatModel(latency=latency))
+
+async def run_level(client, path, payload, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            resp = await client.post(path, json=payload)
+            resp.raise_for_status()
+            # Handlers report failures in the body rather than the status code
+            body = resp.json()
+            if isinstance(body, dict) and "error" in body:
+                raise RuntimeError(f"{path} failed: {body['error']}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - start)
+
+async def main_async(args):
+    install_fake_llm(args.latency)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path, payload in ENDPOINTS.items():
+            for concurrency in args.levels:
+                rps = await run_level(client, path, payload, concurrency, args.requests)
+                print(f"{path:<20} concurrency={concurrency:<3} throughput={rps:8.2f} req/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency in seconds")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16])
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""
+Startup-cost benchmark for the service.
+
+Each run is a fresh interpreter that imports main, answers /health (liveness) and
+then /ready, which compiles the graphs and builds the chains and the real Gemini,
+VoyageAI and MongoDB clients (MongoDB is mongomock, so the ping is offline).
+Reports import time, time to first /health and time for the first /ready, plus any
+heavy SDK that got imported with main, which should stay empty.
+
+Usage: python -m benchmarks.startup [--runs 5] [--importtime 15]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loading any of these at import time means a client is being built eagerly again
+HEAVY_MODULES = ["langchain_google_genai", "langchain_voyageai", "pymongo", "githubkit", "langchain.text_splitter"]
+
+RUN = """
+import os, sys, json, time, asyncio
+for key, value in {"GOOGLE_API_KEY": "benchmark", "VOYAGE_API_KEY": "benchmark",
+                   "MONGODB_URI": "mongodb://localhost:27017"}.items():
+    os.environ.setdefault(key, value)
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+
+import httpx, mongomock
+from agents.clients import clients
+clients.override("mongo", mongomock.MongoClient())
+
+async def probe():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        t = time.perf_counter()
+        (await client.get("/health")).raise_for_status()
+        health = time.perf_counter() - t
+        t = time.perf_counter()
+        (await client.get("/ready")).raise_for_status()
+        ready = time.perf_counter() - t
+        t = time.perf_counter()
+        (await client.get("/ready")).raise_for_status()
+        return health, ready, time.perf_counter() - t
+
+health, ready, ready_again = asyncio.run(probe())
+print(json.dumps({"import": imported, "health": health, "ready": ready, "ready_again": ready_again, "eager": loaded}))
+"""
+
+
+def run_once() -> dict:
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n" + RUN
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=AGENT_DIR,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def import_profile(top: int):
+    """Slowest modules by cumulative import time, from python -X importtime."""
+    err = subprocess.run([sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import main"], cwd=AGENT_DIR,
+                         capture_output=True, text=True, env={**os.environ, "GOOGLE_API_KEY": "benchmark"}).stderr
+    rows = []
+    for line in err.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    for micros, module in sorted(rows, reverse=True)[:top]:
+        print(f"{micros / 1000:10.1f} ms {module}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", type=int, default=0, help="also list the N slowest imports")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"{'phase':<22} {'mean ms':>10} {'min ms':>10}")
+    for phase in ("import", "health", "ready", "ready_again"):
+        samples = [r[phase] * 1000 for r in runs]
+        print(f"{phase:<22} {statistics.fmean(samples):10.1f} {min(samples):10.1f}")
+    eager = sorted({m for r in runs for m in r["eager"]})
+    print(f"SDKs imported eagerly: {', '.join(eager) if eager else 'none'}")
+    if args.importtime:
+        import_profile(args.importtime)
@@ -0,0 +1,214 @@
+"""
+Offline benchmark suite for every endpoint in main.py.
+
+Runs the FastAPI app in-process against the stand-ins from benchmarks.harness
+(fake LLM, hash embedder, mongomock, NumPy vector search, fake GitHub) and
+reports throughput, p50/p99 latency and memory per endpoint at each
+concurrency level. Payloads differ per request so response caches do not
+flatter the numbers.
+
+Results can be saved with --json and compared against a saved baseline with
+--baseline; the run exits non-zero when throughput drops or p99 latency rises
+by more than --tolerance, so it can gate CI.
+
+Usage: python -m benchmarks.suite [--latency 0.2] [--requests 32] [--levels 1 8 32]
+                                  [--endpoints analyze-pr code-query] [--json out.json]
+                                  [--baseline base.json --tolerance 0.25]
+"""
+import gzip
+import json
+import time
+import asyncio
+import argparse
+import resource
+import statistics
+import tracemalloc
+from urllib.parse import urlencode
+from dataclasses import dataclass
+from typing import Callable
+
+from benchmarks.harness import install_fakes, BENCH_ACCOUNT, BENCH_OWNER, BENCH_REPO
+import httpx
+import main
+
+
+def _ci_log(i):
+    lines = [f"2024-05-01T10:00:{s % 60:02d}.000Z Step {s}: running" for s in range(400)]
+    lines += [
+        "Traceback (most recent call last):",
+        f'  File "/home/runner/work/app/worker_{i}.py", line {i + 10}, in handle_{i}',
+        f"KeyError{i}: 'missing_{i}'",
+        f"FAILED tests/test_worker.py::test_handle_{i} - KeyError{i}",
+        "##[error]Process completed with exit code 1.",
+    ]
+    return "\n".join(lines)
+
+def _pr(i):
+    patch = "\n".join(f"@@ -{h},3 +{h},4 @@\n context\n+added line {h} in change {i}\n-removed" for h in range(20))
+    return {
+        "pr_title": f"Change {i}",
+        "pr_body": f"Refactors module {i}",
+        "changed_files": [{"filename": f"src/auth/module_{i}_{f}.py", "patch": patch} for f in range(8)],
+    }
+
+def _large_pr(i):
+    # Big enough to need several refactor shards, with lockfile and generated noise to skip
+    pr = _pr(i)
+    patch = pr["changed_files"][0]["patch"]
+    pr["changed_files"] = [{"filename": f"src/{d}/module_{i}_{f}.py", "patch": patch * 4}
+                           for d in ("auth", "billing", "api") for f in range(20)]
+    pr["changed_files"] += [{"filename": "package-lock.json", "patch": patch * 20},
+                            {"filename": f"proto/service_{i}_pb2.py", "patch": patch * 10}]
+    return pr
+
+def _ci_item(i):
+    # CI failure signatures are cached per account and repo
+    return {"log_text": _ci_log(i), "account_id": BENCH_ACCOUNT, "repo": BENCH_REPO}
+
+CI_SCOPE = urlencode({"account_id": BENCH_ACCOUNT, "repo": BENCH_REPO})
+
+def _issue(i):
+    return {"issue_title": f"Crash #{i} in billing", "issue_body": f"Billing worker {i} raises KeyError on startup"}
+
+def _query(i):
+    return {"user_query": f"where is the auth handler {i} defined", "account_id": BENCH_ACCOUNT,
+            "repo": BENCH_REPO, "owner": BENCH_OWNER, "installation_id": 1}
+
+
+@dataclass
+class Endpoint:
+    name: str
+    method: str
+    path: str
+    body: Callable[[int], dict] = None
+    raw: Callable[[int], bytes] = None  # raw request body instead of JSON
+    headers: dict = None
+    stream: bool = False  # NDJSON / SSE responses are read to the end
+
+
+ENDPOINTS = [
+    Endpoint("analyze-issue", "POST", "/analyze-issue", _issue),
+    Endpoint("analyze-pr", "POST", "/analyze-pr", _pr),
+    Endpoint("analyze-refactor", "POST", "/analyze-refactor", _pr),
+    Endpoint("analyze-refactor-large", "POST", "/analyze-refactor", _large_pr),
+    Endpoint("classify-ci-log", "POST", "/classify-ci-log", _ci_item),
+    Endpoint("classify-ci-log-gzip", "POST", f"/classify-ci-log?{CI_SCOPE}", raw=lambda i: gzip.compress(_ci_log(i).encode()),
+             headers={"content-type": "text/plain", "content-encoding": "gzip"}),
+    Endpoint("code-query", "POST", "/code-query", _query),
+    Endpoint("analyze-pr-stream", "POST", "/analyze-pr/stream", _pr, stream=True),
+    Endpoint("code-query-stream", "POST", "/code-query/stream", _query, stream=True),
+    Endpoint("analyze-issue-batch", "POST", "/analyze-issue/batch", lambda i: {"items": [_issue(i * 8 + j) for j in range(8)]}, stream=True),
+    Endpoint("analyze-pr-batch", "POST", "/analyze-pr/batch", lambda i: {"items": [_pr(i * 4 + j) for j in range(4)]}, stream=True),
+    Endpoint("classify-ci-log-batch", "POST", "/classify-ci-log/batch",
+             lambda i: {"items": [_ci_item(i * 4 + j) for j in range(4)]}, stream=True),
+    Endpoint("index-repo", "POST", "/index-repo", lambda i: {
+        "account_id": f"{BENCH_ACCOUNT}-{i}", "repo": BENCH_REPO, "owner": BENCH_OWNER, "installation_id": 1,
+    }),
+    Endpoint("cache-stats", "GET", "/cache-stats"),
+    Endpoint("ci-failure-signatures", "GET", f"/ci-failure-signatures?{CI_SCOPE}"),
+]
+
+
+def _failed(endpoint: Endpoint, resp: httpx.Response) -> bool:
+    if resp.status_code >= 400:
+        return True
+    if endpoint.stream:
+        return '"error"' in resp.text
+    # Handlers report failures in the body rather than the status code
+    body = resp.json()
+    return isinstance(body, dict) and "error" in body
+
+async def run_level(client, endpoint: Endpoint, concurrency: int, total: int, offset: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        kwargs = {"headers": endpoint.headers}
+        if endpoint.raw:
+            kwargs["content"] = endpoint.raw(i)
+        elif endpoint.body:
+            kwargs["json"] = endpoint.body(i)
+        async with semaphore:
+            start = time.perf_counter()
+            resp = await client.request(endpoint.method, endpoint.path, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if _failed(endpoint, resp):
+                errors += 1
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(offset + i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "endpoint": endpoint.name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput": round(total / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+        "peak_alloc_mb": round(peak / 1e6, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def compare(results, baseline, tolerance) -> list:
+    """Regressions of more than `tolerance` (fractional) in throughput or p99 against a baseline run."""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        before = previous.get((r["endpoint"], r["concurrency"]))
+        if before is None:
+            continue
+        if r["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{r['endpoint']} c={r['concurrency']}: throughput {before['throughput']} -> {r['throughput']} req/s")
+        if r["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{r['endpoint']} c={r['concurrency']}: p99 {before['p99_ms']} -> {r['p99_ms']} ms")
+        if r["errors"] > before["errors"]:
+            regressions.append(f"{r['endpoint']} c={r['concurrency']}: errors {before['errors']} -> {r['errors']}")
+    return regressions
+
+async def main_async(args) -> int:
+    install_fakes(llm_latency=args.latency, embed_latency=args.embed_latency,
+                  github_latency=args.github_latency, repo_files=args.repo_files, prompt_latency=args.prompt_latency)
+    endpoints = [e for e in ENDPOINTS if not args.endpoints or any(f in e.name for f in args.endpoints)]
+    results, offset = [], 0
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        print(f"{'endpoint':<24} {'conc':>4} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'alloc MB':>9} {'rss MB':>8} {'errors':>6}")
+        for endpoint in endpoints:
+            for concurrency in args.levels:
+                r = await run_level(client, endpoint, concurrency, args.requests, offset)
+                offset += args.requests
+                results.append(r)
+                print(f"{r['endpoint']:<24} {r['concurrency']:>4} {r['throughput']:>9.2f} {r['p50_ms']:>9.1f} "
+                      f"{r['p99_ms']:>9.1f} {r['peak_alloc_mb']:>9.2f} {r['max_rss_mb']:>8.1f} {r['errors']:>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"latency": args.latency, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency in seconds")
+    parser.add_argument("--prompt-latency", type=float, default=0.0, help="extra fake LLM seconds per 1k prompt tokens")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="fake embedding latency in seconds")
+    parser.add_argument("--github-latency", type=float, default=0.01, help="fake GitHub API latency in seconds")
+    parser.add_argument("--repo-files", type=int, default=200, help="files in the synthetic repository")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--endpoints", nargs="*", help="only run endpoints whose name contains one of these")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional regression")
+    raise SystemExit(asyncio.run(main_async(parser.parse_args())))
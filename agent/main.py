@@ -1,44 +1,79 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from langchain_core.runnables import RunnableLambda
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from agents.pragent import build_pr_agent_graph, PRInput, AnalysisState
-from agents.citestagent import build_citest_agent_graph, CILogInput, CILogAnalysis
-from agents.codequeryagent import run_agent
-from agents.issueagent import run_issue_agent, IssueInput
-from agents.refactoragent import build_refactor_agent_graph, RefactorInput, RefactorAnalysis
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from agents.pragent import get_pr_agent_graph, PRInput, AnalysisState
+from agents.citestagent import get_citest_agent_graph, CILogInput, CILogAnalysis
+from agents.logreducer import reduce_stream
+from agents.failuresignature import signature_cache
+from agents.codequeryagent import (
+    run_agent, chunk_cache_stats, get_code_query_workflow, initial_state,
+    get_embeddings, get_text_splitter, get_retrieval, CHUNKER,
+)
+from agents.repoindexer import index_repository, IndexRepoInput
+from agents.vectorstore import index_readiness_stats
+from agents.embedder import embedders
+from agents.pathindex import path_index_cache
+from agents.lexicalindex import lexical_index_cache
+from agents.githubpool import github_pool
+from agents.issueagent import run_issue_agent, IssueInput, issue_response_cache, get_issue_agent_graph
+from agents.refactoragent import get_refactor_agent_graph, RefactorInput, RefactorState, RefactorAnalysis
+from agents.batching import stream_batch, BATCH_MAX_ITEMS
+from agents.eventstream import stream_graph, sse_response
+from agents.chains import chain_registry
+from agents.clients import clients
+from agents.metrics import metrics
+from agents.tracing import TracingMiddleware, recent_traces
+from agents.ratelimit import rate_limiter
+from agents.singleflight import SingleFlight, payload_key
+from agents import workerpool
+from agents.workerpool import run_blocking
+import os
 import time
-from collections import defaultdict
-from typing import Dict, List
+import asyncio
+from typing import List, Optional
 
 app = FastAPI()
-graph = build_pr_agent_graph()
-citest_graph = build_citest_agent_graph()
-refactor_graph = build_refactor_agent_graph()
 
-# Rate limiting storage
-rate_limit_store: Dict[str, List[float]] = defaultdict(list)
-RATE_LIMIT_REQUESTS = 2  # 2 requests
-RATE_LIMIT_WINDOW = 60   # per minute (60 seconds)
+# Graphs, chains and clients are built on first use; set WARM_ON_STARTUP=1 to build them
+# in the background as soon as the server starts instead of waiting for /ready
+WARM_ON_STARTUP = os.environ.get("WARM_ON_STARTUP", "0") == "1"
 
-def check_rate_limit(account_id: str) -> bool:
-    """
-    Check if the account_id has exceeded the rate limit.
-    Returns True if request is allowed, False if rate limited.
-    """
-    current_time = time.time()
-    
-    # Clean old entries (older than 1 minute)
-    rate_limit_store[account_id] = [
-        timestamp for timestamp in rate_limit_store[account_id]
-        if current_time - timestamp < RATE_LIMIT_WINDOW
-    ]
-    
-    # Check if we're under the limit
-    if len(rate_limit_store[account_id]) < RATE_LIMIT_REQUESTS:
-        rate_limit_store[account_id].append(current_time)
-        return True
-    
-    return False
+_warmed = False
+
+def warm_up():
+    """Compile every graph and build every chain and client, then check MongoDB is reachable."""
+    global _warmed
+    if not _warmed:
+        for get_graph in (get_pr_agent_graph, get_citest_agent_graph, get_refactor_agent_graph,
+                          get_issue_agent_graph, get_code_query_workflow):
+            get_graph()
+        chain_registry.warm()
+        get_embeddings()
+        if CHUNKER == "recursive":
+            get_text_splitter()
+        get_retrieval()
+        _warmed = True
+    clients.mongo().admin.command("ping")
+
+async def _warm_in_background():
+    try:
+        await run_blocking(warm_up)
+        print(f"🔥 Warmed up {clients.stats['created']} clients and {chain_registry.stats['builds']} chains")
+    except Exception as e:
+        print(f"⚠️ Startup warm-up failed, /ready will retry: {e}")
+
+@app.on_event("startup")
+async def warm_on_startup():
+    if WARM_ON_STARTUP:
+        # In the background, so the server accepts probes while it warms up
+        app.state.warm_task = asyncio.create_task(_warm_in_background())
+
+@app.on_event("shutdown")
+async def shutdown_worker_pool():
+    workerpool.shutdown()
 
 # Enable CORS for local dev
 app.add_middleware(
@@ -48,6 +83,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so each request's trace covers the whole response, streamed bodies included
+app.add_middleware(TracingMiddleware)
 
 class CodeQueryInput(BaseModel):
     user_query: str
@@ -56,57 +93,163 @@ class CodeQueryInput(BaseModel):
     owner: str
     installation_id: int
 
+class IssueBatchInput(BaseModel):
+    items: List[IssueInput]
+    max_concurrency: Optional[int] = None
+    account_id: Optional[str] = None
+
+class PRBatchInput(BaseModel):
+    items: List[PRInput]
+    max_concurrency: Optional[int] = None
+    account_id: Optional[str] = None
+
+class CILogBatchInput(BaseModel):
+    items: List[CILogInput]
+    max_concurrency: Optional[int] = None
+    account_id: Optional[str] = None
+
+async def enforce_rate_limit(endpoint: str, request: Request, account_id: Optional[str] = None, cost: int = 1):
+    """
+    Raise a 429 with Retry-After once the caller's quota for endpoint is used up. Batches
+    are charged one request per item; one larger than the quota's burst gets a 413.
+    """
+    # Callers without an installation account (e.g. direct API use) are limited per client address
+    tenant = account_id or request.headers.get("x-account-id") or (request.client.host if request.client else "anonymous")
+    max_cost = rate_limiter.max_cost(endpoint, tenant)
+    if max_cost is not None and cost > max_cost:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {cost} items exceeds the {endpoint} quota; at most {max_cost} items per batch for account {tenant}",
+        )
+    decision = await rate_limiter.check(endpoint, tenant, cost)
+    if decision is not None and not decision.allowed:
+        quota = rate_limiter.quota(endpoint, tenant)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded. Only {quota.limit} requests per {quota.period:g} seconds allowed for account {tenant}",
+            headers=decision.headers(),
+        )
+
+def ndjson_batch(runnable, items, to_result=lambda r: r, max_concurrency=None):
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {BATCH_MAX_ITEMS} items")
+    return StreamingResponse(
+        stream_batch(runnable, items, to_result, max_concurrency),
+        media_type="application/x-ndjson",
+    )
+
+def pr_state(pr: PRInput) -> AnalysisState:
+    return AnalysisState(pr_title=pr.pr_title, pr_body=pr.pr_body, changed_files=pr.changed_files,
+                         previous=pr.previous_analysis)
+
+def pr_result(result):
+    result.pop("packed_diff", None)  # internal; the hunks are already in changed_files
+    result.pop("previous", None)  # the caller's own input
+    return result
+
+# Webhook retries and double-clicks resend the same payload; identical requests share one run
+pr_flights = SingleFlight("pr")
+refactor_flights = SingleFlight("refactor")
+issue_flights = SingleFlight("issue")
+
+async def _run_issue(issue: IssueInput):
+    # Goes through run_issue_agent so batches share the issue response cache
+    return await issue_flights.run(
+        payload_key(issue.account_id, issue.issue_title, issue.issue_body),
+        lambda: run_issue_agent(issue_title=issue.issue_title, issue_body=issue.issue_body, account_id=issue.account_id),
+    )
+
+async def _run_pr(pr: PRInput):
+    async def analyze():
+        return pr_result(await get_pr_agent_graph().ainvoke(pr_state(pr)))
+    return await pr_flights.run(payload_key(pr.pr_title, pr.pr_body, pr.changed_files, pr.previous_analysis), analyze)
+
+async def _run_refactor(pr: RefactorInput):
+    async def analyze():
+        state = RefactorState(pr_title=pr.pr_title, pr_body=pr.pr_body, changed_files=pr.changed_files,
+                              previous=pr.previous_analysis)
+        return (await get_refactor_agent_graph().ainvoke(state))["final_analysis"]
+    return await refactor_flights.run(payload_key(pr.pr_title, pr.pr_body, pr.changed_files, pr.previous_analysis), analyze)
+
 @app.post("/analyze-issue")
-async def analyze_issue(issue: IssueInput):
+async def analyze_issue(issue: IssueInput, request: Request):
+    await enforce_rate_limit("analyze-issue", request, issue.account_id)
     try:
-        analysis = run_issue_agent(
-            issue_title=issue.issue_title,
-            issue_body=issue.issue_body
-        )
-        return analysis
+        return await _run_issue(issue)
     except Exception as e:
         return {"error": str(e)}
 
+@app.post("/analyze-issue/batch")
+async def analyze_issue_batch(batch: IssueBatchInput, request: Request):
+    """Analyze many issues, streaming one NDJSON line per issue as it completes."""
+    await enforce_rate_limit("analyze-issue", request, batch.account_id, cost=len(batch.items))
+    return ndjson_batch(RunnableLambda(_run_issue), batch.items, max_concurrency=batch.max_concurrency)
+
 @app.post("/analyze-pr")
-async def analyze_pr(pr: PRInput):
+async def analyze_pr(pr: PRInput, request: Request):
+    await enforce_rate_limit("analyze-pr", request, pr.account_id)
     try:
-        state = AnalysisState(
-            pr_title=pr.pr_title,
-            pr_body=pr.pr_body,
-            changed_files=pr.changed_files,
-        )
-        result = graph.invoke(state)
-        return result
+        return await _run_pr(pr)
     except Exception as e:
         return {"error": str(e)}
 
+@app.post("/analyze-pr/stream")
+async def analyze_pr_stream(pr: PRInput, request: Request):
+    """Server-sent events: node progress and LLM tokens as they arrive, then the full analysis."""
+    await enforce_rate_limit("analyze-pr", request, pr.account_id)
+    return sse_response(stream_graph(get_pr_agent_graph(), pr_state(pr), pr_result))
+
+@app.post("/analyze-pr/batch")
+async def analyze_pr_batch(batch: PRBatchInput, request: Request):
+    """Analyze many PRs, streaming one NDJSON line per PR as it completes."""
+    await enforce_rate_limit("analyze-pr", request, batch.account_id, cost=len(batch.items))
+    return ndjson_batch(RunnableLambda(_run_pr), batch.items, max_concurrency=batch.max_concurrency)
+
 @app.post("/analyze-refactor")
-async def analyze_refactor(pr: RefactorInput):
+async def analyze_refactor(pr: RefactorInput, request: Request):
+    await enforce_rate_limit("analyze-refactor", request, pr.account_id)
     try:
-        result = refactor_graph.invoke(pr)
-        return result["final_analysis"]
+        return await _run_refactor(pr)
     except Exception as e:
         return {"error": str(e)}
 
 @app.post("/classify-ci-log")
-async def classify_ci_log(log: CILogInput):
+async def classify_ci_log(request: Request, account_id: Optional[str] = None, repo: Optional[str] = None):
+    """
+    Accepts {"log_text": ..., "account_id": ..., "repo": ...} as JSON, or the raw log as a
+    plain/chunked upload (optionally gzip-encoded, with account_id and repo as query
+    parameters) that is reduced as it streams in instead of being held in memory.
+    """
+    is_json = request.headers.get("content-type", "").startswith("application/json")
+    if is_json:
+        try:
+            log = TypeAdapter(CILogInput).validate_python(await request.json())
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        account_id = log.get("account_id") or account_id
+    await enforce_rate_limit("classify-ci-log", request, account_id)
     try:
-        result = citest_graph.invoke(log)
+        if not is_json:
+            excerpt, stats = await reduce_stream(request.stream(), request.headers.get("content-encoding"))
+            print(f"✂️ Reduced streamed CI log from {stats['chars']} to {len(excerpt)} chars ({stats['windows']} error windows)")
+            log = {"log_excerpt": excerpt, "log_stats": stats}
+            log.update({k: v for k, v in (("account_id", account_id), ("repo", repo)) if v})
+        result = await get_citest_agent_graph().ainvoke(log)
         return CILogAnalysis(**result)
     except Exception as e:
         return {"error": str(e)}
 
+@app.post("/classify-ci-log/batch")
+async def classify_ci_log_batch(batch: CILogBatchInput, request: Request):
+    """Explain many CI logs, streaming one NDJSON line per log as it completes."""
+    await enforce_rate_limit("classify-ci-log", request, batch.account_id, cost=len(batch.items))
+    return ndjson_batch(get_citest_agent_graph(), batch.items, lambda r: CILogAnalysis(**r), batch.max_concurrency)
+
 @app.post("/code-query")
-async def code_query(query: CodeQueryInput):
-    # Check rate limit
-    if not check_rate_limit(query.account_id):
-        raise HTTPException(
-            status_code=429, 
-            detail=f"Rate limit exceeded. Only {RATE_LIMIT_REQUESTS} requests per minute allowed for account {query.account_id}"
-        )
-    
+async def code_query(query: CodeQueryInput, request: Request):
+    await enforce_rate_limit("code-query", request, query.account_id)
     try:
-        answer = run_agent(
+        answer = await run_agent(
             user_query=query.user_query,
             account_id=query.account_id,
             repo=query.repo,
@@ -116,3 +259,96 @@ async def code_query(query: CodeQueryInput):
         return {"answer": answer}
     except Exception as e:
         return {"error": str(e)}
+
+@app.post("/code-query/stream")
+async def code_query_stream(query: CodeQueryInput, request: Request):
+    """Server-sent events: pipeline progress, then the answer token by token, then the final answer."""
+    await enforce_rate_limit("code-query", request, query.account_id)
+    state = initial_state(query.user_query, query.account_id, query.repo, query.owner, query.installation_id)
+    return sse_response(stream_graph(
+        get_code_query_workflow(),
+        state,
+        lambda final: {"answer": final["answer"]},
+        token_nodes={"answer_with_llm"},
+    ))
+
+@app.post("/index-repo")
+async def index_repo(params: IndexRepoInput, background_tasks: BackgroundTasks):
+    # Indexing can take minutes on large repos; acknowledge the push webhook right away
+    background_tasks.add_task(index_repository, params)
+    mode = "full" if params.changed_paths is None else "incremental"
+    return {"status": "queued", "mode": mode}
+
+@app.get("/health")
+async def health():
+    """Liveness probe: the process is up. Does not touch models or MongoDB."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: warms graphs, chains and clients on first call, then pings MongoDB."""
+    start = time.perf_counter()
+    try:
+        await run_blocking(warm_up)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": str(e)})
+    return {"status": "ready", "seconds": round(time.perf_counter() - start, 3)}
+
+def collect_cache_stats():
+    return {
+        "chunk_cache": chunk_cache_stats,
+        "vector_index_readiness": index_readiness_stats,
+        "path_index": path_index_cache.stats,
+        "lexical_index": lexical_index_cache.summary(),
+        "embeddings": {e.model: e.summary() for e in embedders},
+        "github": {**github_pool.stats, "blob_cache": github_pool.blob_cache.stats},
+        "ci_signatures": {**signature_cache.stats, "entries": len(signature_cache)},
+        "issue_responses": issue_response_cache.summary(),
+        "chains": chain_registry.stats,
+        "clients": clients.summary(),
+        "rate_limiter": rate_limiter.summary(),
+        "singleflight": {f.name: f.summary() for f in (pr_flights, refactor_flights, issue_flights)},
+    }
+
+def _numeric_stats(stats: dict, prefix=""):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _numeric_stats(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+metrics.gauge_collector(
+    "cache_stat", "Counters and sizes from /cache-stats, one series per cache and stat",
+    lambda: [({"cache": cache, "stat": stat}, value)
+             for cache, stats in collect_cache_stats().items()
+             for stat, value in _numeric_stats(stats)],
+)
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return collect_cache_stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition: HTTP, node, LLM and embedding timings, tokens, estimated cost and cache stats."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+async def traces(limit: int = 20, route: Optional[str] = None, min_ms: float = 0):
+    """Most recent request traces with their graph, node, LLM and embedding spans, newest first."""
+    selected = []
+    for trace in reversed(recent_traces):
+        summary = trace.to_dict()
+        if route and trace.root.attributes.get("route") != route:
+            continue
+        if (summary["duration_ms"] or 0) < min_ms:
+            continue
+        selected.append(summary)
+        if len(selected) >= limit:
+            break
+    return {"traces": selected}
+
+@app.get("/ci-failure-signatures")
+async def ci_failure_signatures(account_id: str, repo: Optional[str] = None, limit: int = 20):
+    """An account's most frequent CI failure signatures with their cached explanation and failure count."""
+    return {"signatures": signature_cache.top(account_id, repo, limit)}
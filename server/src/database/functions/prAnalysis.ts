@@ -1,5 +1,10 @@
 import { PRAnalysis } from '../../models/PRAnalysis.ts';
 
+export interface AnalysisSnapshot {
+  description_hash: string;
+  files: { filename: string; patch_hash: string }[];
+}
+
 export interface PRAnalysisData {
   accountId: number;
   owner: string;
@@ -13,6 +18,8 @@ export interface PRAnalysisData {
     checklist: string;
     affected_modules: string;
     matched_issues: string;
+    labels?: string;
+    snapshot?: AnalysisSnapshot;
   };
   commentId?: number;
   cicommentId?: number;
@@ -165,7 +172,8 @@ export const updatePRAnalysisRefactorSuggestions = async (
   owner: string,
   repo: string,
   prNumber: number,
-  refactorSuggestions: any[]
+  refactorSuggestions: any[],
+  refactorSnapshot: AnalysisSnapshot | null = null
 ) => {
   try {
     // Clear existing refactor suggestions and add new ones
@@ -191,6 +199,7 @@ export const updatePRAnalysisRefactorSuggestions = async (
       {
         $set: {
           refactorSuggestions: refactorSuggestionsMap,
+          refactorSnapshot,
           updatedAt: new Date()
         }
       },
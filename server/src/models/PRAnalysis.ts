@@ -1,5 +1,14 @@
 import mongoose from 'mongoose';
 
+// What the agent analyzed: lets the next push re-analyze only the files whose patch changed
+const snapshotSchema = new mongoose.Schema({
+  description_hash: String,
+  files: [new mongoose.Schema({
+    filename: String,
+    patch_hash: String
+  }, { _id: false })]
+}, { _id: false });
+
 // PR Analysis Schema
 const prAnalysisSchema = new mongoose.Schema({
   accountId: {
@@ -29,6 +38,8 @@ const prAnalysisSchema = new mongoose.Schema({
     suggested_tests: String,
     checklist: String,
     affected_modules: String,
+    labels: String,
+    snapshot: snapshotSchema,
   },
   refactorSuggestions: {
     type: Map,
@@ -65,6 +76,10 @@ const prAnalysisSchema = new mongoose.Schema({
     type: String,
     default: null
   },
+  refactorSnapshot: {
+    type: snapshotSchema,
+    default: null
+  },
   createdAt: {
     type: Date,
     default: Date.now
@@ -96,7 +96,8 @@ router.get('/get-issue-agent', requireAuth, async (req, res) => {
     // 2. Send to Python FastAPI Issue Agent
     const response = await axios.post("http://localhost:8000/analyze-issue", {
       issue_title: issue.data.title,
-      issue_body: issue.data.body || ""
+      issue_body: issue.data.body || "",
+      account_id: String(accountId),
     });
 
     // 3. Save the analysis result
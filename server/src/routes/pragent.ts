@@ -114,6 +114,7 @@ router.get('/get-pr-agent', requireAuth, async (req, res) => {
         pr_title: pr.data.title,
         pr_body: pr.data.body || "",
         changed_files: changedFiles,
+        account_id: accountId.toString(),
       });
 
       // 5. Save the analysis result
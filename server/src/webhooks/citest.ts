@@ -71,13 +71,15 @@ async function downloadAndExtractLogText(zipUrl: string): Promise<string> {
   }
 }
 
-async function classifyLog(logText: string): Promise<ClassifyResponse> {
+async function classifyLog(logText: string, accountId: number, repoFullName: string): Promise<ClassifyResponse> {
   try {
     console.log("🤖 Sending log to Python agent for classification");
-    const classifyResp = await fetch(PYTHON_AGENT_URL, {
+    // Send the raw log so the agent can reduce it as it streams in; cached explanations are scoped per account and repo
+    const params = new URLSearchParams({ account_id: String(accountId), repo: repoFullName });
+    const classifyResp = await fetch(`${PYTHON_AGENT_URL}?${params}`, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ log_text: logText }),
+      headers: { "Content-Type": "text/plain; charset=utf-8" },
+      body: logText,
     });
 
     if (!classifyResp.ok) {
@@ -225,7 +227,7 @@ export function setupCITestWebhooks(webhooks: Webhooks) {
           });
 
           const logText = await downloadAndExtractLogText(logUrl);
-          const classifyData = await classifyLog(logText);
+          const classifyData = await classifyLog(logText, accountId, `${owner}/${repo}`);
 
           // Add to aggregated comment
           aggregatedBody += `❌ **${job.name}** failed\n`;
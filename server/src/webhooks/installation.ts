@@ -7,6 +7,25 @@ import { Octokit } from "@octokit/rest";
 import { createAppAuth } from "@octokit/auth-app";
 import { config } from '../config/config.ts';
 import RepoFileList from '../models/RepoFileList.ts';
+import axios from "axios";
+
+const PYTHON_INDEXER_URL = "http://localhost:8000/index-repo";
+
+// Ask the agent to (re)index a repo's code chunks; runs in the background on the agent side
+async function requestRepoIndex(body: {
+  account_id: string,
+  repo: string,
+  owner: string,
+  installation_id: number,
+  changed_paths?: string[],
+  removed_paths?: string[],
+}) {
+  try {
+    await axios.post(PYTHON_INDEXER_URL, body);
+  } catch (err) {
+    console.error(`❌ Failed to queue code index for ${body.repo}:`, err);
+  }
+}
 
 async function getInstallationOctokit(installationId: number) {
   const octokit = new Octokit({
@@ -95,6 +114,12 @@ export function setupInstallationWebhooks(webhooks: Webhooks) {
             { upsert: true, new: true }
           );
           console.log(`✅ Updated file list for ${repoObj.full_name} (${filepaths.length} files)`);
+          await requestRepoIndex({
+            account_id: accountId.toString(),
+            repo: repoObj.full_name,
+            owner,
+            installation_id: installationId,
+          });
         }
       }
       // === END NEW ===
@@ -123,6 +148,8 @@ export function setupInstallationWebhooks(webhooks: Webhooks) {
       if (branch === defaultBranch) {
         // Check if any files were added or removed in this push
         let hasFileChanges = false;
+        const changedPaths = new Set<string>();
+        const removedPaths = new Set<string>();
 
         // Check all commits in this push for file changes
         if (payload.commits && Array.isArray(payload.commits)) {
@@ -135,9 +162,31 @@ export function setupInstallationWebhooks(webhooks: Webhooks) {
             if (commit.removed && commit.removed.length > 0) {
               hasFileChanges = true;
             }
+            //@ts-ignore
+            for (const path of [...(commit.added || []), ...(commit.modified || [])]) {
+              changedPaths.add(path);
+              removedPaths.delete(path);
+            }
+            //@ts-ignore
+            for (const path of commit.removed || []) {
+              removedPaths.add(path);
+              changedPaths.delete(path);
+            }
           }
         }
 
+        // Keep the agent's code index current for every changed file
+        if (changedPaths.size > 0 || removedPaths.size > 0) {
+          await requestRepoIndex({
+            account_id: accountId.toString(),
+            repo: repoFullName,
+            owner,
+            installation_id: installationId,
+            changed_paths: [...changedPaths],
+            removed_paths: [...removedPaths],
+          });
+        }
+
         // Only update file list if files were actually added or removed
         if (hasFileChanges) {
           console.log(`📁 File changes detected in ${repoFullName}:`);
@@ -129,6 +129,7 @@ async function analyzeAndSaveIssue(
     const analysisResponse = await axios.post("http://localhost:8000/analyze-issue", {
       issue_title: issueTitle,
       issue_body: issueBody,
+      account_id: String(accountId),
     });
 
     const analysis = analysisResponse.data;
@@ -191,6 +191,14 @@ async function analyzeAndSavePR(
     }
     console.log("now doing analysis______________________________")
 
+    // Send the last analysis back so the agent only re-analyzes the files changed since then
+    const previous = lastAnalysis?.toObject({ flattenMaps: true });
+    const previousAnalysis = previous?.analysis?.snapshot ? previous.analysis : undefined;
+    const previousRefactor = previous?.refactorSnapshot ? {
+      refactor_suggestions: Object.values(previous.refactorSuggestions || {}),
+      snapshot: previous.refactorSnapshot,
+    } : undefined;
+
     // Run both PR analysis and refactor analysis in parallel
     console.log("Making requests to agent endpoints...");
     const [analysisResponse, refactorResponse] = await Promise.all([
@@ -198,11 +206,15 @@ async function analyzeAndSavePR(
         pr_title: prTitle,
         pr_body: prBody,
         changed_files: changedFiles,
+        account_id: accountId.toString(),
+        previous_analysis: previousAnalysis,
       }),
       axios.post("http://localhost:8000/analyze-refactor", {
         pr_title: prTitle,
         pr_body: prBody,
         changed_files: changedFiles,
+        account_id: accountId.toString(),
+        previous_analysis: previousRefactor,
       })
     ]).catch(error => {
       console.error("Error calling agent endpoints:", error);
@@ -269,11 +281,15 @@ async function analyzeAndSavePR(
       if (refactorCommentId && !savedAnalysis.refactorCommentId) {
         await updatePRAnalysisRefactorCommentId(accountId, owner, repoName, prNumber, refactorCommentId);
       }
-
-      // Save refactor suggestions to database
-      await updatePRAnalysisRefactorSuggestions(accountId, owner, repoName, prNumber, refactorAnalysis.refactor_suggestions);
     }
 
+    // Save refactor suggestions (even none) with the snapshot the next push is compared against
+    await updatePRAnalysisRefactorSuggestions(
+      accountId, owner, repoName, prNumber,
+      refactorAnalysis.refactor_suggestions || [],
+      refactorAnalysis.snapshot || null
+    );
+
     // === LABEL SYNC LOGIC ===
     try {
       // Fetch current labels on the PR